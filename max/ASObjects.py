@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 from max.MADObjects import MADDict
-from max.utils.formatting import findHashtags
+from max.utils.entities import extract_entities
 from max.utils.formatting import findKeywords
 from max.utils.formatting import formatMessageEntities
 
@@ -59,15 +59,16 @@ class Note(ASObject):
         self.data = data
         if creating:
             self.processFields()
-            self.data['content'] = formatMessageEntities(request, self.data.get('content', ''))
-            hashtags = findHashtags(self.data['content'])
-            if hashtags:
-                self.data['_hashtags'] = hashtags
-            self.setKeywords()
+            content = self.data.get('content', '')
+            entities = extract_entities(content)
+            self.data['content'] = formatMessageEntities(request, content, entities.urls)
+            if entities.hashtags:
+                self.data['_hashtags'] = entities.hashtags
+            self.setKeywords(entities.keywords)
         self.update(self.data)
 
-    def setKeywords(self):
-        self['_keywords'] = findKeywords(self.data['content'])
+    def setKeywords(self, keywords=None):
+        self['_keywords'] = findKeywords(self.data['content']) if keywords is None else keywords
 
 
 class Comment(ASObject):
@@ -101,11 +102,12 @@ class Comment(ASObject):
         self.data = data
         if creating:
             self.processFields()
-            self.data['content'] = formatMessageEntities(self.request, self.data.get('content', ''))
-            hashtags = findHashtags(self.data['content'])
-            if hashtags:
-                self.data['_hashtags'] = hashtags
-            self.setKeywords()
+            content = self.data.get('content', '')
+            entities = extract_entities(content)
+            self.data['content'] = formatMessageEntities(self.request, content, entities.urls)
+            if entities.hashtags:
+                self.data['_hashtags'] = entities.hashtags
+            self.setKeywords(entities.keywords)
         else:
             existing_id = self.data.pop('id', None)
             if existing_id:
@@ -152,8 +154,8 @@ class Comment(ASObject):
         else:
             raise KeyError(key)
 
-    def setKeywords(self):
-        self['_keywords'] = findKeywords(self.data['content'])
+    def setKeywords(self, keywords=None):
+        self['_keywords'] = findKeywords(self.data['content']) if keywords is None else keywords
 
 
 class Conversation(ASObject):
@@ -274,12 +276,13 @@ class Image(File):
         self.data = data
         if creating:
             self.processFields()
-            self.data['content'] = formatMessageEntities(request, self.data.get('content', ''))
-            hashtags = findHashtags(self.data['content'])
-            if hashtags:
-                self.data['_hashtags'] = hashtags
-            self.setKeywords()
+            content = self.data.get('content', '')
+            entities = extract_entities(content)
+            self.data['content'] = formatMessageEntities(request, content, entities.urls)
+            if entities.hashtags:
+                self.data['_hashtags'] = entities.hashtags
+            self.setKeywords(entities.keywords)
         self.update(self.data)
 
-    def setKeywords(self):
-        self['_keywords'] = findKeywords(self.data['content'])
+    def setKeywords(self, keywords=None):
+        self['_keywords'] = findKeywords(self.data['content']) if keywords is None else keywords
@@ -5,6 +5,7 @@ from max.exceptions import ObjectNotSupported
 from max.exceptions import ValidationError
 from max.utils.dicts import RUDict
 from max.utils.dicts import flatten
+from max.timing import timed_call
 from pyramid.security import ACLAllowed
 
 from bson import ObjectId
@@ -399,6 +400,7 @@ class MADBase(MADDict):
             # XXX TODO - Test it!!
             return None
 
+    @timed_call('serialization')
     def flatten(self, **kwargs):
         """
             Recursively transforms non-json-serializable values and simplifies
@@ -14,6 +14,7 @@ from gevent.monkey import patch_all
 patch_all()
 
 from max import debug
+from max import hubmonitor
 from max import mongoprobe
 from max.request import extract_post_data
 from max.request import get_database
@@ -57,6 +58,10 @@ PAGINATION_MODIFIERS = ['before', 'after', 'limit']
 SORTING_MODIFIERS = ['sort', 'priority']
 FILTERING_MODIFIERS = ['date_filter', 'hashtag', 'actor', 'keywords', 'tags', 'favorites', 'context_tags']
 SEARCH_MODIFIERS = PAGINATION_MODIFIERS + SORTING_MODIFIERS + FILTERING_MODIFIERS
+
+# Packages scanned for views on startup. Modules with views outside of them
+# are never registered, test_routes_have_views checks every route has views
+SCANNED_PACKAGES = ['max.rest', 'max.exceptions']
 import logging
 
 logger = logging.getLogger('exceptions')
@@ -75,6 +80,9 @@ def main(*args, **settings):
 
     # IMPORTANT NOTE !! Order matters! First tween added will be the first to be invoked
     settings['pyramid.tweens'] = [
+        'max.metrics.metrics_factory',
+        'max.timing.server_timing_factory',
+        'max.profiling.profiling_factory',
         'max.tweens.excview_tween_factory',
         'max.tweens.compatibility_checker_factory',
         'max.tweens.post_tunneling_factory',
@@ -82,6 +90,7 @@ def main(*args, **settings):
     ]
 
     debug.setup(settings)
+    hubmonitor.setup(settings)
     mongoprobe.setup(settings)
 
     config = Configurator(
@@ -134,7 +143,10 @@ def main(*args, **settings):
         route_params = {param: value for param, value in properties.items() if param in ['traverse']}
         config.add_route(name, properties.get('route'), **route_params)
 
-    config.scan('max', ignore=['max.tests'])
+    # Only the packages with decorated views are scanned, to avoid
+    # importing all the modules of max on startup
+    for package in SCANNED_PACKAGES:
+        config.scan(package)
     set_signal()
 
     # Create exceptions log folfer if it doesnt exists
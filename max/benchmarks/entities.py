@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+    Benchmark of the extraction of urls, hashtags and keywords from activity contents.
+
+    Compares the single pass extractor against the previous pipeline, that
+    searched the text once for each kind of entity, over a generated corpus of
+    catalan, spanish and english texts with hashtags and links. Also checks that
+    both find the same entities.
+
+    Run it with: python -m max.benchmarks.entities [texts] [rounds]
+"""
+from max.utils.entities import UNICODE_ACCEPTED_CHARS
+from max.utils.entities import extract_entities
+
+import random
+import re
+import sys
+import time
+
+LEGACY_URL_REGEX = r'((https?\:\/\/)|(www\.))(\S+)'
+LEGACY_URL_KEYWORDS_REGEX = r'((https?\:\/\/)|(www\.))(\S+)(\w{2,4})(:[0-9]+)?(\/|\/([\w#!:.?+=&%@!\-\/]))?'
+LEGACY_HASHTAGS_REGEX = r'(\s|^)#{1}([\w\-\_\.%s]+)' % UNICODE_ACCEPTED_CHARS
+LEGACY_KEYWORDS_REGEX = r'(\s|^)(?:#|\'|\"|\w\')?([\w\-\_\.%s]{3,})[\"\']?' % UNICODE_ACCEPTED_CHARS
+
+WORDS = u"""
+    Hola a tots avui hem fet la reunió del projecte d'innovació docent. L'escola està
+    preparant una jornada sobre l'ús de tecnologies. ¿Alguien sabe dónde está la sala?
+    Please check the slides, they're great! Àlex i Òscar han preparat el material.
+""".split()
+
+HASHTAGS = [u'#MAX', u'#upc', u'#Innovació', u'#ab', u'#reunió2016', u'#a.b-c']
+
+LINKS = [
+    u'http://www.businessinsider.com/r-for-egypts-entrepreneurs-going-green-makes-business-sense-2016-6',
+    u'https://example.com/path?x=1&y=2',
+    u'www.upc.edu',
+    u'(http://foo.com/bar)',
+    u'http://example.com.',
+    u'seehttp://example.com',
+    u'Visitwww.upc.edu'
+]
+
+
+def legacy_extract_entities(text):
+    """
+        Extracts the entities as done before, with a search for each kind of entity
+    """
+    urls = [match.group(0) for match in re.finditer(LEGACY_URL_REGEX, text, flags=re.IGNORECASE)]
+    hashtags = [match.groups()[1].lower() for match in re.finditer(LEGACY_HASHTAGS_REGEX, text)]
+    stripped_urls = re.sub(LEGACY_URL_KEYWORDS_REGEX, '', text.lower())
+    keywords = [match.groups()[1] for match in re.finditer(LEGACY_KEYWORDS_REGEX, stripped_urls)]
+    return urls, hashtags, keywords
+
+
+def single_pass_extract_entities(text):
+    entities = extract_entities(text)
+    return [text[start:end] for start, end in entities.urls], entities.hashtags, entities.keywords
+
+
+def generate_corpus(size, seed=1):
+    """
+        Returns size random texts between 3 and 60 words long, with about
+        a 15% of the words being hashtags or links.
+    """
+    generator = random.Random(seed)
+    corpus = []
+    for i in range(size):
+        words = []
+        for j in range(generator.randint(3, 60)):
+            if generator.random() > 0.15:
+                words.append(generator.choice(WORDS))
+            else:
+                words.append(generator.choice(HASHTAGS + LINKS))
+        corpus.append(u' '.join(words))
+    return corpus
+
+
+def measure(extractor, corpus, rounds):
+    start = time.time()
+    for i in range(rounds):
+        for text in corpus:
+            extractor(text)
+    return time.time() - start
+
+
+def main(argv=sys.argv):
+    size = int(argv[1]) if len(argv) > 1 else 3000
+    rounds = int(argv[2]) if len(argv) > 2 else 5
+    corpus = generate_corpus(size)
+
+    differences = [text for text in corpus if legacy_extract_entities(text) != single_pass_extract_entities(text)]
+    print 'Texts: {}, rounds: {}, texts with different entities: {}'.format(size, rounds, len(differences))
+    for text in differences[:5]:
+        print repr(text)
+
+    legacy = measure(legacy_extract_entities, corpus, rounds)
+    single_pass = measure(single_pass_extract_entities, corpus, rounds)
+    print 'legacy:      {:.3f}s'.format(legacy)
+    print 'single pass: {:.3f}s ({:.0%} of legacy)'.format(single_pass, single_pass / legacy)
+
+
+if __name__ == '__main__':
+    main()
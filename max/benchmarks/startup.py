@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+    Benchmark of the application startup.
+
+    Measures, each one on a fresh interpreter, the time spent importing max
+    and its views, importing the libraries only used by some endpoints, and
+    looking up the max version, as done on each rabbitmq connection. If a
+    config file is given, also measures the time spent creating the wsgi
+    application from it, which needs the mongodb server configured there.
+
+    Run it with: python -m max.benchmarks.startup [config.ini] [rounds]
+"""
+import os
+import subprocess
+import sys
+
+MEASURE_TEMPLATE = """
+import time
+start = time.time()
+{}
+print time.time() - start
+"""
+
+# Name, setup not measured and code measured
+MEASURES = [
+    ('import max', '', 'import max'),
+    ('import max views', 'import max', 'import max.rest'),
+    ('import PIL', '', 'from PIL import Image'),
+    ('import tweepy', '', 'import tweepy'),
+    ('import requests', '', 'import requests'),
+    ('100 versions (require)', 'import pkg_resources', '[pkg_resources.require("max")[0].version for i in range(100)]'),
+    ('100 versions (cached)', 'from max.resources import getMAXVersion', '[getMAXVersion() for i in range(100)]'),
+]
+
+
+def measure(code, setup='', rounds=5):
+    """
+        Returns the best time of running code on a new interpreter, after setup
+    """
+    times = []
+    for i in range(rounds):
+        output = subprocess.check_output([sys.executable, '-c', setup + '\n' + MEASURE_TEMPLATE.format(code)])
+        times.append(float(output.strip().splitlines()[-1]))
+    return min(times)
+
+
+def main(argv=sys.argv):
+    config = os.path.abspath(argv[1]) if len(argv) > 1 and argv[1] else None
+    rounds = int(argv[2]) if len(argv) > 2 else 5
+
+    for name, setup, code in MEASURES:
+        try:
+            print '{:<25} {:.3f}s'.format(name, measure(code, setup=setup, rounds=rounds))
+        except subprocess.CalledProcessError:
+            print '{:<25} failed'.format(name)
+
+    if config:
+        # Libraries are imported beforehand, so only the configuration is measured
+        setup = 'import max\nfrom paste.deploy import loadapp'
+        print '{:<25} {:.3f}s'.format('configure app', measure("loadapp('config:{}')".format(config), setup=setup, rounds=rounds))
+
+
+if __name__ == '__main__':
+    main()
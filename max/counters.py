@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+    Counters of posts and comments, maintained on each insert and delete.
+
+    HEAD requests to the activity and comment listings, when not filtered,
+    are answered from these counters instead of counting the matching
+    documents. A counter is created from an exact count the first time it's
+    needed, and only incremented or decremented afterwards. Counters of
+    contexts and users are always used, global counters only when asked for
+    an `estimated` count.
+
+    Once a counter exists, increments are its only writes. Posts or comments
+    added or removed while a missing counter is being counted may be left out
+    of it, as the counter doesn't exist yet to be incremented. Any counter can
+    be recounted asking for an `exact` count.
+"""
+from max.utils.ancestry import ancestor_hashes
+
+from pymongo import ReturnDocument
+from pyramid.settings import asbool
+
+COUNTERS_COLLECTION = 'counters'
+
+# Request params that filter the items of a listing, so its count can't be
+# answered from a counter
+FILTERING_PARAMS = ['before', 'after', 'date_filter', 'hashtag', 'actor', 'keyword', 'username', 'tags', 'favorites', 'context_tags', 'twitter_enabled', 'max_users']
+
+
+def context_activities_key(context_hash):
+    return u'context_activities:{}'.format(context_hash)
+
+
+def context_comments_key(context_hash):
+    return u'context_comments:{}'.format(context_hash)
+
+
+def user_comments_key(username):
+    return u'user_comments:{}'.format(username)
+
+
+def activity_counter_keys(activity):
+    """
+        Returns the keys of the counters that count an activity.
+
+        Context posts are counted on the counters of the context and of all
+        its ancestors, as listings of a context include the posts of all its
+        child contexts.
+    """
+    if activity.get('verb') == 'post':
+        keys = [u'activities']
+        for context in activity.get('contexts', []):
+            # Activities stored before ancestors were kept don't have them yet
+            ancestors = context.get('_ancestors') or ancestor_hashes(context['url'])
+            keys.extend([context_activities_key(context_hash) for context_hash in ancestors])
+        return keys
+
+    elif activity.get('verb') == 'comment':
+        keys = [u'comments']
+        username = activity.get('actor', {}).get('username')
+        if username:
+            keys.append(user_comments_key(username))
+        for reply in activity.get('object', {}).get('inReplyTo', []):
+            keys.extend([context_comments_key(context_hash) for context_hash in reply.get('contexts', [])])
+        return keys
+
+    return []
+
+
+class Counters(object):
+    """
+        The counters stored on a max database
+    """
+
+    def __init__(self, db):
+        self.collection = db[COUNTERS_COLLECTION]
+        self.activity = db.activity
+
+    def count(self, key, query, exact=False):
+        """
+            Returns the value of a counter. If the counter doesn't exist yet,
+            the activities matching the query are counted and the counter
+            created, unless it was created meanwhile. If an exact count is
+            requested, the counter is set again.
+        """
+        if not exact:
+            counter = self.collection.find_one({'_id': key})
+            if counter is not None:
+                return counter['count']
+
+        count = self.activity.find(query).count()
+        if exact:
+            self.collection.update_one({'_id': key}, {'$set': {'count': count}}, upsert=True)
+            return count
+
+        counter = self.collection.find_one_and_update(
+            {'_id': key},
+            {'$setOnInsert': {'count': count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return counter['count']
+
+    def increment(self, keys, amount=1):
+        """
+            Increments the existing counters among keys. Counters not yet
+            created will get the right value when counted.
+        """
+        if keys:
+            self.collection.update_many({'_id': {'$in': keys}}, {'$inc': {'count': amount}})
+
+    def reset(self, prefix=None):
+        """
+            Removes all the counters, or only the ones with keys starting with
+            prefix, so they are counted again when needed.
+        """
+        query = {'_id': {'$regex': u'^{}'.format(prefix)}} if prefix else {}
+        self.collection.delete_many(query)
+
+
+def counted_request(request, estimated=False):
+    """
+        Checks if a request asks for the count of a listing without filters.
+        Global counts, with estimated=True, are only answered from counters
+        when the request asks for an `estimated` count.
+    """
+    if request.method != 'HEAD' or [param for param in FILTERING_PARAMS if param in request.params]:
+        return False
+    return not estimated or asbool(request.params.get('estimated', False))
+
+
+def get_count(request, key, query):
+    """
+        Returns the count of a listing from its counter. With the `exact`
+        request param, activities are counted and the counter set again.
+    """
+    exact = asbool(request.params.get('exact', False))
+    return Counters(request.db.db).count(key, query, exact=exact)
@@ -8,13 +8,15 @@ def patched_check_token(*args, **kwargs):
 
 def browser_debug_factory(handler, registry):
     def browser_debug_tween(request):
-        debug = request.params.get('d', None)
+        # Debug params are only looked for in the query string, so
+        # requests not being debugged are left untouched
+        debug = request.GET.get('d', None)
         debugging = debug is not None
         if debugging:
-            user = request.params.get('u', None)
-            token = request.params.get('t', 'fake_token')
-            method = request.params.get('m', '').upper()
-            payload = request.params.get('p', None)
+            user = request.GET.get('u', None)
+            token = request.GET.get('t', 'fake_token')
+            method = request.GET.get('m', '').upper()
+            payload = request.GET.get('p', None)
 
             if user:
                 new_headers = {
@@ -30,8 +32,9 @@ def browser_debug_factory(handler, registry):
                 if payload:
                     request.text = payload
 
-        request.body = unquote_plus(request.body).strip('=')
-        request.headers['Content-Type'] = 'application/json'
+            request.body = unquote_plus(request.body).strip('=')
+            request.headers['Content-Type'] = 'application/json'
+
         response = handler(request)
 
         if debug == '1' and user:
@@ -45,7 +48,8 @@ def browser_debug_factory(handler, registry):
 def setup(settings):
     if asbool(settings['max.debug_api']):
         if asbool(settings.get('testing', False)):  # pragma: no cover
-            settings['pyramid.tweens'].insert(1, 'max.debug.browser_debug_factory')
+            position = settings['pyramid.tweens'].index('max.tweens.excview_tween_factory') + 1
+            settings['pyramid.tweens'].insert(position, 'max.debug.browser_debug_factory')
         else:  # pragma: no cover
             settings['pyramid.tweens'].append('max.debug.browser_debug_factory')
 
@@ -1,13 +1,15 @@
 # -*- coding: utf-8 -*-
-import re
 from hashlib import sha1
 
-people_resource_matcher = re.compile(r'/people/([^\/]+)$').search
-people_subscriptions_resource_matcher = re.compile(r'/people/([^\/]+)/subscriptions$').search
-people_subscription_resource_matcher = re.compile(r'/people/([^\/]+)/subscriptions/([^\/]+)$').search
-people_activities_resource_matcher = re.compile(r'/people/([^\/]+)/activities$').search
-people_conversation_resource_matcher = re.compile(r'/people/([^\/]+)/conversations/([^\/]+)$').search
-people_device_token_resource_matcher = re.compile(r'/people/([^\/]+)/device/([^\/]+)/([^\/]+)$').search
+import re
+import threading
+
+people_resource_matcher = re.compile(r'/people/([^\/]+)$')
+people_subscriptions_resource_matcher = re.compile(r'/people/([^\/]+)/subscriptions$')
+people_subscription_resource_matcher = re.compile(r'/people/([^\/]+)/subscriptions/([^\/]+)$')
+people_activities_resource_matcher = re.compile(r'/people/([^\/]+)/activities$')
+people_conversation_resource_matcher = re.compile(r'/people/([^\/]+)/conversations/([^\/]+)$')
+people_device_token_resource_matcher = re.compile(r'/people/([^\/]+)/device/([^\/]+)/([^\/]+)$')
 
 
 def fix_deprecated_create_user(request, match):
@@ -288,30 +290,87 @@ def fix_deprecated_delete_token(request, match):
     request.headers['Content-Type'] = 'application/json'
 
 
-def check_deprecation(request, pattern, action):
+class DeprecationTable(object):
     """
-        Applies a deprecation fix
+        The deprecations of a request method, compiled into a single regex.
+
+        Paths without the prefix shared by all deprecated routes are rejected
+        without searching, and the others with a single search. Only when a
+        deprecated route matches, its own matcher is applied at the same
+        position to extract the arguments of the fix. Counts how many times each deprecated route is
+        used, to know when it can be retired.
     """
-    match = pattern(request.path_info)
-    if match:
-        response_wrapper = action(request, match)
-        return True, response_wrapper
 
-    return False, None
+    def __init__(self, method, deprecations, prefix='/people/'):
+        self.method = method
+        self.deprecations = deprecations
+        self.prefix = prefix
+        self.regex = re.compile('|'.join([
+            '(?P<deprecation{}>{})'.format(index, matcher.pattern)
+            for index, (route, matcher, action) in enumerate(deprecations)
+        ]))
+        self.counts = dict([(route, 0) for route, matcher, action in deprecations])
+        self.lock = threading.Lock()
+
+    def apply(self, request):
+        """
+            Applies the fix of the deprecated route matching the request, if any.
+            Returns the response wrapper of the fix, or None.
+        """
+        path = request.path_info
+        if self.prefix not in path:
+            return None
+
+        found = self.regex.search(path)
+        if found is None:
+            return None
 
-# PLEASE! Construct depreaction list sorted by matching frequency, so deprecations expected
-# to happen more frequently that others go first. This is to minimize the number of deprecations tested
+        route, matcher, action = self.deprecations[int(found.lastgroup[len('deprecation'):])]
+        wrapper = action(request, matcher.match(path, found.start()))
+
+        # Some fixes leave requests to routes still in use untouched,
+        # so only the requests actually rewritten are counted
+        if request.path_info != path:
+            with self.lock:
+                self.counts[route] += 1
+        return wrapper
+
+    def usage(self):
+        """
+            Returns how many times each deprecated route has been used
+        """
+        with self.lock:
+            return [
+                {'method': self.method, 'route': route, 'count': self.counts[route]}
+                for route, matcher, action in self.deprecations
+            ]
+
+# Deprecations are tested all at once, if more than one could match a path
+# the first one on the list wins.
 
 POST_DEPRECATIONS = [
-    (people_activities_resource_matcher, fix_deprecated_create_context_activity),
-    (people_subscriptions_resource_matcher, fix_deprecated_subscribe_user),
-    (people_resource_matcher, fix_deprecated_create_user),
-    (people_conversation_resource_matcher, fix_deprecated_join_conversation),
-    (people_device_token_resource_matcher, fix_deprecated_add_token)
+    ('/people/{username}/activities', people_activities_resource_matcher, fix_deprecated_create_context_activity),
+    ('/people/{username}/subscriptions', people_subscriptions_resource_matcher, fix_deprecated_subscribe_user),
+    ('/people/{username}', people_resource_matcher, fix_deprecated_create_user),
+    ('/people/{username}/conversations/{id}', people_conversation_resource_matcher, fix_deprecated_join_conversation),
+    ('/people/{username}/device/{platform}/{token}', people_device_token_resource_matcher, fix_deprecated_add_token)
 ]
 
 DELETE_DEPRECATIONS = [
-    (people_subscription_resource_matcher, fix_deprecated_unsubscribe_user),
-    (people_conversation_resource_matcher, fix_deprecated_leave_conversation),
-    (people_device_token_resource_matcher, fix_deprecated_delete_token)
+    ('/people/{username}/subscriptions/{hash}', people_subscription_resource_matcher, fix_deprecated_unsubscribe_user),
+    ('/people/{username}/conversations/{id}', people_conversation_resource_matcher, fix_deprecated_leave_conversation),
+    ('/people/{username}/device/{platform}/{token}', people_device_token_resource_matcher, fix_deprecated_delete_token)
 ]
+
+
+def get_deprecations(registry):
+    """
+        Returns the deprecation tables of the application, by request method
+    """
+    deprecations = getattr(registry, 'deprecations', None)
+    if deprecations is None:
+        deprecations = registry.deprecations = {
+            'POST': DeprecationTable('POST', POST_DEPRECATIONS),
+            'DELETE': DeprecationTable('DELETE', DELETE_DEPRECATIONS)
+        }
+    return deprecations
@@ -45,5 +45,9 @@ class Forbidden(Exception):
     pass
 
 
+class Conflict(Exception):
+    pass
+
+
 class ConnectionError(Exception):
     pass
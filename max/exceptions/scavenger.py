@@ -28,6 +28,23 @@ END EXCEPTION REPORT
 ------------------------------------------------
 """
 
+PROFILE_TEMPLATE = u"""
+------------------------------------------------
+BEGIN PROFILE REPORT: {hash}
+MATCHED_ROUTE: {matched_route}
+DATE: {time}
+REQUEST:
+
+{raw_request}
+
+PROFILE:
+
+{profile}
+
+END PROFILE REPORT
+------------------------------------------------
+"""
+
 
 def format_raw_request(request):
     """
@@ -100,3 +117,30 @@ def saveException(request, error):
     )
     open(exception_filename, 'w').write(exception_log)
     return entry['hash'], exception_log
+
+
+def saveProfile(request, profile):
+    """
+        Stores a request profile report along with the logged exceptions
+    """
+    now = datetime.now()
+    matched_route = request.matched_route.name if request.matched_route else 'No route matched'
+
+    entry = dict(
+        profile=profile,
+        time=now.strftime('%Y/%m/%d %H:%M:%S'),
+        raw_request=format_raw_request(request),
+        matched_route=matched_route,
+    )
+
+    dump = json.dumps(entry)
+    entry['hash'] = sha1(dump).hexdigest()
+    profile_log = PROFILE_TEMPLATE.format(**entry)
+
+    profile_filename = '{folder}/profile_{date}_{hash}'.format(
+        folder=request.registry.settings.get('exceptions_folder'),
+        date=now.strftime('%Y%m%d%H%M%S'),
+        hash=entry['hash']
+    )
+    open(profile_filename, 'w').write(profile_log.encode('utf-8'))
+    return entry['hash'], profile_log
@@ -3,6 +3,7 @@
     Views to catch different exceptions across execution of a request
 """
 
+from max.exceptions import Conflict
 from max.exceptions import DuplicatedItemError
 from max.exceptions import Forbidden
 from max.exceptions import InvalidPermission
@@ -14,6 +15,7 @@ from max.exceptions import Unauthorized
 from max.exceptions import UnknownUserError
 from max.exceptions import ValidationError
 from max.exceptions.http import JSONHTTPBadRequest
+from max.exceptions.http import JSONHTTPConflict
 from max.exceptions.http import JSONHTTPForbidden
 from max.exceptions.http import JSONHTTPInternalServerError
 from max.exceptions.http import JSONHTTPNotFound
@@ -38,6 +40,11 @@ def forbidden(exc, request):
     return JSONHTTPForbidden(error=dict(objectType='error', error=Forbidden.__name__, error_description=exc.message))
 
 
+@view_config(context=Conflict)
+def conflict(exc, request):
+    return JSONHTTPConflict(error=dict(objectType='error', error=Conflict.__name__, error_description=exc.message))
+
+
 @view_config(context=UnknownUserError)
 def required_user(exc, request):
     return JSONHTTPBadRequest(error=dict(objectType='error', error=UnknownUserError.__name__, error_description=exc.message))
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+    Detection of greenlets blocking the gevent hub.
+
+    With gevent, a greenlet doing CPU heavy or blocking work without yielding
+    stalls all the other requests served by the worker. When enabled with
+    `max.enable_hub_monitor`, a native thread checks that greenlets keep
+    switching. If a greenlet other than the hub keeps running for more than
+    `max.hub_monitor_threshold` milliseconds, its stack and the route of the
+    request it serves are logged. Blocks are counted by route and blocking
+    code location, and their duration is added once the greenlet yields.
+"""
+from bisect import bisect_left
+from datetime import datetime
+from gevent import get_hub
+from gevent import getcurrent
+from gevent.monkey import get_original
+from pyramid.settings import asbool
+
+import greenlet
+import logging
+import sys
+import time
+import traceback
+
+logger = logging.getLogger('max')
+
+# Upper bounds in milliseconds of the blocking time histogram buckets
+BLOCKING_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Number of stack frames of the blocking greenlet logged
+STACK_LIMIT = 30
+
+monitor_started = []
+
+
+def blocking_location(frame):
+    """
+        Returns the innermost location of the application code in a stack,
+        or the innermost one if no code of the application is found.
+    """
+    innermost = None
+    while frame is not None:
+        location = '{}:{} ({})'.format(frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name)
+        innermost = innermost or location
+        if '/max/' in frame.f_code.co_filename:
+            return location
+        frame = frame.f_back
+    return innermost
+
+
+class BlockingStats(object):
+    """
+        Aggregated blocks of the hub by a route and code location
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.histogram = [0] * (len(BLOCKING_BUCKETS) + 1)
+        self.stack = None
+
+    def add(self, seconds):
+        millis = seconds * 1000
+        self.count += 1
+        self.total += millis
+        self.max = max(self.max, millis)
+        self.histogram[bisect_left(BLOCKING_BUCKETS, millis)] += 1
+
+    def format(self):
+        bucket_names = ['<={}ms'.format(bound) for bound in BLOCKING_BUCKETS] + ['>{}ms'.format(BLOCKING_BUCKETS[-1])]
+        return {
+            'count': self.count,
+            'time_total': round(self.total, 3),
+            'time_max': round(self.max, 3),
+            'time_average': round(self.total / self.count, 3) if self.count else 0,
+            'histogram': dict(zip(bucket_names, self.histogram)),
+            'stack': self.stack
+        }
+
+
+class HubMonitor(object):
+    """
+        Watches the greenlet switches of the hub thread from a native thread.
+
+        Switches are traced with greenlet.settrace. The monitor thread wakes
+        up every half threshold, and reports a block when the same greenlet
+        has been running since more than the threshold.
+    """
+
+    def __init__(self, enabled=False, threshold=100):
+        self.enabled = enabled
+        self.threshold = threshold / 1000.
+        self.started = False
+        self.switches = 0
+        self.switched_at = time.time()
+        self.active = None
+        self.blocking = None
+        self.reset()
+
+    def reset(self):
+        self.since = datetime.utcnow()
+        self.blocks = {}
+
+    def start(self):
+        """
+            Starts tracing the switches of the calling thread, where the hub
+            runs, and the native monitor thread. Only starts once per process.
+        """
+        if not self.enabled or monitor_started:
+            return
+
+        monitor_started.append(self)
+        self.started = True
+        self.hub = get_hub()
+        self.hub_thread = get_original('thread', 'get_ident')()
+        self.sleep = get_original('time', 'sleep')
+        greenlet.settrace(self.trace)
+        get_original('thread', 'start_new_thread')(self.monitor, ())
+
+    def trace(self, event, args):
+        if event not in ('switch', 'throw'):
+            return
+        now = time.time()
+        blocking = self.blocking
+        if blocking is not None:
+            self.blocking = None
+            blocking.add(now - self.switched_at)
+        self.switches += 1
+        self.switched_at = now
+        self.active = args[1]
+
+    def monitor(self):
+        checked = None
+        while True:
+            self.sleep(self.threshold / 2)
+            switches, active = self.switches, self.active
+            if switches == checked or active is None or active is self.hub:
+                continue
+            blocked = time.time() - self.switched_at
+            if blocked < self.threshold:
+                continue
+            checked = switches
+            try:
+                self.report(active, blocked, switches)
+            except Exception:
+                logger.exception('Error reporting a blocked gevent hub')
+
+    def report(self, greenlet, blocked, switches):
+        """
+            Logs the stack of the greenlet blocking the hub, and keeps the
+            statistics of the block to be completed on its next switch.
+        """
+        frame = sys._current_frames().get(self.hub_thread)
+        # Skip the monitor itself, when reporting from the hub thread
+        while frame is not None and frame.f_code is self.report.__func__.__code__:
+            frame = frame.f_back
+        if frame is None:
+            return
+        request = getattr(greenlet, 'max_request', None)
+        route = request.matched_route.pattern if getattr(request, 'matched_route', None) else None
+        method = request.method if request is not None else None
+        location = blocking_location(frame)
+        stack = ''.join(traceback.format_stack(frame, STACK_LIMIT))
+
+        logger.warning('Gevent hub blocked for more than {:.0f}ms by {} {} at {}\n{}'.format(blocked * 1000, method, route, location, stack))
+
+        key = (route, method, location)
+        stats = self.blocks.get(key)
+        if stats is None:
+            stats = self.blocks[key] = BlockingStats()
+        stats.stack = stack
+        # The block is accounted on the next switch, unless already over
+        if self.switches == switches:
+            self.blocking = stats
+
+    def format(self):
+        blocks = [
+            dict(route=route, method=method, location=location, **stats.format())
+            for (route, method, location), stats in self.blocks.items()
+            if stats.count
+        ]
+        return {
+            'enabled': self.enabled and self.started,
+            'since': self.since.isoformat(),
+            'threshold': self.threshold * 1000,
+            'blocks': sorted(blocks, key=lambda block: block['time_total'], reverse=True)
+        }
+
+
+def get_hub_monitor(registry):
+    """
+        Returns the hub monitor of the application
+    """
+    monitor = getattr(registry, 'hub_monitor', None)
+    if monitor is None:
+        settings = registry.settings or {}
+        monitor = registry.hub_monitor = HubMonitor(
+            enabled=asbool(settings.get('max.enable_hub_monitor', False)),
+            threshold=float(settings.get('max.hub_monitor_threshold', 100)))
+    return monitor
+
+
+def hub_monitor_factory(handler, registry):
+    monitor = get_hub_monitor(registry)
+    monitor.start()
+
+    def hub_monitor_tween(request):
+        current = getcurrent()
+        current.max_request = request
+        try:
+            return handler(request)
+        finally:
+            current.max_request = None
+
+    return hub_monitor_tween
+
+
+def setup(settings):
+    """
+        Adds the tween tagging the greenlets with the request they serve,
+        right after the metrics tween, if the hub monitor is enabled.
+    """
+    if asbool(settings.get('max.enable_hub_monitor', False)):
+        position = settings['pyramid.tweens'].index('max.metrics.metrics_factory') + 1
+        settings['pyramid.tweens'].insert(position, 'max.hubmonitor.hub_monitor_factory')
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+    Chunked and resumable execution of maintenance jobs.
+
+    A maintenance job is a list of steps, each one iterating a collection in
+    chunks of documents ordered by _id. After each chunk is processed and its
+    bulk writes are performed, a checkpoint with the last processed _id is stored
+    in the maintenance_jobs collection, so an interrupted job can be resumed from
+    there by any process, either inline on a request or on a separate worker.
+"""
+from max import maxlogger
+from max.exceptions import ObjectNotFound
+from max.maintenance.jobs import MAINTENANCE_JOBS
+from max.utils.dates import datetime_to_rfc3339
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING
+from pymongo import DESCENDING
+from pymongo import ReturnDocument
+
+from datetime import datetime
+from datetime import timedelta
+from uuid import uuid4
+
+import os
+import socket
+
+MAINTENANCE_CHUNK_SIZE = 500
+MAINTENANCE_JOB_LEASE = 300
+
+
+class MaintenanceJobInterrupted(Exception):
+    """
+        The job was claimed by another worker while running
+    """
+
+
+def get_jobs_collection(request):
+    return request.db.db.maintenance_jobs
+
+
+def get_worker_id():
+    """
+        Returns a new id identifying a single run of jobs, unique across
+        hosts, processes and the requests served by a process.
+    """
+    return '{}:{}:{}'.format(socket.gethostname(), os.getpid(), uuid4().hex)
+
+
+def get_step_query(step, last_id=None):
+    """
+        Returns the query to fetch the documents of a step, starting after last_id
+    """
+    if last_id is None:
+        return step.query
+    return {'$and': [step.query, {'_id': {'$gt': last_id}}]}
+
+
+def create_job(request, name, worker=None):
+    """
+        Creates a new maintenance job.
+
+        If a worker is given, the job is created already claimed by it, otherwise
+        it will remain pending until a worker claims it.
+    """
+    steps = MAINTENANCE_JOBS[name]
+    now = datetime.utcnow()
+    job = {
+        'name': name,
+        'status': 'running' if worker else 'pending',
+        'worker': worker,
+        'step': 0,
+        'last_id': None,
+        'processed': 0,
+        'total': sum([request.db.db[step.collection].find(step.query).count() for step in steps]),
+        'created': now,
+        'heartbeat': now,
+        'finished': None,
+        'error': None
+    }
+    job['_id'] = get_jobs_collection(request).insert_one(job).inserted_id
+    return job
+
+
+def get_job(request, job_id):
+    """
+        Returns a maintenance job, given its id as a string
+    """
+    try:
+        job = get_jobs_collection(request).find_one({'_id': ObjectId(job_id)})
+    except InvalidId:
+        job = None
+
+    if job is None:
+        raise ObjectNotFound('There is no maintenance job with id {}'.format(job_id))
+    return job
+
+
+def get_jobs(request, limit=10):
+    """
+        Returns the most recent maintenance jobs
+    """
+    return list(get_jobs_collection(request).find().sort('_id', DESCENDING).limit(limit))
+
+
+def claim_job(request, worker, job_id=None, lease=MAINTENANCE_JOB_LEASE):
+    """
+        Claims a job for a worker.
+
+        Pending jobs, and running jobs whose worker hasn't stored any checkpoint
+        for longer than the lease, are considered available. If no job_id is given
+        the oldest available job is claimed. Returns None if there is no job to claim.
+    """
+    available = [
+        {'status': 'pending'},
+        {'status': 'running', 'heartbeat': {'$lt': datetime.utcnow() - timedelta(seconds=lease)}},
+    ]
+    query = {'$or': available}
+
+    # Failed jobs are only resumed when explicitly requested
+    if job_id is not None:
+        available.append({'status': 'failed'})
+        query['_id'] = job_id
+
+    return get_jobs_collection(request).find_one_and_update(
+        query,
+        {'$set': {'status': 'running', 'worker': worker, 'heartbeat': datetime.utcnow(), 'error': None}},
+        sort=[('_id', ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def process_step(request, step, last_id=None, chunk_size=MAINTENANCE_CHUNK_SIZE, min_id=None, max_id=None):
+    """
+        Processes the documents of a step in chunks, starting after last_id and
+        optionally bounded to a range of _ids.
+
+        Yields the last processed _id and the number of documents after each chunk.
+    """
+    collection = request.db.db[step.collection]
+    bounds = {}
+    if min_id is not None:
+        bounds['$gte'] = min_id
+    if max_id is not None:
+        bounds['$lt'] = max_id
+
+    while True:
+        query = get_step_query(step, last_id)
+        if bounds:
+            query = {'$and': [query, {'_id': bounds}]}
+
+        documents = list(collection.find(query, step.projection).sort('_id', ASCENDING).limit(chunk_size))
+        if not documents:
+            break
+
+        operations = step.process(request, documents)
+        if operations:
+            collection.bulk_write(operations, ordered=False)
+
+        last_id = documents[-1]['_id']
+        yield last_id, len(documents)
+
+        if len(documents) < chunk_size:
+            break
+
+
+def get_id_ranges(request, step, parts):
+    """
+        Splits the documents of a step into at most `parts` ranges of _ids of
+        similar size, to be processed independently.
+
+        Returns a list of (min_id, max_id) tuples, where min_id is inclusive and
+        max_id exclusive. The first and last ranges are left open.
+    """
+    collection = request.db.db[step.collection]
+    buckets = list(collection.aggregate([
+        {'$match': step.query},
+        {'$bucketAuto': {'groupBy': '$_id', 'buckets': parts}}
+    ]))
+    if not buckets:
+        return []
+
+    boundaries = [None] + [bucket['_id']['min'] for bucket in buckets[1:]] + [None]
+    return zip(boundaries[:-1], boundaries[1:])
+
+
+def run_job_range(request, job, step_index, min_id=None, max_id=None, chunk_size=MAINTENANCE_CHUNK_SIZE):
+    """
+        Processes a range of _ids of a step of a claimed job, for jobs whose
+        ranges are processed in parallel.
+
+        The heartbeat and processed count of the job are updated after every
+        chunk, so the job isn't taken as interrupted while any range is still
+        progressing. If the job is claimed by another worker meanwhile, it stops.
+        Returns the number of documents processed.
+    """
+    jobs = get_jobs_collection(request)
+    step = MAINTENANCE_JOBS[job['name']][step_index]
+    checkpoint_query = {'_id': job['_id'], 'worker': job['worker']}
+
+    processed = 0
+    for last_id, count in process_step(request, step, chunk_size=chunk_size, min_id=min_id, max_id=max_id):
+        processed += count
+        checkpoint = jobs.update_one(checkpoint_query, {
+            '$set': {'heartbeat': datetime.utcnow()},
+            '$inc': {'processed': count}
+        })
+        if not checkpoint.matched_count:
+            raise MaintenanceJobInterrupted()
+    return processed
+
+
+def run_job(request, job, chunk_size=MAINTENANCE_CHUNK_SIZE):
+    """
+        Runs a claimed job from its last checkpoint until the end.
+
+        A checkpoint is stored after every chunk. If the job is claimed by another
+        worker meanwhile, it stops. Any error is stored on the job and raised again.
+    """
+    jobs = get_jobs_collection(request)
+    steps = MAINTENANCE_JOBS[job['name']]
+    checkpoint_query = {'_id': job['_id'], 'worker': job['worker']}
+
+    try:
+        for step_index in range(job['step'], len(steps)):
+            last_id = job['last_id'] if step_index == job['step'] else None
+            for last_id, count in process_step(request, steps[step_index], last_id=last_id, chunk_size=chunk_size):
+                checkpoint = jobs.update_one(checkpoint_query, {
+                    '$set': {'step': step_index, 'last_id': last_id, 'heartbeat': datetime.utcnow()},
+                    '$inc': {'processed': count}
+                })
+                if not checkpoint.matched_count:
+                    raise MaintenanceJobInterrupted()
+
+            jobs.update_one(checkpoint_query, {'$set': {'step': step_index + 1, 'last_id': None}})
+    except MaintenanceJobInterrupted:
+        maxlogger.warning('Maintenance job {} taken over by another worker'.format(job['_id']))
+        return jobs.find_one({'_id': job['_id']})
+    except Exception as exc:
+        jobs.update_one(checkpoint_query, {'$set': {'status': 'failed', 'error': repr(exc)}})
+        raise
+
+    finished = jobs.find_one_and_update(
+        checkpoint_query,
+        {'$set': {'status': 'finished', 'finished': datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER
+    )
+    maxlogger.warning('Finished maintenance job {} ({}), {} documents processed'.format(job['name'], job['_id'], finished['processed']))
+    return finished
+
+
+def format_job(job):
+    """
+        Returns the public representation of a maintenance job
+    """
+    return {
+        'id': str(job['_id']),
+        'name': job['name'],
+        'status': job['status'],
+        'step': job['step'],
+        'steps': len(MAINTENANCE_JOBS[job['name']]),
+        'processed': job['processed'],
+        'total': job['total'],
+        'created': datetime_to_rfc3339(job['created']),
+        'updated': datetime_to_rfc3339(job['heartbeat']),
+        'finished': datetime_to_rfc3339(job['finished']) if job['finished'] else None,
+        'error': job['error']
+    }
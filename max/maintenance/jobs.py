@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+    Definition of the steps of each maintenance job.
+
+    Each step processes a chunk of documents of a collection, and returns a list
+    of bulk write operations to perform on that same collection.
+"""
+from max import maxlogger
+from max.MADMax import ItemWrapper
+from max.models import Context
+from max.models import Conversation
+from max.models import Token
+from max.models import User
+from max.rabbitmq import RabbitNotifications
+from max.utils.ancestry import ancestor_hashes
+
+from bson import ObjectId
+from collections import OrderedDict
+from collections import defaultdict
+from pymongo import UpdateOne
+
+TOKEN_PLATFORMS = [
+    ('ios', 'iosDevices'),
+    ('android', 'androidDevices')
+]
+
+
+class MaintenanceStep(object):
+    """
+        A step of a maintenance job, that processes the documents of `collection`
+        matching `query`, optionally fetched with a `projection`.
+    """
+    def __init__(self, collection, query, process, projection=None):
+        self.collection = collection
+        self.query = query
+        self.process = process
+        self.projection = projection
+
+
+def rebuild_activities_keywords(request, activities):
+    """
+        Rebuild keywords of post activities
+    """
+    operations = []
+    for document in activities:
+        activity = ItemWrapper(document, request, 'activity')
+        activity['object'].setKeywords()
+        activity.setKeywords()
+        operations.append(UpdateOne({'_id': activity['_id']}, {'$set': {
+            'object._keywords': activity['object']['_keywords'],
+            '_keywords': activity['_keywords']
+        }}))
+    return operations
+
+
+def rebuild_activities_dates(request, activities):
+    """
+        Rebuild dates of post activities
+
+        Removes the ancient commented field and sets the lastComment id field
+    """
+    operations = []
+    for activity in activities:
+        updates = {'$unset': {'commented': ''}}
+        if activity.get('replies', []):
+            updates['$set'] = {'lastComment': ObjectId(activity['replies'][-1]['id'])}
+        operations.append(UpdateOne({'_id': activity['_id']}, updates))
+    return operations
+
+
+def rebuild_contexts_subscriptions(request, contexts):
+    """
+        Propagates context changes to subscriptions and activities,
+        creates the bindings of the subscribed users and sets the
+        ancestors of the contexts
+    """
+    users = request.db.db.users
+    notifier = RabbitNotifications(request)
+    operations = []
+    for document in contexts:
+        context = Context.from_object(request, document)
+        context.updateUsersSubscriptions(force_update=True)
+        context.updateContextActivities(force_update=True)
+
+        if context.get('notifications', False):
+            subscribed = users.find({'subscribedTo.hash': context['hash']}, {'username': 1})
+            notifier.bind_users_to_context(context, [user['username'] for user in subscribed])
+
+        operations.append(UpdateOne({'_id': context['_id']}, {'$set': {'_ancestors': ancestor_hashes(context['url'])}}))
+    return operations
+
+
+def rebuild_users_subscriptions(request, users):
+    """
+        Removes subscriptions to unexisting contexts, and ancient fields
+        from the valid ones
+    """
+    hashes = set([subscription['hash'] for user in users for subscription in user.get('subscribedTo', [])])
+    existing_contexts = request.db.db.contexts.find({'hash': {'$in': list(hashes)}}, {'hash': 1})
+    existing_hashes = set([context['hash'] for context in existing_contexts])
+
+    operations = []
+    for user in users:
+        subscriptions = []
+        changed = False
+        for subscription in user.get('subscribedTo', []):
+            if subscription['hash'] not in existing_hashes:
+                fake_deleted_context = Context.from_object(request, subscription)
+                fake_deleted_context._after_subscription_remove(user['username'])
+                changed = True
+                continue
+
+            changed = changed or 'vetos' in subscription or 'grants' in subscription
+            subscription.pop('vetos', None)
+            subscription.pop('grants', None)
+            subscriptions.append(subscription)
+
+        if changed:
+            operations.append(UpdateOne({'_id': user['_id']}, {'$set': {'subscribedTo': subscriptions}}))
+    return operations
+
+
+def rebuild_conversations(request, conversations):
+    """
+        Deletes conversations without messages, migrates ancient participants lists
+        and propagates conversation changes to subscriptions and messages.
+    """
+    conversation_ids = [str(conversation['_id']) for conversation in conversations]
+    with_messages = set(request.db.db.messages.distinct('contexts.id', {'contexts.id': {'$in': conversation_ids}}))
+
+    for document in conversations:
+        conversation = Conversation.from_object(request, document)
+        if str(conversation['_id']) not in with_messages:
+            maxlogger.warning('rebuildConversationSubscriptions: Deleting conversation without messages: {}'.format(conversation['_id']))
+            conversation.delete()
+            continue
+
+        # if we found an ancient plain username list, we migrate it
+        if True not in [isinstance(a, dict) for a in conversation['participants']]:
+            conversation['participants'] = [{'username': a, 'displayName': a, 'objectType': 'person'} for a in conversation['participants']]
+            conversation.save()
+
+        conversation.updateUsersSubscriptions(force_update=True)
+        conversation.updateContextActivities(force_update=True)
+    return []
+
+
+def rebuild_users_conversations(request, users):
+    """
+        Removes subscriptions to unexisting conversations, and migrates
+        ancient participants lists on the existing ones
+    """
+    conversation_ids = set([subscription['id'] for user in users for subscription in user.get('talkingIn', [])])
+    # Malformed ids can't match any conversation, so their subscriptions are removed as unexisting ones
+    valid_conversation_ids = [conversation_id for conversation_id in conversation_ids if ObjectId.is_valid(conversation_id)]
+    existing_conversations = request.db.db.conversations.find(
+        {'_id': {'$in': [ObjectId(conversation_id) for conversation_id in valid_conversation_ids]}},
+        {'participants': 1}
+    )
+    participants = {str(conversation['_id']): conversation['participants'] for conversation in existing_conversations}
+
+    operations = []
+    for document in users:
+        user = User.from_object(request, document)
+        changed = False
+        for subscription in list(user.get('talkingIn', [])):
+            if subscription['id'] not in participants:
+                fake_deleted_conversation = Conversation.from_object(request, subscription)
+                user.removeSubscription(fake_deleted_conversation)
+                user['talkingIn'] = [a for a in user['talkingIn'] if a['id'] != subscription['id']]
+            # if subscription has an ancient plain username list, update it
+            elif True not in [isinstance(a, dict) for a in subscription['participants']]:
+                subscription['participants'] = participants[subscription['id']]
+                changed = True
+
+        user.updateConversationParticipants(force_update=True)
+        if changed:
+            operations.append(UpdateOne({'_id': user['_id']}, {'$set': {'talkingIn': user['talkingIn']}}))
+    return operations
+
+
+def rebuild_conversations_tags(request, conversations):
+    """
+        Sets the group, single and archive tags of conversations based on its participants,
+        makes sure that the owner is subscribed and creates the bindings of the subscribed users.
+    """
+    users = request.db.db.users
+    conversation_ids = set([str(conversation['_id']) for conversation in conversations])
+
+    subscribed_users_by_conversation = defaultdict(list)
+    for user in users.find({'talkingIn.id': {'$in': list(conversation_ids)}}, {'username': 1, 'talkingIn.id': 1}):
+        for subscription in user['talkingIn']:
+            if subscription['id'] in conversation_ids:
+                subscribed_users_by_conversation[subscription['id']].append(user['username'])
+
+    participants = set([participant['username'] for conversation in conversations for participant in conversation['participants']])
+    existing_users = set([user['username'] for user in users.find({'username': {'$in': list(participants)}}, {'username': 1})])
+
+    notifier = RabbitNotifications(request)
+    operations = []
+    for document in conversations:
+        conversation = Conversation.from_object(request, document)
+        conversation_participants_usernames = [user['username'] for user in conversation['participants']]
+        conversation_subscribed_usernames = subscribed_users_by_conversation[str(conversation['_id'])]
+
+        not_subscribed = set(conversation_participants_usernames) - set(conversation_subscribed_usernames)
+        deleted_participants = not_subscribed - existing_users
+
+        all_participants_subscribed = len(conversation_participants_usernames) == len(conversation_subscribed_usernames)
+        all_participants_exist = len(deleted_participants) == 0
+        tags = [tag for tag in conversation.get('tags', []) if tag not in ['single', 'archive']]
+
+        # Conversations od 2+ get the group tag
+        if len(conversation['participants']) > 2:
+            if 'group' not in tags:
+                tags.append('group')
+        # Two people conversation and not group:
+        # tag single: if not all participants subscribed by all exist
+        # tag archive: if not all participants exist
+        elif len(conversation['participants']) == 2 and 'group' not in tags:
+            if all_participants_subscribed:
+                pass
+            elif all_participants_exist:
+                tags.append('single')
+            else:
+                tags.append('archive')
+        # Tag archive: if group conversation only 1 participant
+        elif 'group' in tags and len(conversation['participants']) == 1:
+            tags.append('archive')
+
+        # If the owner is not subscribed to the conversation anymore, one of the
+        # subscribed members becomes the owner, with the hability to add new users
+        owner = conversation['_owner']
+        if conversation_subscribed_usernames and owner not in conversation_subscribed_usernames:
+            owner = conversation_subscribed_usernames[0]
+            new_owner = User.from_object(request, users.find_one({'username': owner}))
+            subscription = new_owner.getSubscription(conversation)
+            new_owner.grantPermission(subscription, 'invite', permanent=True)
+            new_owner.grantPermission(subscription, 'kick', permanent=True)
+            new_owner.revokePermission(subscription, 'unsubscribe', permanent=True)
+
+        # Creates a binding only users subscribed in conversation
+        for participant in conversation_subscribed_usernames:
+            notifier.bind_user_to_conversation(conversation, participant)
+
+        operations.append(UpdateOne({'_id': conversation['_id']}, {'$set': {'tags': tags, '_owner': owner}}))
+    return operations
+
+
+def rebuild_users(request, users):
+    """
+        Checks that the owner of each user is the user itself, and creates the
+        user exchanges in rabbit, if they don't exist yet
+    """
+    operations = []
+    for user in users:
+        if user.get('_owner') != user['username']:
+            operations.append(UpdateOne({'_id': user['_id']}, {'$set': {'_owner': user['username']}}))
+
+    notifier = RabbitNotifications(request)
+    notifier.add_users([user['username'] for user in users])
+    return operations
+
+
+def rebuild_tokens(request, users):
+    """
+        Moves old style tokens stored on users to the tokens collection
+    """
+    tokens = []
+    for user in users:
+        for platform, oldfield in TOKEN_PLATFORMS:
+            for token in user.get(oldfield, []):
+                newtoken = Token.from_object(request, {
+                    'platform': platform,
+                    'token': token,
+                    'objectId': 'token',
+                    '_owner': user['username'],
+                    '_creator': user['username'],
+                })
+                newtoken.setDates()
+                # Upserting keeps the step idempotent, if a chunk is processed twice
+                tokens.append(UpdateOne({'platform': platform, 'token': token}, {'$setOnInsert': dict(newtoken)}, upsert=True))
+
+    if tokens:
+        request.db.db.tokens.bulk_write(tokens, ordered=False)
+
+    # Clean old token fields
+    return [UpdateOne({'_id': user['_id']}, {'$unset': {'iosDevices': '', 'androidDevices': ''}}) for user in users]
+
+
+MAINTENANCE_JOBS = OrderedDict()
+
+MAINTENANCE_JOBS['keywords'] = [
+    MaintenanceStep('activity', {'verb': 'post'}, rebuild_activities_keywords),
+]
+
+MAINTENANCE_JOBS['dates'] = [
+    MaintenanceStep('activity', {'verb': 'post'}, rebuild_activities_dates, projection={'replies.id': 1}),
+]
+
+MAINTENANCE_JOBS['subscriptions'] = [
+    MaintenanceStep('contexts', {}, rebuild_contexts_subscriptions),
+    MaintenanceStep('users', {'subscribedTo.0': {'$exists': True}}, rebuild_users_subscriptions, projection={'username': 1, 'subscribedTo': 1}),
+]
+
+MAINTENANCE_JOBS['conversations'] = [
+    MaintenanceStep('conversations', {}, rebuild_conversations),
+    MaintenanceStep('users', {'talkingIn.0': {'$exists': True}}, rebuild_users_conversations),
+    MaintenanceStep('conversations', {}, rebuild_conversations_tags),
+]
+
+MAINTENANCE_JOBS['users'] = [
+    MaintenanceStep('users', {}, rebuild_users, projection={'username': 1, '_owner': 1}),
+]
+
+MAINTENANCE_JOBS['tokens'] = [
+    MaintenanceStep(
+        'users',
+        {'$or': [{'iosDevices': {'$exists': True}}, {'androidDevices': {'$exists': True}}]},
+        rebuild_tokens,
+        projection={'username': 1, 'iosDevices': 1, 'androidDevices': 1}),
+]
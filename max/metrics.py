@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+    Per route latency, throughput and payload size metrics.
+
+    The metrics tween is the first tween, so it measures the whole time spent
+    serving each request. Metrics are aggregated in memory for all the
+    greenlets or threads of the process, and exposed in the Prometheus text
+    format at /metrics. Each process of a deployment has to be scraped.
+
+    As metrics tell the traffic and errors of every route, /metrics is only
+    readable by Managers, or without authentication from the addresses listed
+    on `max.metrics_allowed_ips`. Prometheus is expected to scrape each max
+    process directly, on its own port and from one of these addresses, not
+    through the public frontend.
+"""
+from bisect import bisect_left
+
+import threading
+import time
+
+# Upper bounds in seconds of the request duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Upper bounds in bytes of the request and response size histogram buckets
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+EXPOSITION_CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+
+class Histogram(object):
+    """
+        Cumulative histogram with a running sum, as exposed to Prometheus
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self, name, labels):
+        """
+            Yields the exposition lines of the histogram
+        """
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            yield '{}_bucket{} {}'.format(name, format_labels(labels + (('le', bound),)), cumulative)
+        yield '{}_sum{} {}'.format(name, format_labels(labels), self.sum)
+        yield '{}_count{} {}'.format(name, format_labels(labels), cumulative)
+
+
+def format_labels(labels):
+    return '{{{}}}'.format(','.join([
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    ]))
+
+
+class RequestMetrics(object):
+    """
+        The request metrics of an application, by route and method
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.responses = {}
+        self.durations = {}
+        self.request_sizes = {}
+        self.response_sizes = {}
+
+    def started(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def finished(self, route, method, status, duration, request_size=None, response_size=None):
+        labels = (('route', route), ('method', method))
+        with self.lock:
+            self.in_flight -= 1
+            status_labels = labels + (('status', status),)
+            self.responses[status_labels] = self.responses.get(status_labels, 0) + 1
+            self.histogram(self.durations, labels, DURATION_BUCKETS).observe(duration)
+            if request_size is not None:
+                self.histogram(self.request_sizes, labels, SIZE_BUCKETS).observe(request_size)
+            if response_size is not None:
+                self.histogram(self.response_sizes, labels, SIZE_BUCKETS).observe(response_size)
+
+    def histogram(self, histograms, labels, buckets):
+        histogram = histograms.get(labels)
+        if histogram is None:
+            histogram = histograms[labels] = Histogram(buckets)
+        return histogram
+
+    def exposition(self):
+        """
+            Returns the metrics in the Prometheus text format
+        """
+        lines = []
+        with self.lock:
+            lines.append('# HELP max_requests_in_flight Requests being served')
+            lines.append('# TYPE max_requests_in_flight gauge')
+            lines.append('max_requests_in_flight {}'.format(self.in_flight))
+
+            lines.append('# HELP max_requests_total Requests served, by response status')
+            lines.append('# TYPE max_requests_total counter')
+            for labels, count in sorted(self.responses.items()):
+                lines.append('max_requests_total{} {}'.format(format_labels(labels), count))
+
+            for name, description, histograms in [
+                    ('max_request_duration_seconds', 'Time spent serving requests', self.durations),
+                    ('max_request_size_bytes', 'Size of the request bodies', self.request_sizes),
+                    ('max_response_size_bytes', 'Size of the response bodies', self.response_sizes)]:
+                lines.append('# HELP {} {}'.format(name, description))
+                lines.append('# TYPE {} histogram'.format(name))
+                for labels, histogram in sorted(histograms.items()):
+                    lines.extend(histogram.samples(name, labels))
+
+        return '\n'.join(lines) + '\n'
+
+
+def get_request_metrics(registry):
+    """
+        Returns the request metrics of the application
+    """
+    metrics = getattr(registry, 'request_metrics', None)
+    if metrics is None:
+        metrics = registry.request_metrics = RequestMetrics()
+    return metrics
+
+
+def request_route(request):
+    """
+        Returns the pattern of the route that served a request. Requests not
+        matching any route are grouped together, to keep labels bounded.
+    """
+    matched_route = getattr(request, 'matched_route', None)
+    return matched_route.pattern if matched_route is not None else 'unmatched'
+
+
+def metrics_factory(handler, registry):
+    metrics = get_request_metrics(registry)
+
+    def metrics_tween(request):
+        metrics.started()
+        start = time.time()
+        try:
+            response = handler(request)
+        except:
+            metrics.finished(request_route(request), request.method, 500, time.time() - start, request.content_length)
+            raise
+
+        metrics.finished(request_route(request), request.method, response.status_int, time.time() - start, request.content_length, response.content_length)
+        return response
+
+    return metrics_tween
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 from max import DEFAULT_CONTEXT_PERMISSIONS
 from max.MADObjects import MADBase
+from max.counters import Counters
+from max.counters import activity_counter_keys
 from max.models.context import Context
 from max.models.user import User
 from max.rabbitmq import RabbitNotifications
@@ -17,27 +19,32 @@ from max.security.permissions import flag
 from max.security.permissions import like
 from max.security.permissions import list_comments
 from max.security.permissions import modify_activity
+from max.security.permissions import modify_immutable_fields
 from max.security.permissions import unfavorite
 from max.security.permissions import unflag
 from max.security.permissions import unlike
 from max.security.permissions import view_activity
+from max.security.permissions import view_private_fields
 from max.utils import getMaxModelByObjectType
 from max.utils import hasPermission
+from max.utils.ancestry import ancestor_hashes
+from max.utils.blobs import get_blob_path
+from max.utils.blobs import store_blob
 from max.utils.dates import rfc3339_parse
-from max.utils.image import rotate_image_by_EXIF
+from max.utils.formatting import get_url_shortener
+from max.utils.image_processing import process_image
+from max.utils.image_processing import render_thumbnails
 
 from pyramid.decorator import reify
 from pyramid.security import Allow
 from pyramid.security import Authenticated
 
-from PIL import Image
 from bson import ObjectId
 
 import datetime
 import json
 import os
 import re
-import requests
 
 ACTIVITY_CONTEXT_FIELDS = ['displayName', 'tags', 'hash', 'url', 'objectType', 'notifications']
 
@@ -78,8 +85,50 @@ class BaseActivity(MADBase):
         'generator': {
             'default': None
         },
+        '_blobs': {
+            'view': view_private_fields,
+            'edit': modify_immutable_fields
+        },
     }
 
+    @classmethod
+    def from_users_batch(cls, request, users, rest_params={}):
+        """
+            Builds one activity for each of the users provided, all of them sharing
+            the same verb and object (i.e. a batch of subscriptions to a context).
+
+            Validation and building is done only once on a template activity, and then
+            the actor is swapped for each user. Users are expected to be plain dicts
+            with at least the username. Activities get their _id assigned here, so they
+            are ready to be inserted all at once.
+        """
+        if not users:
+            return []
+
+        template = cls(request)
+        template.data.update(rest_params)
+        template.data['actor'] = User.from_object(request, users[0])
+        template.data['_creator'] = request.authenticated_userid
+        template.processFields()
+        template.setDates()
+        template.buildObject()
+
+        activities = []
+        for user in users:
+            activity = cls(request)
+            activity.update(template)
+            activity['actor'] = {
+                'objectType': 'person',
+                'displayName': user.get('displayName', user['username']),
+                'username': user['username']
+            }
+            activity['_owner'] = user['username']
+            activity['_id'] = ObjectId()
+            activity['lastComment'] = activity['_id']
+            activities.append(activity)
+
+        return activities
+
     def getOwner(self, request):
         """
             Overrides the getOwner method to set the
@@ -123,6 +172,9 @@ class BaseActivity(MADBase):
 
         if 'contexts' in self.data:
             ob['contexts'] = [self.data['contexts'][0].flatten(preserve=ACTIVITY_CONTEXT_FIELDS), ]
+            # Hashes of the context ancestors, to find the activity on recursive context queries
+            if 'url' in ob['contexts'][0]:
+                ob['contexts'][0]['_ancestors'] = ancestor_hashes(ob['contexts'][0]['url'])
 
         self.update(ob)
 
@@ -146,6 +198,19 @@ class BaseActivity(MADBase):
         if self['verb'] in ['post']:
             self.setKeywords()
 
+    def insert(self, **kwargs):
+        """
+            Inserts the activity, and schedules the rewrite of the urls on its
+            content that were not shortened yet.
+        """
+        oid = super(BaseActivity, self).insert(**kwargs)
+
+        content = self.get('object', {}).get('content', '')
+        if content and 'max.pending_urls' in self.request.environ:
+            parent_id = self['object']['inReplyTo'][0]['_id'] if self.get('verb') == 'comment' else None
+            get_url_shortener(self.request.registry).rewrite_later(self.request, self.collection, oid, content, parent_id=parent_id)
+        return oid
+
     def modifyActivity(self, properties):
         """Update the Activity object with the given properties"""
 
@@ -233,53 +298,93 @@ class BaseActivity(MADBase):
 
     def getBlob(self, extension=''):
         """
+            Returns the path of the file stored for this activity, with the given
+            extension, or None if it doesn't exist.
+
+            Files are looked up first on the content addressed blob store, and
+            then on the legacy per-activity location.
         """
         base_path = self.request.registry.settings.get('file_repository')
-        separator = '.' if extension else ''
+        digest = self.get('_blobs', {}).get(extension or 'full')
+        if digest:
+            path = get_blob_path(base_path, digest)
+            return path if os.path.exists(path) else None
 
+        separator = '.' if extension else ''
         dirs = list(re.search('(\w{2})(\w{2})(\w{2})(\w{2})(\w{2})(\w{2})(\w{12})', str(self['_id'])).groups())
         filename = dirs.pop() + separator + extension
 
         path = base_path + '/' + '/'.join(dirs)
 
         if os.path.exists(os.path.join(path, filename)):
-            data = open(os.path.join(path, filename)).read()
-            return data
+            return os.path.join(path, filename)
         return None
 
+    def getBlobETag(self, extension=''):
+        """
+            Returns the content hash of the file stored for this activity, if stored
+            on the blob store.
+        """
+        return self.get('_blobs', {}).get(extension or 'full')
+
     def getFile(self):
         """
-            Gets the image associated to this message, if the message is of type file
-            And the image exists
+            Gets the path of the file associated to this message, if the message is of type file
+            And the file exists
         """
         if self['object']['objectType'] != 'file':
-            return None
+            return None, None
 
-        image_file = self.getBlob()
+        file_path = self.getBlob()
 
-        if image_file is None:
+        if file_path is None:
             return None, None
         else:
-            return image_file, str(self['object'].get('mimetype', 'application/octet-stream'))
+            return file_path, str(self['object'].get('mimetype', 'application/octet-stream'))
 
     def getImage(self, size):
         """
-            Gets the image associated to this message, if the message is of type image
+            Gets the path of the image associated to this message, if the message is of type image
             And the image exists
         """
         if self['object']['objectType'] != 'image':
-            return None
+            return None, None
 
         file_extension = size if size != 'full' else ''
 
-        image_file = self.getBlob(extension=file_extension)
+        image_path = self.getBlob(extension=file_extension)
 
-        if image_file is None:
+        if image_path is None:
             return None, None
         else:
 
-            content_type = 'image/jpeg' if size != 'full' else str(self['object'].get('mimetype', 'image/jpeg'))
-            return image_file, content_type
+            if size == 'full':
+                content_type = str(self['object'].get('mimetype', 'image/jpeg'))
+            else:
+                content_type = 'image/webp' if size.endswith('webp') else 'image/jpeg'
+            return image_path, content_type
+
+    def generate_thumbnails(self, request):
+        """
+            Generates the thumbnails of the image stored for this activity on the
+            image processing pool, and stores them when ready.
+
+            Must be called once the activity is saved, as the result is stored directly
+            on the database. Meanwhile, the original image is served as thumbnail.
+        """
+        digest = self.getBlobETag()
+        if self['object'].get('objectType') != 'image' or digest is None:
+            return
+
+        base_path = request.registry.settings.get('file_repository')
+        process_image(request.registry, render_thumbnails, (base_path, digest), self._store_thumbnails)
+
+    def _store_thumbnails(self, blobs):
+        self.setdefault('_blobs', {}).update(blobs)
+        self.mdb_collection.update_one(
+            {'_id': self['_id']},
+            {'$set': {'_blobs.{}'.format(name): digest for name, digest in blobs.items()}}
+        )
 
     def process_file(self, request, activity_file):
         """
@@ -305,6 +410,7 @@ class BaseActivity(MADBase):
             # Todo: Make sure that the mimetype is correctly or even informed
             # Use magic or imghdr libraries for that
             files = {'image': (activity_file.filename, activity_file.file, activity_file.type)}
+            import requests
             res = requests.post(uploadURL, headers=headers, files=files)
             if res.status_code == 201:
                 response = json.loads(res.text)
@@ -315,30 +421,14 @@ class BaseActivity(MADBase):
         else:
             # We have a conversation or an activity with no related context
             # or a context with no community which we should save localy
-            dirs = list(re.search('(\w{2})(\w{2})(\w{2})(\w{2})(\w{2})(\w{2})(\w{12})', str(self['_id'])).groups())
-            filename = dirs.pop()
-            path = base_path + '/' + '/'.join(dirs)
-            if not os.path.exists(path):
-                os.makedirs(path)
-            r_file = open(path + '/' + filename, 'w')
-            try:
-                r_file.write(activity_file.file.read())
-            except:
-                from base64 import decodestring
-                r_file.write(decodestring(activity_file.file))
-            r_file.close()
+            blobs = self.setdefault('_blobs', {})
+            blobs['full'] = store_blob(base_path, activity_file.file)
 
             full_endpoint_name = 'image/full' if file_type == 'image' else 'file/download'
             self['object']['fullURL'] = '/{}/{}/{}'.format(self.resource_root, str(self['_id']), full_endpoint_name)
 
             if file_type == 'image':
-                # Generate thumbnail
-                activity_file.file.seek(0)
-                image = Image.open(activity_file.file)
-                thumb = rotate_image_by_EXIF(image)
-                thumb.thumbnail((400, 400), Image.ANTIALIAS)
-                thumb.save(path + '/' + filename + ".thumb", "JPEG")
-
+                # The thumbnail is served from the original image until generated
                 self['object']['thumbURL'] = '/{}/{}/image/thumb'.format(self.resource_root, str(self['_id']))
         self['object']['mimetype'] = activity_file.headers.getheader('content-type', '')
 
@@ -482,6 +572,8 @@ class Activity(BaseActivity):
 
     def flatten(self, *args, **kwargs):
         self.pop('comments', None)
+        # Ancestors of the activity context are only used to query
+        kwargs['squash'] = kwargs.get('squash', []) + ['_ancestors']
         return super(Activity, self).flatten(*args, **kwargs)
 
     def _before_saving_object(self):
@@ -498,11 +590,16 @@ class Activity(BaseActivity):
         self['lastComment'] = oid
         self.save()
 
+        Counters(self.mdb_collection.database).increment(activity_counter_keys(self))
+
         notify = self.get('contexts', [{}])[0].get('notifications', False)
         if notify in ['posts', 'comments', True]:
             notifier = RabbitNotifications(self.request)
             notifier.notify_context_activity(self)
 
+    def _after_delete(self):
+        Counters(self.mdb_collection.database).increment(activity_counter_keys(self), -1)
+
     def _post_init_from_object(self, source):
         """
             * Set the deletable flag on the object. If user is the owner don't check anything else,
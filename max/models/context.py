@@ -2,14 +2,16 @@
 from max import DEFAULT_CONTEXT_PERMISSIONS
 from max.MADMax import MADMaxCollection
 from max.MADObjects import MADBase
-from max.models.user import User
+from max.counters import Counters
+from max.counters import context_activities_key
+from max.publiccontexts import invalidate_public_contexts
 from max.rabbitmq import RabbitNotifications
 from max.security import Manager
 from max.security import Owner
 from max.security import is_self_operation
 from max.security import permissions
-from max.utils.twitter import get_twitter_api
-from max.utils.twitter import get_userid_from_twitter
+from max.utils.ancestry import ancestor_hashes
+from max.utils.twitter import get_twitter_client
 
 from pyramid.decorator import reify
 from pyramid.security import Allow
@@ -178,11 +180,16 @@ class BaseContext(MADBase):
             if 'url' in self.schema.keys() and (self.field_changed('url') or force_update):
                 updates.update({'contexts.$.url': self['url']})
                 updates.update({'contexts.$.hash': self['hash']})
+                updates.update({'contexts.$._ancestors': ancestor_hashes(self['url'])})
 
             combined_updates = {'$set': updates}
 
             self.mdb_collection.database[self.activity_storage].update(criteria, combined_updates, multi=True)
 
+            # Posts move to the counters of the new url ancestors
+            if 'contexts.$.url' in updates:
+                Counters(self.mdb_collection.database).reset(prefix=context_activities_key(''))
+
     def updateUsersSubscriptions(self, force_update=False):
         """
             Updates users subscriptions with changes of the original context.
@@ -198,66 +205,175 @@ class BaseContext(MADBase):
         # Construct a list of all updatable fields that has changes. On force_update=True, all
         # fields with requested update will pass trough
 
-        if must_update_fields:
-            for user in self.subscribedUsers():
-                user_object = User.from_object(self.request, user)
-                criteria = {'_id': user['_id'], '{}.{}'.format(self.user_subscription_storage, self.unique.lstrip('_')): self.getIdentifier()}
-                updates = {}
-
-                if 'url' in must_update_fields:
-                    updates.update({'{}.$.url'.format(self.user_subscription_storage): self['url']})
-                    updates.update({'{}.$.hash'.format(self.user_subscription_storage): self['hash']})
+        if not must_update_fields:
+            return
+
+        storage = self.user_subscription_storage
+        subscription_key = self.unique.lstrip('_')
+        identifier = self.getIdentifier()
+        users = self.mdb_collection.database.users
+        criteria = {'{}.{}'.format(storage, subscription_key): identifier}
+        subscription_filter = {'subscription.{}'.format(subscription_key): identifier}
+
+        # All the writes match the subscriptions by the old identifier, so users
+        # are collected before, and the url and hash are changed on the last write
+        if self.field_changed('url'):
+            usernames = [user['username'] for user in users.find(criteria, {'username': 1})]
+
+        # Users without persistent grants or vetos get the plain permissions of
+        # the context, and the permissions of subscriptions with grants or vetos
+        # are calculated once for each distinct combination of them
+        if 'permissions' in must_update_fields:
+            plain_filter = dict(subscription_filter)
+            plain_filter['subscription._grants'] = {'$in': [None, []]}
+            plain_filter['subscription._vetos'] = {'$in': [None, []]}
+            self.updateSubscriptionsWhere(criteria, plain_filter, {'permissions': self.subscription_permissions()})
+
+            for _grants, _vetos in self.subscriptionsGrantsAndVetos():
+                grants_filter = dict(subscription_filter)
+                grants_filter['subscription._grants'] = _grants if _grants else {'$in': [None, []]}
+                grants_filter['subscription._vetos'] = _vetos if _vetos else {'$in': [None, []]}
+                permissions = self.subscription_permissions_with(_grants, _vetos)
+                self.updateSubscriptionsWhere(criteria, grants_filter, {'permissions': permissions})
+
+        updates = {}
+        if 'displayName' in must_update_fields:
+            updates['displayName'] = self['displayName']
+
+        if 'tags' in must_update_fields:
+            updates['tags'] = self.get('tags', [])
+
+        if 'notifications' in must_update_fields:
+            updates['notifications'] = self.get('notifications', False)
+
+        if 'participants' in must_update_fields:
+            updates['participants'] = self['participants']
+
+        if 'url' in must_update_fields:
+            updates['url'] = self['url']
+            updates['hash'] = self['hash']
+
+        if updates:
+            self.updateSubscriptionsWhere(criteria, subscription_filter, updates)
+
+        # update original subscriptions related to subscribed users when changing url
+        if self.field_changed('url'):
+            self.mdb_collection.database.activity.update_many(
+                {'actor.username': {'$in': usernames}, 'object.url': self.old['url']},
+                {'$set': {
+                    'object.url': self['url'],
+                    'object.hash': self['hash'],
+                }}
+            )
 
-                if 'displayName' in must_update_fields:
-                    updates.update({'{}.$.displayName'.format(self.user_subscription_storage): self['displayName']})
+        self.save()
 
-                if 'tags' in must_update_fields:
-                    updates.update({'{}.$.tags'.format(self.user_subscription_storage): self.get('tags', [])})
+    def updateSubscriptionsWhere(self, criteria, subscription_filter, fields):
+        """
+            Sets the given fields on the subscriptions to this context that match
+            subscription_filter, on all the users matching criteria, in a single write.
+        """
+        updates = {}
+        for field, value in fields.items():
+            updates['{}.$[subscription].{}'.format(self.user_subscription_storage, field)] = value
+
+        return self.mdb_collection.database.users.update_many(
+            criteria,
+            {'$set': updates},
+            array_filters=[subscription_filter]
+        )
+
+    def subscriptionsGrantsAndVetos(self):
+        """
+            Returns the distinct (_grants, _vetos) combinations found on the
+            subscriptions to this context that have any of them.
+        """
+        storage = self.user_subscription_storage
+        subscription_id = '{}.{}'.format(storage, self.unique.lstrip('_'))
+        identifier = self.getIdentifier()
+        pipeline = [
+            {'$match': {subscription_id: identifier}},
+            {'$project': {storage: 1}},
+            {'$unwind': '${}'.format(storage)},
+            {'$match': {
+                subscription_id: identifier,
+                '$or': [
+                    {'{}._grants.0'.format(storage): {'$exists': True}},
+                    {'{}._vetos.0'.format(storage): {'$exists': True}}
+                ]
+            }},
+            {'$group': {'_id': {
+                'grants': '${}._grants'.format(storage),
+                'vetos': '${}._vetos'.format(storage)
+            }}}
+        ]
+        combinations = self.mdb_collection.database.users.aggregate(pipeline)
+        return [(combination['_id'].get('grants', []), combination['_id'].get('vetos', [])) for combination in combinations]
 
-                if 'notifications' in must_update_fields:
-                    updates.update({'{}.$.notifications'.format(self.user_subscription_storage): self.get('notifications', False)})
+    def subscription_permissions_with(self, _grants, _vetos):
+        """
+            Returns the permissions of a subscription to this context, given its
+            persistent granted and vetted permissions.
+        """
+        # The default permissions from the new configured context
+        new_permissions = self.subscription_permissions()
 
-                if 'participants' in must_update_fields:
-                    updates.update({'{}.$.participants'.format(self.user_subscription_storage): self['participants']})
+        # First add the persistent granted permissions
+        for granted_permission in _grants:
+            if granted_permission not in new_permissions:
+                new_permissions.append(granted_permission)
 
-                if 'permissions' in must_update_fields:
-                    subscription = user_object.getSubscription(self)
-                    _vetos = subscription.get('_vetos', [])
-                    _grants = subscription.get('_grants', [])
+        # Then rebuild list excluding the vetted permissions
+        # except if the permission is also granted
+        # This way, the vetted permissions will disappear, and the plain ones
+        # will remain untouched
+        return [permission for permission in new_permissions if (permission not in _vetos or permission in _grants)]
 
-                    # The default permissions from the new configured context
-                    new_permissions = self.subscription_permissions()
+    def addUsersSubscriptions(self, usernames):
+        """
+            Subscribes a batch of users to the context in a single write.
 
-                    # First add the persistent granted permissions
-                    for granted_permission in _grants:
-                        if granted_permission not in new_permissions:
-                            new_permissions.append(granted_permission)
+            The subscription is prepared and validated once and pushed to all
+            the users at the same time. Users already subscribed are left untouched.
+            Returns the number of users that got the new subscription.
+        """
+        if not usernames:
+            return 0
 
-                    # Then rebuild list excluding the vetted permissions
-                    # except if the permission is also granted
-                    # This way, the vetted permissions will disappear, and the plain ones
-                    # will remain untouched
-                    new_permissions = [permission for permission in new_permissions if (permission not in _vetos or permission in _grants)]
+        subscription = self.prepareUserSubscription()
+        subscription_unique_field = '{}.{}'.format(self.user_subscription_storage, self.unique.lstrip('_'))
+        criteria = {
+            'username': {'$in': usernames},
+            subscription_unique_field: {'$ne': self.getIdentifier()}
+        }
+        result = self.mdb_collection.database.users.update_many(criteria, {'$push': {self.user_subscription_storage: subscription}})
+        self._after_subscriptions_add(usernames)
+        return result.modified_count
 
-                    updates.update({'{}.$.permissions'.format(self.user_subscription_storage): new_permissions})
+    def removeUsersSubscriptions(self, usernames):
+        """
+            Unsubscribes a batch of users from the context in a single write.
 
-                if updates:
-                    combined_updates = {'$set': updates}
-                    self.mdb_collection.database.users.update(criteria, combined_updates, multi=True)
+            Push unsubscriptions of those users to this context, if any, are also removed.
+            Returns the number of users that lost the subscription.
+        """
+        if not usernames:
+            return 0
 
-                # update original subscriptions related to this user when changing url
-                if self.field_changed('url'):
-                    self.field_changed('url')
-                    self.mdb_collection.database.activity.update(
-                        {'actor.username': user['username'], 'object.url': self.old['url']},
-                        {'$set': {
-                            'object.url': self['url'],
-                            'object.hash': self['hash'],
-                        }},
-                        multi=True
-                    )
+        context_unique_field = self.unique.lstrip('_')
+        subscription_unique_field = '{}.{}'.format(self.user_subscription_storage, context_unique_field)
+        criteria = {
+            'username': {'$in': usernames},
+            subscription_unique_field: self.getIdentifier()
+        }
+        pulls = {self.user_subscription_storage: {context_unique_field: self.getIdentifier()}}
+        push_storage = getattr(self, 'user_unsubscription_storage_push', None)
+        if push_storage:
+            pulls[push_storage] = {context_unique_field: self.getIdentifier()}
 
-                self.save()
+        result = self.mdb_collection.database.users.update_many(criteria, {'$pull': pulls})
+        self._after_subscriptions_remove(usernames)
+        return result.modified_count
 
     def removeUserSubscriptions(self, users_to_delete=[]):
         """
@@ -296,6 +412,10 @@ class BaseContext(MADBase):
         }
         activitydb.remove(which_to_delete, logical=logical)
 
+        # Hidden activities are still counted, removed ones have to be counted again
+        if not logical:
+            Counters(self.mdb_collection.database).reset()
+
     @property
     def subscription(self):
         """
@@ -328,6 +448,22 @@ class BaseContext(MADBase):
         """
         pass  # pragma: no cover
 
+    def _after_subscriptions_add(self, usernames):
+        """
+            Executed after a batch of users has been subscribed to this context
+            Override to provide a batched behaviour for each context type
+        """
+        for username in usernames:
+            self._after_subscription_add(username)
+
+    def _after_subscriptions_remove(self, usernames):
+        """
+            Executed after a batch of users has been unsubscribed from this context
+            Override to provide a batched behaviour for each context type
+        """
+        for username in usernames:
+            self._after_subscription_remove(username)
+
 
 class Context(BaseContext):
     """
@@ -361,6 +497,10 @@ class Context(BaseContext):
     }
 
     schema['uploadURL'] = {}
+    schema['_ancestors'] = {
+        'view': permissions.view_private_fields,
+        'edit': permissions.modify_immutable_fields
+    }
 
     @reify
     def __acl__(self):
@@ -380,6 +520,10 @@ class Context(BaseContext):
             (Allow, Owner, permissions.manage_subcription_permissions),
             (Allow, Manager, permissions.remove_subscription),
             (Allow, Owner, permissions.remove_subscription),
+            (Allow, Manager, permissions.add_subscriptions_bulk),
+            (Allow, Owner, permissions.add_subscriptions_bulk),
+            (Allow, Manager, permissions.remove_subscriptions_bulk),
+            (Allow, Owner, permissions.remove_subscriptions_bulk),
         ]
         # Grant subscribe permission to the user to subscribe itself if the context policy allows it
         if self['permissions'].get('subscribe', DEFAULT_CONTEXT_PERMISSIONS['subscribe']) == 'public' and is_self_operation(self.request):
@@ -476,10 +620,10 @@ class Context(BaseContext):
 
         # If creating with the twitterUsername, get its Twitter ID
         if self.data.get('twitterUsername', None):
-            api = get_twitter_api(self.request.registry)
-            self['twitterUsernameId'] = get_userid_from_twitter(api, self.data['twitterUsername'])
+            self['twitterUsernameId'] = self.getTwitterUsernameId(self.data['twitterUsername'])
 
         self['hash'] = self.getIdentifier()
+        self['_ancestors'] = ancestor_hashes(self['url'])
 
         # Set displayName only if it's not specified
         self['displayName'] = self.get('displayName', self['url'])
@@ -488,8 +632,7 @@ class Context(BaseContext):
         """Update the user object with the given properties"""
         # If updating the twitterUsername, get its Twitter ID
         if properties.get('twitterUsername', None):
-            api = get_twitter_api(self.request.registry)
-            properties['twitterUsernameId'] = get_userid_from_twitter(api, properties['twitterUsername'])
+            properties['twitterUsernameId'] = self.getTwitterUsernameId(properties['twitterUsername'])
 
         self.updateFields(properties)
 
@@ -508,18 +651,56 @@ class Context(BaseContext):
 
         if 'url' in properties:
             self['hash'] = sha1(self['url']).hexdigest()
+            self['_ancestors'] = ancestor_hashes(self['url'])
 
         self.save()
+        invalidate_public_contexts(self.mdb_collection.database)
+
+    def getTwitterUsernameId(self, twitter_username):
+        """
+            Returns the Twitter ID of a twitter username.
+
+            When twitter lookups run on the background, only already known ids are
+            returned, and unknown ones are resolved after the context is stored.
+        """
+        twitter = get_twitter_client(self.request.registry)
+        return twitter.get_userid(twitter_username, lookup=not twitter.tasks.enabled)
+
+    def _after_twitter_username_change(self):
+        """
+            Restarts tweety to listen to the new twitter username, once its
+            Twitter ID is known, resolving it on the background if needed.
+        """
+        notifier = RabbitNotifications(self.request)
+        twitter = get_twitter_client(self.request.registry)
+        twitter_username = self.get('twitterUsername', None)
+
+        if twitter_username and self.get('twitterUsernameId', None) is None and twitter.tasks.enabled:
+            twitter.tasks.run(('userid', self['hash'], twitter_username), self._resolve_twitter_username_id, twitter, notifier)
+        else:
+            notifier.restart_tweety()
+
+    def _resolve_twitter_username_id(self, twitter, notifier):
+        twitter_username = self['twitterUsername']
+        twitter_username_id = twitter.get_userid(twitter_username)
+        if twitter_username_id is not None:
+            self.mdb_collection.update_one(
+                {'hash': self['hash'], 'twitterUsername': twitter_username},
+                {'$set': {'twitterUsernameId': twitter_username_id}}
+            )
+            notifier.restart_tweety()
 
     def _after_insert_object(self, oid):
+        invalidate_public_contexts(self.mdb_collection.database)
         if self.field_changed('twitterUsername'):
-            notifier = RabbitNotifications(self.request)
-            notifier.restart_tweety()
+            self._after_twitter_username_change()
 
     def _after_saving_object(self, oid):
         if self.field_changed('twitterUsername'):
-            notifier = RabbitNotifications(self.request)
-            notifier.restart_tweety()
+            self._after_twitter_username_change()
+
+    def _after_delete(self):
+        invalidate_public_contexts(self.mdb_collection.database)
 
     def _after_subscription_add(self, username):
         """
@@ -535,3 +716,18 @@ class Context(BaseContext):
         """
         notifier = RabbitNotifications(self.request)
         notifier.unbind_user_from_context(self, username)
+
+    def _after_subscriptions_add(self, usernames):
+        """
+            Creates rabbitmq bindings after a batch of new subscriptions
+        """
+        if self.get('notifications', False):
+            notifier = RabbitNotifications(self.request)
+            notifier.bind_users_to_context(self, usernames)
+
+    def _after_subscriptions_remove(self, usernames):
+        """
+            Removes rabbitmq bindings after a batch of unsubscriptions
+        """
+        notifier = RabbitNotifications(self.request)
+        notifier.unbind_users_from_context(self, usernames)
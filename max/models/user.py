@@ -2,6 +2,8 @@
 from max import DEFAULT_CONTEXT_PERMISSIONS_PERMANENCY
 from max.MADMax import MADMaxCollection
 from max.MADObjects import MADBase
+from max.exceptions import MissingField
+from max.exceptions import ValidationError
 from max.rabbitmq import RabbitNotifications
 from max.security import Manager
 from max.security import Owner
@@ -29,6 +31,7 @@ from pyramid.security import Authenticated
 from pyramid.settings import asbool
 
 from bson import ObjectId
+from collections import OrderedDict
 
 import datetime
 
@@ -133,6 +136,86 @@ class User(MADBase):
     def format_unique(self, key):
         return key
 
+    @classmethod
+    def bulk_insert(cls, request, users_data, creator=None, notifications=True):
+        """
+            Creates a batch of users at once.
+
+            Existing users are detected with a single query, all the new users are
+            validated and built as usual, and inserted with a single write. Exchanges
+            for the new users are created through the same broker connection.
+
+            Returns a tuple with the list of created usernames, the list of usernames
+            that already existed, and a list of (user_data, error) for the invalid entries,
+            including the repeated entries of a username in the batch.
+        """
+        creator = creator if creator is not None else request.authenticated_userid
+        candidates = OrderedDict()
+        invalid = []
+        for user_data in users_data:
+            username = user_data.get('username', None) if isinstance(user_data, dict) else None
+            if not username or not isinstance(username, basestring):
+                invalid.append((user_data, 'Missing username'))
+                continue
+            if username.lower() in candidates:
+                invalid.append((user_data, 'Duplicated username'))
+                continue
+            candidates[username.lower()] = user_data
+
+        users = request.db.db.users
+        found_users = users.find({'username': {'$in': candidates.keys()}}, {'username': 1})
+        existing = set([user['username'] for user in found_users])
+
+        new_users = []
+        for username, user_data in candidates.items():
+            if username in existing:
+                continue
+
+            newuser = cls(request)
+            newuser.data.update(user_data)
+            newuser.data['username'] = username
+            newuser.data['_creator'] = creator
+            newuser.data['_owner'] = username
+            try:
+                newuser.processFields()
+            except (MissingField, ValidationError) as exc:
+                invalid.append((user_data, exc.message))
+                continue
+
+            newuser.setDates()
+            newuser.buildObject()
+            new_users.append(newuser)
+
+        created = [newuser['username'] for newuser in new_users]
+        if new_users:
+            users.insert_many(new_users, ordered=False)
+            cls._after_bulk_insert(request, created, notifications=notifications)
+
+        already_existing = [username for username in candidates if username in existing]
+        return created, already_existing, invalid
+
+    @classmethod
+    def _after_bulk_insert(cls, request, usernames, notifications=True):
+        """
+            Batched version of _after_insert_object, for users created with bulk_insert
+        """
+        query = {
+            'objectType': 'conversation',
+            'participants': {'$size': 2},
+            'participants.username': {'$in': usernames},
+            'tags': {'$all': ['archive'], '$ne': 'group'}
+        }
+
+        conversations_search = request.db.conversations.search(query)
+        for conversation in conversations_search:
+            conversation['tags'].remove('archive')
+            conversation['tags'].append('single')
+            conversation.save()
+
+        if notifications:
+            notifier = RabbitNotifications(request)
+            notifier.add_users(usernames)
+
     def getOwner(self, request):
         """
             Overrides the getOwner method to set the
@@ -1,193 +1,255 @@
 # -*- coding: utf-8 -*-
+"""
+    In memory statistics of the mongodb queries made by each route.
+
+    Queries are observed through pymongo command monitoring, and aggregated by
+    route, collection, command and query shape, where the shape of a query is
+    its structure with all the values replaced. For each one the probe counts
+    executions, errors and documents returned, and keeps a latency histogram.
+
+    Nothing is written to disk, so the probe can be left enabled under load. The
+    fraction of requests observed can be lowered with `max.mongodb_probe_sample_rate`.
+"""
 from pyramid.threadlocal import get_current_request
 
-from copy import deepcopy
+from bisect import bisect_left
 from datetime import datetime
-from hashlib import sha1
-from pymongo.cursor import Cursor
+from pymongo import monitoring
 from pyramid.settings import asbool
 
-import json
 import os
-import re
-import traceback
+import random
+import threading
+
+# Upper bounds in milliseconds of the latency histogram buckets
+LATENCY_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
 
-original_Cursor__init__ = Cursor.__init__
-original_Cursornext = Cursor.next
-
-IGNORE_COLLECTIONS = ['$cmd']
-REQUEST_REPORT = '/tmp/mongo_probe/requests'
-QUERIES_REPORT = '/tmp/mongo_probe/queries'
+# Commands that are not queries made by the application
+IGNORE_COMMANDS = set(['ismaster', 'isMaster', 'ping', 'buildinfo', 'buildInfo', 'getnonce', 'authenticate', 'saslStart', 'saslContinue', 'endSessions', 'killCursors'])
 
+# Fields of each command holding the query, to extract its shape
+QUERY_FIELDS = {
+    'find': 'filter',
+    'count': 'query',
+    'distinct': 'query',
+    'findAndModify': 'query',
+    'findandmodify': 'query',
+}
 
-def get_probe_data():
+
+def query_shape(value):
     """
-        Get probe data from current request
+        Returns the structure of a query, with all the values replaced by ?.
+        Lists of plain values are collapsed, so queries that only differ in
+        the values they look for have the same shape.
     """
-    request = get_current_request()
-    if request:
-        return request.mongodb_probe
+    if isinstance(value, dict):
+        return u'{{{}}}'.format(u', '.join([u'{}: {}'.format(key, query_shape(value[key])) for key in sorted(value)]))
+    elif isinstance(value, (list, tuple)):
+        return u'[{}]'.format(u', '.join(sorted(set([query_shape(item) for item in value]))))
+    return u'?'
 
 
-def get_originator():
+def command_shape(command_name, command):
+    """
+        Returns the shape of the query of a command
+    """
+    if command_name in QUERY_FIELDS:
+        shape = query_shape(command.get(QUERY_FIELDS[command_name], {}))
+        if command.get('sort'):
+            shape = u'{} sort {}'.format(shape, query_shape(command['sort']))
+        return shape
+    elif command_name == 'aggregate':
+        return u' | '.join([u'{}: {}'.format(stage.keys()[0], query_shape(stage.values()[0])) for stage in command.get('pipeline', [])])
+    elif command_name in ('update', 'delete'):
+        statements = command.get('updates' if command_name == 'update' else 'deletes', [])
+        return query_shape(statements[0].get('q', {})) if statements else u''
+    return u''
+
+
+def returned_documents(command_name, reply):
+    """
+        Returns the number of documents returned or affected by a command
+    """
+    if 'cursor' in reply:
+        return len(reply['cursor'].get('firstBatch', reply['cursor'].get('nextBatch', [])))
+    elif command_name == 'count':
+        return int(reply.get('n', 0))
+    elif command_name == 'distinct':
+        return len(reply.get('values', []))
+    return int(reply.get('n', 0))
+
+
+class QueryStats(object):
+    """
+        Aggregated statistics of a query shape
     """
-        Get clean traceback of which max code originated the pymongo query.
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.documents = 0
+        self.total_micros = 0
+        self.max_micros = 0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, micros, documents=0, executions=1, error=False):
+        self.count += executions
+        self.errors += 1 if error else 0
+        self.documents += documents
+        self.total_micros += micros
+        self.max_micros = max(self.max_micros, micros)
+        # Later batches of a cursor only add to the time of its query
+        if executions:
+            self.histogram[bisect_left(LATENCY_BUCKETS, micros / 1000.)] += 1
+
+    def format(self):
+        bucket_names = ['<={}ms'.format(bound) for bound in LATENCY_BUCKETS] + ['>{}ms'.format(LATENCY_BUCKETS[-1])]
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'documents': self.documents,
+            'time_total': round(self.total_micros / 1000., 3),
+            'time_max': round(self.max_micros / 1000., 3),
+            'time_average': round(self.total_micros / 1000. / self.count, 3) if self.count else 0,
+            'histogram': dict(zip(bucket_names, self.histogram))
+        }
+
+
+class MongoProbe(object):
+    """
+        The statistics of the queries of an application, by route and query shape.
+    """
+
+    def __init__(self, enabled=True, sample_rate=1.0):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.since = datetime.utcnow()
+            self.queries = {}
+
+    def sampled(self, request):
+        """
+            Decides once per request if its queries are observed
+        """
+        sampled = request.environ.get('max.mongoprobe.sampled', None)
+        if sampled is None:
+            sampled = request.environ['max.mongoprobe.sampled'] = self.enabled and random.random() < self.sample_rate
+        return sampled
+
+    def record(self, key, micros, documents=0, executions=1, error=False):
+        with self.lock:
+            stats = self.queries.get(key)
+            if stats is None:
+                stats = self.queries[key] = QueryStats()
+            stats.add(micros, documents=documents, executions=executions, error=error)
+
+    def format(self):
+        with self.lock:
+            queries = [
+                dict(route=route, method=method, collection=collection, command=command, shape=shape, **stats.format())
+                for (route, method, collection, command, shape), stats in self.queries.items()
+            ]
+        return {
+            'since': self.since.isoformat(),
+            'sample_rate': self.sample_rate,
+            'queries': sorted(queries, key=lambda query: query['time_total'], reverse=True)
+        }
+
+
+def get_mongo_probe(registry):
+    """
+        Returns the mongodb probe of the application
+    """
+    probe = getattr(registry, 'mongo_probe', None)
+    if probe is None:
+        settings = registry.settings or {}
+        probe = registry.mongo_probe = MongoProbe(
+            enabled=asbool(settings.get('max.enable_mongodb_probe', True)) or asbool(os.environ.get('mongoprobe', False)),
+            sample_rate=float(settings.get('max.mongodb_probe_sample_rate', 1.0)))
+    return probe
+
+
+class MongoProbeListener(monitoring.CommandListener):
+    """
+        Collects the commands run while serving a sampled request,
+        and adds their time to the timings of the request, if timed.
+
+        The key of each command is kept on the request environment until
+        it finishes, as well as the key of any open cursor, so later batches
+        are accounted to the query that opened it.
     """
-    stack = traceback.extract_stack()
-    clean = []
 
-    for file, line, method, code in stack[::-1]:
-        if 'max/max' not in file:
-            continue
-        if file.endswith('mongoprobe.py'):
-            continue
-        module = re.search('src/max/(.*?)\.py', file).groups()[0].replace('/', '.')
-        if module in ['max.tweens']:
-            break
-        mid = '{}.{}:{}'.format(module, method, line)
-        clean.append(mid)
-    clean = clean[::-1]
-    return clean
-
-
-def format_spec(spec, normalize=False):
-    """
-        Formats a pymongo query to json-friendly values.
-
-        When normalize is True, all values different than dicts
-        and lists will be normalized to a mock 'VALUE', to be able
-        to identify similar queries that only differ in particular values
-    """
-    from_spec = deepcopy(spec)
-    newspec = {}
-
-    def _format(value):
-        if normalize:
-            return 'VALUE'
-        else:
-            if isinstance(value, datetime):
-                return value.isoformat()
-            elif isinstance(value, unicode):
-                return value.encode('utf-8')
-            else:
-                return str(value)
-
-    def format_value(value):
-        if isinstance(value, list):
-            newlist = []
-            for item in value:
-                newvalue = format_value(item)
-                # When normalizing, do not add a value to a list if it's already in
-                # This way all plain value lists will remain the same
-                if normalize is False or (normalize is True and newvalue not in newlist):
-                    newlist.append(newvalue)
-            return newlist
-        elif isinstance(value, dict):
-            newdict = {}
-            for itemkey, item in value.items():
-                newdict[itemkey] = format_value(item)
-            return newdict
-        else:
-            return _format(value)
-
-    for key, value in from_spec.items():
-        newspec[key] = format_value(value)
-
-    return newspec
-
-
-def patched_Cursor__init__(self, collection, spec={}, *args, **kwargs):
-    """
-        Patch for Cursor initialization.
-
-        It takes care of creating the probe entry for this cursor, that will be
-        populated on the next patch
-    """
-    original_Cursor__init__(self, collection, spec, *args, **kwargs)
-    if collection.name not in IGNORE_COLLECTIONS:
-        probe_data = get_probe_data()
-        if probe_data:
-            cursor_id = id(self)
-            normalized_spec = format_spec(spec, normalize=True)
-            cursor_hash = sha1(collection.name + json.dumps(normalized_spec)).hexdigest()
-
-            probe_data['cursors'][cursor_id] = {
-                'used': False,
-                'collection': collection.name,
-                'spec': normalized_spec,
-                'hash': cursor_hash,
-                'order': probe_data['cursor_count']
-            }
-            probe_data['cursor_count'] += 1
-
-
-def patched_Cursornext(self):
-    """
-        Patch for the next iterator method of Cursor.
-
-        The first invocation of Cursor.next() is the one that fetches data from
-        mongodb, so we get the originating traceback here.
-    """
-    probe_data = get_probe_data()
-    if probe_data:
-        cursor_id = id(self)
-        if cursor_id in probe_data['cursors']:
-            if not probe_data['cursors'][cursor_id]['used']:
-                probe_data['cursors'][cursor_id]['used'] = True
-                probe_data['cursors'][cursor_id]['originator'] = get_originator()
-
-    data = original_Cursornext(self)
-    return data
-
-
-def mongodb_probe_factory(handler, registry):
-    def mongodb_probe_tween(request):
-        if not hasattr(request, 'mongodb_probe'):
-            request.mongodb_probe = {
-                'cursors': {},
-                'cursor_count': 0
-            }
-        response = handler(request)
-        if request.matched_route:
-            endpoint = request.matched_route.path.strip('/').replace('/', '_')
-            method = request.method
-            request_folder = '{}/{}___{}'.format(REQUEST_REPORT, endpoint, method)
-            if not os.path.exists(request_folder):
-                os.makedirs(request_folder)
-            count = len(os.listdir(request_folder))
-            request_queries = []
-            for cursorid, cursor in sorted(request.mongodb_probe.get('cursors', []).items(), key=lambda x: x[1]['order']):
-                del cursor['order']
-                del cursor['used']
-                request_queries.append(cursor)
-                if not os.path.exists(QUERIES_REPORT):
-                    os.makedirs(QUERIES_REPORT)
-                if not os.path.exists('{}/{collection}_{hash}'.format(QUERIES_REPORT, **cursor)):
-                    dumped = deepcopy(cursor)
-                    del dumped['originator']
-                    del dumped['hash']
-                    open('{}/{collection}_{hash}'.format(QUERIES_REPORT, **cursor), 'w').write(json.dumps(dumped, indent=4))
-
-            output = {
-                'queries': request_queries,
-                'request': request.url
-            }
-
-            test_name = [a[2] for a in traceback.extract_stack() if a[2].startswith('test_')]
-            if test_name:
-                output['test'] = test_name
-
-            open('{}/{}'.format(request_folder, count), 'w').write(json.dumps(output, indent=4))
-
-        return response
-    return mongodb_probe_tween
+    def started(self, event):
+        if event.command_name in IGNORE_COMMANDS:
+            return
+        request = get_current_request()
+        if request is None or not get_mongo_probe(request.registry).sampled(request):
+            return
+
+        pending = request.environ.setdefault('max.mongoprobe.pending', {})
+        if event.command_name == 'getMore':
+            key = request.environ.get('max.mongoprobe.cursors', {}).get(event.command['getMore'])
+            if key is not None:
+                pending[event.request_id] = (key, 0)
+            return
+
+        matched_route = getattr(request, 'matched_route', None)
+        collection = event.command.get(event.command_name)
+        key = (
+            matched_route.pattern if matched_route else None,
+            request.method,
+            collection if isinstance(collection, basestring) else None,
+            event.command_name,
+            command_shape(event.command_name, event.command)
+        )
+        pending[event.request_id] = (key, 1)
+
+    def finished(self, event, reply=None):
+        request = get_current_request()
+        if request is None:
+            return
+
+        # Time spent on mongodb by requests being timed, see max.timing
+        timings = request.environ.get('max.timings')
+        if timings is not None and event.command_name not in IGNORE_COMMANDS:
+            timings.add('mongodb', event.duration_micros / 1000000.)
+
+        pending = request.environ.get('max.mongoprobe.pending', {}).pop(event.request_id, None)
+        if pending is None:
+            return
+
+        key, executions = pending
+        probe = get_mongo_probe(request.registry)
+        if reply is None:
+            probe.record(key, event.duration_micros, executions=executions, error=True)
+            return
+
+        cursor_id = reply.get('cursor', {}).get('id')
+        if cursor_id:
+            request.environ.setdefault('max.mongoprobe.cursors', {})[cursor_id] = key
+        probe.record(key, event.duration_micros, documents=returned_documents(event.command_name, reply), executions=executions)
+
+    def succeeded(self, event):
+        self.finished(event, event.reply)
+
+    def failed(self, event):
+        self.finished(event)
+
+
+listener = MongoProbeListener()
+listener_registered = []
 
 
 def setup(settings):
     """
-        Enable mongo probe patches and tweens
+        Registers the command listener of the probe. It has to be registered
+        before the mongodb connection is created, and only once per process.
     """
-    if asbool(settings.get('max.enable_mongodb_probe', False)) or asbool(os.environ.get('mongoprobe', False)):
-        settings['pyramid.tweens'].insert(1, 'max.mongoprobe.mongodb_probe_factory')
-        Cursor.__init__ = patched_Cursor__init__
-        Cursor.next = patched_Cursornext
+    if not listener_registered:
+        monitoring.register(listener)
+        listener_registered.append(listener)
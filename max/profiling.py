@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+    On demand profiling of single requests, for Managers.
+
+    Any request made by a Manager with a `profile` query parameter, or a
+    X-Max-Profile header, is run under cProfile. The report, with the top
+    functions by cumulative time and their call counts, is stored along with
+    the logged exceptions, and its id returned on the X-Max-Profile response
+    header. With `profile=inline` the report replaces the response body.
+
+    As all the greenlets of a worker share the same thread, the profiler is
+    only enabled while the greenlet of the profiled request is running, so the
+    report doesn't include the requests served meanwhile. Time spent waiting
+    on other greenlets, as for I/O, is left out of the report too.
+"""
+from max.exceptions.scavenger import saveProfile
+from max.timing import is_manager
+
+from cProfile import Profile
+from greenlet import getcurrent
+from greenlet import settrace
+from pstats import Stats
+from StringIO import StringIO
+
+PROFILE_HEADER = 'X-Max-Profile'
+
+# Number of functions listed in the profile reports
+PROFILE_TOP_FUNCTIONS = 40
+
+# Profiles being recorded, by the greenlet they belong to
+_profiles = {}
+
+# Greenlet trace function installed before ours, if any
+_previous_tracer = None
+
+
+def requested_profile(request):
+    """
+        Returns the profile mode requested, or None if not requested
+    """
+    mode = request.headers.get(PROFILE_HEADER, None)
+    if mode is None:
+        mode = request.GET.get('profile', None)
+    return mode
+
+
+def trace_switches(event, args):
+    """
+        Greenlet trace function that enables the profile of a greenlet only while
+        it's running, and chains to the previous trace function.
+    """
+    if event in ('switch', 'throw'):
+        origin, target = args
+        if origin in _profiles:
+            _profiles[origin].disable()
+        if target in _profiles:
+            _profiles[target].enable()
+
+    if _previous_tracer is not None:
+        _previous_tracer(event, args)
+
+
+def profile_greenlet(func, *args):
+    """
+        Runs a function under a profile that only records the current greenlet.
+
+        Returns the result of the function and the profile.
+    """
+    global _previous_tracer
+
+    current = getcurrent()
+    profile = Profile()
+    if not _profiles:
+        _previous_tracer = settrace(trace_switches)
+    _profiles[current] = profile
+
+    profile.enable()
+    try:
+        result = func(*args)
+    finally:
+        profile.disable()
+        del _profiles[current]
+        if not _profiles:
+            settrace(_previous_tracer)
+            _previous_tracer = None
+    return result, profile
+
+
+def format_profile(profile, limit=PROFILE_TOP_FUNCTIONS):
+    """
+        Returns the report of a profile, sorted by cumulative time
+    """
+    report = StringIO()
+    stats = Stats(profile, stream=report)
+    stats.sort_stats('cumulative', 'calls').print_stats(limit)
+    return report.getvalue()
+
+
+def profiling_factory(handler, registry):
+    def profiling_tween(request):
+        mode = requested_profile(request)
+        if mode is None or not is_manager(request):
+            return handler(request)
+
+        response, profile = profile_greenlet(handler, request)
+        report = format_profile(profile)
+
+        if mode == 'inline':
+            response.content_type = 'text/plain'
+            response.body = report
+        else:
+            profile_id, profile_log = saveProfile(request, report)
+            response.headers[PROFILE_HEADER] = str(profile_id)
+        return response
+
+    return profiling_tween
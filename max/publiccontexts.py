@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+    In-process registry of the public contexts.
+
+    Listings of activities need the contexts that everyone can read or write,
+    which rarely change. Instead of searching them on each request, they're
+    kept on the application registry, indexed by hash and by the hashes of
+    their ancestors, the url prefixes of the context.
+
+    A version stored on the database is changed each time a context is
+    created, modified or deleted, and checked before using the registry, so
+    all the processes serving the application reload the public contexts
+    after any change.
+"""
+from max.utils.ancestry import ancestor_hashes
+
+from bson import ObjectId
+
+VERSIONS_COLLECTION = 'versions'
+VERSION_KEY = 'public_contexts'
+
+
+def invalidate_public_contexts(db):
+    """
+        Changes the version of the public contexts, so every process reloads
+        them on its next use.
+    """
+    db[VERSIONS_COLLECTION].update_one({'_id': VERSION_KEY}, {'$set': {'version': ObjectId()}}, upsert=True)
+
+
+class PublicContexts(object):
+    """
+        The public contexts of a max database
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.loaded = False
+        self.version = None
+        self.by_hash = {}
+        self.readable_by_ancestor = {}
+
+    def current_version(self):
+        document = self.db[VERSIONS_COLLECTION].find_one({'_id': VERSION_KEY})
+        return document['version'] if document else None
+
+    def refresh(self):
+        """
+            Loads the public contexts, if not loaded yet or if they changed
+            since the last load.
+        """
+        # The version is read before the contexts, so a change while loading
+        # is loaded again on the next refresh
+        version = self.current_version()
+        if self.loaded and version == self.version:
+            return
+
+        query = {'$or': [{'permissions.read': 'public'}, {'permissions.write': 'public'}]}
+        fields = {'hash': 1, 'url': 1, 'permissions': 1, '_ancestors': 1}
+
+        by_hash = {}
+        readable_by_ancestor = {}
+        for context in self.db.contexts.find(query, fields):
+            # Contexts stored before ancestors were kept don't have them yet
+            ancestors = context.get('_ancestors') or ancestor_hashes(context['url'])
+            by_hash[context['hash']] = context.get('permissions', {})
+            if context.get('permissions', {}).get('read') == 'public':
+                for ancestor in ancestors:
+                    readable_by_ancestor.setdefault(ancestor, []).append(context['hash'])
+
+        self.by_hash = by_hash
+        self.readable_by_ancestor = readable_by_ancestor
+        self.version = version
+        self.loaded = True
+
+    def writable(self):
+        """
+            Returns the hashes of the contexts where everyone can post
+        """
+        return [context_hash for context_hash, context_permissions in self.by_hash.items() if context_permissions.get('write') == 'public']
+
+    def readable_within(self, context_hash):
+        """
+            Returns the hashes of the contexts that everyone can read among
+            a context and its child contexts.
+        """
+        return list(self.readable_by_ancestor.get(context_hash, []))
+
+
+def get_public_contexts(registry):
+    """
+        Returns the up to date public contexts of the application
+    """
+    public_contexts = getattr(registry, 'public_contexts', None)
+    if public_contexts is None:
+        public_contexts = registry.public_contexts = PublicContexts(registry.max_store)
+    public_contexts.refresh()
+    return public_contexts
@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 from max.exceptions import ConnectionError
 from max.resources import getMAXSettings
+from max.resources import getMAXVersion
+from max.timing import get_request_timings
+from max.timing import timed
+from max.timing import timed_call
 
 from maxcarrot import RabbitClient
 from maxcarrot import RabbitMessage
@@ -8,7 +12,6 @@ from socket import error as socket_error
 
 import datetime
 import json
-import pkg_resources
 import sys
 
 
@@ -34,13 +37,14 @@ class RabbitNotifications(object):
 
         client_properties = {
             "product": "max",
-            "version": pkg_resources.require('max')[0].version,
+            "version": getMAXVersion(),
             "platform": 'Python {0.major}.{0.minor}.{0.micro}'.format(sys.version_info),
             "server": settings.get('max_server', '')
         }
 
         try:
-            self.client = RabbitClient(self.url, client_properties=client_properties)
+            with timed('rabbitmq', request):
+                self.client = RabbitClient(self.url, client_properties=client_properties)
         except AttributeError:
             self.enabled = False
         except socket_error:
@@ -51,13 +55,18 @@ class RabbitNotifications(object):
             Returns the requested method if notifier is enabled, otherwise
             performs a noop
         """
-        enabled = object.__getattribute__(self, 'enabled')
-        if enabled or name in [
-                'enabled', 'url', 'request', 'client', 'message_defaults']:
+        if name in ['enabled', 'url', 'request', 'client', 'message_defaults']:
             return object.__getattribute__(self, name)
-        else:
+
+        enabled = object.__getattribute__(self, 'enabled')
+        if not enabled:
             return noop
 
+        method = object.__getattribute__(self, name)
+        if get_request_timings(object.__getattribute__(self, 'request')) is not None:
+            return timed_call('rabbitmq')(method)
+        return method
+
     def restart_tweety(self):
         """
             Sends a timestamp to tweety_restart queue, trough the default exchange
@@ -75,6 +84,15 @@ class RabbitNotifications(object):
         self.client.create_user(username)
         # self.client.disconnect()
 
+    def add_users(self, usernames):
+        """
+            Creates the exchanges and bindings of a batch of users,
+            reusing the same broker connection for all of them
+        """
+        for username in usernames:
+            self.client.create_user(username)
+        # self.client.disconnect()
+
     def delete_user(self, username):
         """
             Deletes the specified user exchange and bindings
@@ -98,6 +116,26 @@ class RabbitNotifications(object):
         self.client.activity.unbind_user(context_id, username)
         # self.client.disconnect()
 
+    def bind_users_to_context(self, context, usernames):
+        """
+            Creates bindings between a batch of user exchanges and a context,
+            reusing the same broker connection for all of them
+        """
+        context_id = context.getIdentifier()
+        for username in usernames:
+            self.client.activity.bind_user(context_id, username)
+        # self.client.disconnect()
+
+    def unbind_users_from_context(self, context, usernames):
+        """
+            Destroys bindings between a batch of user exchanges and a context,
+            reusing the same broker connection for all of them
+        """
+        context_id = context.getIdentifier()
+        for username in usernames:
+            self.client.activity.unbind_user(context_id, username)
+        # self.client.disconnect()
+
     def unbind_context(self, context):
         """
             Destroys all bindings between a context and any user
@@ -27,15 +27,8 @@ def extract_post_data(request):
     """
     json_data = {}
 
-    try:
-        request_body = request.body
-    except:
-        request_body = None
-    try:
-        have_file = json.loads(request_body, object_hook=json_util.object_hook)['data']['file']
-    except:
-        have_file = False
-    
+    # Multipart bodies are parsed by webob, that keeps uploaded files out of
+    # memory, so the raw body is never read here
     if 'multipart/form-data' in request.content_type:
         try:
             json_data = json.loads(request.params.get('json_data'), object_hook=json_util.object_hook)
@@ -43,19 +36,34 @@ def extract_post_data(request):
                 json_data['object']['file'] = request.params.get('file')
         except:
             pass
-    elif 'application/json' in request.content_type and have_file:
-        from base64 import b64decode
-        json_data = json.loads(json.loads(request_body, object_hook=json_util.object_hook)['data']['json_data'])
-        json_data['object']['file'] = b64decode(have_file)
+        return json_data
+
+    try:
+        request_body = request.body
+    except:
+        request_body = None
 
-    elif 'multipart/form-data' not in request.content_type and request_body:
+    if not request_body:
+        return json_data
 
-        # Usually look for JSON encoded body, catch the case it does not contain
-        # valid JSON data, e.g when uploading a file
-        try:
-            json_data = json.loads(request_body, object_hook=json_util.object_hook)
-        except:
-            pass
+    # Usually look for JSON encoded body, catch the case it does not contain
+    # valid JSON data, e.g when uploading a file
+    try:
+        decoded_body = json.loads(request_body, object_hook=json_util.object_hook)
+    except:
+        return json_data
+
+    try:
+        have_file = decoded_body['data']['file']
+    except:
+        have_file = False
+
+    if 'application/json' in request.content_type and have_file:
+        from base64 import b64decode
+        json_data = json.loads(decoded_body['data']['json_data'])
+        json_data['object']['file'] = b64decode(have_file)
+    else:
+        json_data = decoded_body
 
     return json_data
 
@@ -10,6 +10,8 @@ import pkg_resources
 import inspect
 
 
+MAX_VERSION = []
+
 DUMMY_CLOUD_API_DATA = {
     "twitter": {
         "consumer_secret": "",
@@ -238,6 +240,7 @@ class PeopleTraverser(MongoDBTraverser):
     def __acl__(self):
         acl = [
             (Allow, Manager, permissions.add_people),
+            (Allow, Manager, permissions.import_people),
             (Allow, Manager, permissions.list_visible_people),
             (Allow, Manager, permissions.modify_user),
             (Allow, Manager, permissions.delete_user),
@@ -257,12 +260,22 @@ def getMAXSettings(request):
     return request.registry.max_settings
 
 
+def getMAXVersion():
+    """
+        Returns the version of the installed max distribution. Resolving
+        the distribution is slow, so it's looked up only once.
+    """
+    if not MAX_VERSION:
+        MAX_VERSION.append(pkg_resources.get_distribution('max').version)
+    return MAX_VERSION[0]
+
+
 def loadMAXSettings(settings):
     max_ini_settings = {key.replace('max.', 'max_'): settings[key] for key in settings.keys() if 'max' in key}
     max_ini_settings['max_message_defaults'] = {
         "source": "max",
         "domain": max_ini_settings.get('max_server_id', ''),
-        "version": pkg_resources.require("max")[0].version,
+        "version": getMAXVersion(),
     }
     return max_ini_settings
 
@@ -4,9 +4,12 @@ from pyramid.response import Response
 from types import GeneratorType
 
 from max.MADMax import ResultsWrapper
+from max.timing import timed
+from max.timing import timed_view
 from max.utils.dates import datetime_to_rfc3339
 
 import json
+import linecache
 import venusian
 
 
@@ -28,6 +31,8 @@ class endpoint(object):
         settings = self.__dict__.copy()
         depth = settings.pop('_depth', 0)
         modifiers = settings.pop('modifiers', [])
+        decorators = settings.get('decorator', ())
+        settings['decorator'] = (timed_view,) + (decorators if isinstance(decorators, tuple) else (decorators,))
 
         def callback(context, name, ob):
             ob.modifiers = modifiers
@@ -40,7 +45,8 @@ class endpoint(object):
         # Fix multiline decorator signature in code object
         decorator_name = '@{}'.format(self.__class__.__name__)
         if decorator_name not in info.codeinfo[3]:
-            codelines = open(info.codeinfo[0]).readlines()
+            # Source lines are already cached by venusian's frame inspection
+            codelines = linecache.getlines(info.codeinfo[0])
             end = info.codeinfo[1]
             start = end
             while decorator_name not in codelines[start] and end - start <= 4:
@@ -99,7 +105,8 @@ class JSONResourceRoot(object):
             response_payload = ''
             self.headers['X-totalItems'] = str(self.data)
         else:
-            response_payload = json.dumps(self.data, cls=IterEncoder)
+            with timed('serialization', self.request):
+                response_payload = json.dumps(self.data, cls=IterEncoder)
 
         if self.remaining:
             self.headers['X-Has-Remaining-Items'] = '1'
@@ -135,7 +142,8 @@ class JSONResourceEntity(object):
         if 'show_acls' in self.request.params:
             self.data['acls'] = self.request.context.dump_acls()
 
-        response_payload = json.dumps(self.data, cls=IterEncoder)
+        with timed('serialization', self.request):
+            response_payload = json.dumps(self.data, cls=IterEncoder)
         data = response_payload is None and self.data or response_payload
         response = Response(data, status_int=self.status_code)
         response.content_type = self.response_content_type
@@ -1,10 +1,17 @@
 # -*- coding: utf-8 -*-
+from max.counters import context_activities_key
+from max.counters import counted_request
+from max.counters import get_count
 from max.models import Activity
+from max.publiccontexts import get_public_contexts
 from max.rest import JSONResourceEntity
 from max.rest import JSONResourceRoot
 from max.rest import endpoint
 from max.rest.sorting import sorted_query
 from max.utils import searchParams
+from max.utils.ancestry import ancestor_hashes
+from max.utils.blobs import blob_response
+from max.utils.image import image_attachment_response
 from max.security.permissions import add_activity
 from max.security.permissions import delete_activity
 from max.security.permissions import list_activities
@@ -13,15 +20,12 @@ from max.security.permissions import view_activity
 
 from pyramid.httpexceptions import HTTPGone
 from pyramid.httpexceptions import HTTPNoContent
-from pyramid.response import Response
 from pyramid.security import ACLAllowed
 
-from base64 import b64encode
 from bson import ObjectId
 from datetime import timedelta
 
 import re
-import requests
 
 
 def visible_user_activities_query(user, request, filter_non_shared=True):
@@ -74,8 +78,7 @@ def visible_user_activities_query(user, request, filter_non_shared=True):
 
     # Prepare query to search for all non_shared context public activity
     if non_shared_contexts:
-        public_contexts = request.db.contexts.search({'permissions.write': 'public'}, flatten=1)
-        public_contexts_hashes = [a['hash'] for a in public_contexts]
+        public_contexts_hashes = get_public_contexts(request.registry).writable()
         if public_contexts_hashes:
             non_shared_contexts_activity_query.update(common_query)
             non_shared_contexts_activity_query['contexts.hash'] = {'$in': public_contexts_hashes}
@@ -126,7 +129,11 @@ def getGlobalActivities(context, request):
         Returns all post activities generated in the system by anyone.
     """
     is_head = request.method == 'HEAD'
-    activities = request.db.activity.search({'verb': 'post'}, flatten=1, count=is_head, **searchParams(request))
+    query = {'verb': 'post'}
+    if counted_request(request, estimated=True):
+        activities = get_count(request, 'activities', query)
+    else:
+        activities = request.db.activity.search(query, flatten=1, count=is_head, **searchParams(request))
     handler = JSONResourceRoot(request, activities, stats=is_head)
     return handler.buildResponse()
 
@@ -140,47 +147,51 @@ def getContextActivities(context, request):
 
          :rest hash The hash of the context url where the activties where posted
     """
-    url = context['url']
-
-    # regex query to find all contexts within url
-    escaped = re.escape(url)
-    url_regex = {'$regex': '^%s' % escaped}
+    # Search posts associated with this context or any of its
+    # child contexts a.k.a "recursive contexts"
+    # Activities stored before ancestors were kept are matched by url
+    # until the subscriptions maintenance job fills their ancestors
+    url_regex = {'$regex': '^%s(/|$)' % re.escape(context['url'].rstrip('/'))}
 
-    # Search posts associated with contexts that have this context's
-    # url as prefix a.k.a "recursive contexts"
     query = {}                                                     # Search
     query.update({'verb': 'post'})                                 # 'post' activities
-    query.update({'contexts.url': url_regex})                      # equal or child of url
+    query.update({'$or': [                                         # equal or child of context
+        {'contexts._ancestors': context['hash']},
+        {'contexts._ancestors': {'$exists': False}, 'contexts.url': url_regex}
+    ]})
 
     # Check if we have permission to unrestrictely view activities from recursive contexts:
     can_list_activities_unsubscribed = isinstance(request.has_permission(list_activities_unsubscribed), ACLAllowed)
 
+    # Unfiltered counts of all the activities are kept on the counter of the context
+    if can_list_activities_unsubscribed and counted_request(request):
+        handler = JSONResourceRoot(request, get_count(request, context_activities_key(context['hash']), query), stats=True)
+        return handler.buildResponse()
+
     # If we can't view unsubcribed contexts, filter from which contexts we get activities by listing
     # the contexts that the user has read permission on his subscriptions. Public contexts are only searched here
     # because if we can list_activities_unsubscribed, main query already includes them.
 
-    readable_contexts_urls = []
+    readable_contexts_hashes = []
     if not can_list_activities_unsubscribed:
-        # Include all urls from subscriptions to contexts whose url
-        # is a child of of main context url,
+        # Include all hashes from subscriptions to contexts that are
+        # the main context or a child of it
         for subscription in request.actor['subscribedTo']:
             if 'read' in subscription.get('permissions', []) \
                and subscription['objectType'] == 'context'\
-               and subscription['url'].startswith(url):
-                readable_contexts_urls.append(subscription['url'])
+               and context['hash'] in ancestor_hashes(subscription['url']):
+                readable_contexts_hashes.append(subscription['hash'])
 
-        # We'll include also all contexts that are public whitin the url
-        public_query = {'permissions.read': 'public', 'url': url_regex}
-        for result in request.db.contexts.search(public_query, show_fields=['url']):
-            readable_contexts_urls.append(result['url'])
+        # We'll include also all contexts that are public whitin the context
+        readable_contexts_hashes.extend(get_public_contexts(request.registry).readable_within(context['hash']))
 
-    # if any url collected, include it on the query
-    if readable_contexts_urls:
-        query['contexts.url'] = {'$in': readable_contexts_urls}
+    # if any context collected, include it on the query
+    if readable_contexts_hashes:
+        query['contexts.hash'] = {'$in': readable_contexts_hashes}
 
     activities = []
     # Execute search only if we have read permision on some contexts or we have usubscribed access to activities.
-    if readable_contexts_urls or can_list_activities_unsubscribed:
+    if readable_contexts_hashes or can_list_activities_unsubscribed:
         activities = sorted_query(request, request.db.activity, query, flatten=1)
 
     is_head = request.method == 'HEAD'
@@ -240,6 +251,7 @@ def addContextActivity(context, request):
             newactivity['_id'] = ObjectId(activity_oid)
             newactivity.process_file(request, activity_file)
             newactivity.save()
+            newactivity.generate_thumbnails(request)
         else:
             activity_oid = newactivity.insert()
             newactivity['_id'] = ObjectId(activity_oid)
@@ -282,6 +294,7 @@ def addContextActivity(context, request):
                          'X-Oauth-Token': request.auth_headers[0],
                          'X-Oauth-Scope': request.auth_headers[2]}
 
+                import requests
                 res = requests.post(url, headers=headers, data=payload, verify=False)
         except:
             pass
@@ -336,6 +349,7 @@ def addUserActivity(user, request):
             newactivity['_id'] = ObjectId(activity_oid)
             newactivity.process_file(request, activity_file)
             newactivity.save()
+            newactivity.generate_thumbnails(request)
         else:
             activity_oid = newactivity.insert()
             newactivity['_id'] = activity_oid
@@ -377,19 +391,7 @@ def getActivityImageAttachment(activity, request):
     """
 
     file_size = request.matchdict.get('size', 'full')
-    image, mimetype = activity.getImage(size=file_size)
-
-    if image is not None:
-        if request.headers.get('content-type', '') == 'application/base64':
-            image = b64encode(image)
-            mimetype = 'application/base64'
-
-        response = Response(image, status_int=200)
-        response.content_type = mimetype
-    else:
-        response = HTTPGone()
-
-    return response
+    return image_attachment_response(request, activity, file_size)
 
 
 @endpoint(route_name='activity_file_download', request_method='GET', permission=view_activity)
@@ -399,17 +401,11 @@ def getActivityFileAttachment(activity, request):
 
         :rest activity The id of the activity
     """
-    file_data, mimetype = activity.getFile()
+    file_path, mimetype = activity.getFile()
 
-    if file_data is not None:
+    if file_path is not None:
         from_app = request.headers.get('X-From-Utalk', 'None') # app or None
-        if from_app == 'App':
-            pdf = b64encode(file_data)
-            mimetype = 'application/base64'
-            response = Response(pdf, status_int=200)
-        else:
-            response = Response(file_data, status_int=200)
-        response.content_type = mimetype
+        response = blob_response(request, file_path, mimetype, etag=activity.getBlobETag(), base64=from_app == 'App')
         filename = activity['object'].get('filename', activity['_id'])
         response.headers.add('Content-Disposition', 'attachment; filename={}'.format(filename))
     else:
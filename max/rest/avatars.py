@@ -1,18 +1,23 @@
 # -*- coding: utf-8 -*-
 from max.exceptions import ValidationError
+from max.rest import JSONResourceEntity
 from max.rest import endpoint
-from max.utils.twitter import download_twitter_user_image
+from max.utils.image import avatar_response
 from max.utils.image import get_avatar_folder
-from max.utils.twitter import get_twitter_api
+from max.utils.image import get_image_cache
+from max.utils.image_processing import process_image
+from max.utils.image_processing import render_avatars
+from max.utils.image_processing import save_image_file
+from max.utils.twitter import avatar_needs_refresh
+from max.utils.twitter import get_twitter_client
 from max.security.permissions import modify_avatar
 
 from pyramid.response import Response
 
-from PIL import Image
-from PIL import ImageOps
-
 import os
-import time
+
+# Maximum number of avatars that can be requested at once
+MAX_BULK_AVATARS = 100
 
 
 @endpoint(route_name='avatar', request_method='POST', permission=modify_avatar)
@@ -21,9 +26,6 @@ def postUserAvatar(user, request):
         Upload user avatar
     """
     base_folder = request.registry.settings.get('avatar_folder')
-    AVATAR_SIZE = (48, 48)
-    LARGE_SIZE = (250, 250)
-
     username = request.matchdict['username']
 
     if request.content_type != 'multipart/form-data' and \
@@ -33,23 +35,31 @@ def postUserAvatar(user, request):
     file_key = request.POST.keys()[0]
     input_file = request.POST[file_key].file
 
-    # Saving the standard avatar image in png format, resize if needed
-    regular_avatar_folder = get_avatar_folder(base_folder, 'people', username)
-    file_path = os.path.join(regular_avatar_folder, username)
-    input_file.seek(0)
-    image = Image.open(input_file)
-
-    avatar = ImageOps.fit(image, AVATAR_SIZE, method=Image.ANTIALIAS, centering=(0, 0))
-    avatar.save(file_path, 'PNG')
+    from PIL import Image
 
-    # Saving the large avatar image in png format, resize if needed
-    large_avatar_folder = get_avatar_folder(base_folder, 'people', username, size='large')
-    file_path = os.path.join(large_avatar_folder, username)
+    # Only the image header is read here, to reject unsupported files
     input_file.seek(0)
-    image = Image.open(input_file)
+    try:
+        Image.open(input_file)
+    except IOError:
+        raise ValidationError('Not supported image format.')
 
-    medium = ImageOps.fit(image, LARGE_SIZE, method=Image.ANTIALIAS, centering=(0, 0))
-    medium.save(file_path, 'PNG')
+    # The original image is stored as is, and the avatar sizes
+    # are generated from it on the image processing pool
+    input_file.seek(0)
+    original_folder = get_avatar_folder(base_folder, 'people', username, size='original')
+    original_path = os.path.join(original_folder, username)
+    save_image_file(original_path, input_file)
+
+    # Drop all the cached sizes of the previous avatar, now, and when the new ones are ready
+    image_cache = get_image_cache(request.registry)
+    image_cache.evict_prefix(('people', username))
+    process_image(
+        request.registry,
+        render_avatars,
+        (base_folder, username, original_path),
+        lambda username: image_cache.evict_prefix(('people', username))
+    )
 
     # return Response("Uploaded", status_int=201)
     import json
@@ -59,43 +69,91 @@ def postUserAvatar(user, request):
 
     return response
 
-@endpoint(route_name='avatar', request_method='GET')
-@endpoint(route_name='avatar_sizes', request_method='GET')
-def getUserAvatar(context, request):
+def get_user_avatar(request, username, named_size=''):
     """
-        Get user avatar
+        Returns the cached avatar of a user on a named size, loading it on a cache miss.
+
+        The file to serve is always resolved, and the cached avatar only reused
+        if it was read from that same file and it didn't change since, as new
+        avatars may have been uploaded through any other process.
     """
     base_folder = request.registry.settings.get('avatar_folder')
-    username = request.matchdict['username']
-    named_size = request.matchdict.get('size', '')
     filename = ''
 
+    image_cache = get_image_cache(request.registry)
+    cache_key = ('people', username, named_size)
+
     # First attempt to find an existing named size avatar
     # If image is not sized, this will fallback to regular avatar.
-    avatar_folder = get_avatar_folder(base_folder, 'people', username, size=named_size)
+    avatar_folder = get_avatar_folder(base_folder, 'people', username, size=named_size, create=False)
     if os.path.exists(os.path.join(avatar_folder, username)):
         filename = username
 
     # If we were loking for a named size avatar, reaching here
     # menans we did not found it, so fallback to base avatar
     elif named_size:
-        avatar_folder = get_avatar_folder(base_folder, 'people', username)
+        avatar_folder = get_avatar_folder(base_folder, 'people', username, create=False)
         if os.path.exists(os.path.join(avatar_folder, username)):
             filename = username
 
     # At this point we should have a filename set, if not, it means that we
     # couldn't locate any size of the requested avatar. In this case, set the
-    # missing avatar filename, based on context and size and located at root
-    # avatars folder
+    # missing avatar filename located at root avatars folder
+
+    avatar_folder = avatar_folder if filename else get_avatar_folder(base_folder, create=False)
+
+    # If the original image exists, the avatar sizes are still being generated,
+    # so the placeholder is served without caching it for this user
+    if not filename:
+        original_folder = get_avatar_folder(base_folder, 'people', username, size='original', create=False)
+        if os.path.exists(os.path.join(original_folder, username)):
+            cache_key = ('missing', 'people')
+
+    filename = filename if filename else 'missing-people.png'
+
+    return image_cache.load_fresh(cache_key, os.path.join(avatar_folder, filename))
+
 
-    avatar_folder = avatar_folder if filename else get_avatar_folder(base_folder)
-    named_size_sufix = '-{}'.format(named_size) if named_size else ''
-    filename = filename if filename else 'missing-people.png'.format(context, named_size_sufix)
+@endpoint(route_name='avatar', request_method='GET')
+@endpoint(route_name='avatar_sizes', request_method='GET')
+def getUserAvatar(context, request):
+    """
+        Get user avatar
+    """
+    username = request.matchdict['username']
+    named_size = request.matchdict.get('size', '')
 
-    data = open(os.path.join(avatar_folder, filename)).read()
-    image = Response(data, status_int=200)
-    image.content_type = 'image/png'
-    return image
+    return avatar_response(request, get_user_avatar(request, username, named_size))
+
+
+@endpoint(route_name='avatars', request_method='GET')
+def getUsersAvatars(context, request):
+    """
+        Get the avatar urls of a list of users
+
+        Returns a map of the given usernames to the url of their current avatar. Urls
+        carry the avatar version, so they can be cached until the user changes its avatar.
+
+        :query usernames Comma separated list of usernames
+        :query size The named size of the avatars, defaults to the regular size
+    """
+    usernames = [username.strip() for username in request.params.get('usernames', '').split(',') if username.strip()]
+    named_size = request.params.get('size', '')
+
+    if not usernames:
+        raise ValidationError('A list of usernames is required')
+
+    if len(usernames) > MAX_BULK_AVATARS:
+        raise ValidationError('A maximum of {} avatars can be requested at once'.format(MAX_BULK_AVATARS))
+
+    avatars = {}
+    for username in usernames:
+        cached_avatar = get_user_avatar(request, username, named_size)
+        route_name, route_params = ('avatar_sizes', {'size': named_size}) if named_size else ('avatar', {})
+        avatars[username] = request.route_path(route_name, username=username, _query={'v': cached_avatar.etag}, **route_params)
+
+    handler = JSONResourceEntity(request, avatars)
+    return handler.buildResponse()
 
 
 @endpoint(route_name='context_avatar', request_method='GET')
@@ -114,23 +172,18 @@ def getContextAvatar(context, request):
 
     context_image_filename = '%s/%s' % (avatar_folder, chash)
 
-    api = get_twitter_api(request.registry)
+    # Missing or outdated avatars are downloaded from twitter, on the background
+    # if enabled, so the current image or the placeholder is served meanwhile
+    if avatar_needs_refresh(context_image_filename):
+        get_twitter_client(request.registry).refresh_avatar(twitter_username, context_image_filename)
+
     if not os.path.exists(context_image_filename):
-        download_twitter_user_image(api, twitter_username, context_image_filename)
-
-    if os.path.exists(context_image_filename):
-        # Calculate time since last download and set if we have to re-download or not
-        modification_time = os.path.getmtime(context_image_filename)
-        hours_since_last_modification = (time.time() - modification_time) / 60 / 60
-        if hours_since_last_modification > 3:
-            download_twitter_user_image(api, twitter_username, context_image_filename)
-    else:
         context_image_filename = '{}/missing-context.png'.format(base_folder)
 
-    data = open(context_image_filename).read()
-    image = Response(data, status_int=200)
-    image.content_type = 'image/png'
-    return image
+    # Context avatars are refreshed from twitter on disk, so the cached
+    # image is only reused while the file on disk is still the same
+    image_cache = get_image_cache(request.registry)
+    return avatar_response(request, image_cache.load_fresh(('contexts', chash), context_image_filename))
 
 
 @endpoint(route_name='conversation_avatar', request_method='GET')
@@ -143,13 +196,13 @@ def getConversationUserAvatar(conversation, request):
     cid = request.matchdict['id']
 
     base_folder = request.registry.settings.get('avatar_folder')
-    avatar_folder = get_avatar_folder('conversations', cid)
+    avatar_folder = get_avatar_folder('conversations', cid, create=False)
 
     missing_avatar = os.path.join(base_folder, 'missing-conversation.png')
     conversation_avatar = os.path.join(avatar_folder, cid)
     filename = conversation_avatar if os.path.exists(conversation_avatar) else missing_avatar
 
-    data = open(filename).read()
-    image = Response(data, status_int=200)
-    image.content_type = 'image/png'
-    return image
+    # Conversation avatars can be replaced by any process, so the cached
+    # image is only reused while the file on disk is still the same
+    image_cache = get_image_cache(request.registry)
+    return avatar_response(request, image_cache.load_fresh(('conversations', cid), filename))
@@ -1,4 +1,8 @@
 # -*- coding: utf-8 -*-
+from max.counters import context_comments_key
+from max.counters import counted_request
+from max.counters import get_count
+from max.counters import user_comments_key
 from max.models import Activity
 from max.rest import JSONResourceEntity
 from max.rest import JSONResourceRoot
@@ -11,7 +15,6 @@ from max.security.permissions import list_comments
 
 from pyramid.httpexceptions import HTTPNoContent
 
-import requests
 
 @endpoint(route_name='user_comments', request_method='GET', permission=list_comments)
 def getUserComments(user, request):
@@ -26,6 +29,10 @@ def getUserComments(user, request):
         'actor.username': user['username']
     }
     is_head = request.method == 'HEAD'
+    if counted_request(request):
+        handler = JSONResourceRoot(request, get_count(request, user_comments_key(user['username']), query), stats=True)
+        return handler.buildResponse()
+
     comments = request.db.activity.search(
         query,
         sort="_id",
@@ -67,7 +74,10 @@ def getContextComments(context, request):
         }
     }
 
-    comments = request.db.activity.search(query, flatten=1, count=is_head, **searchParams(request))
+    if counted_request(request):
+        comments = get_count(request, context_comments_key(context['hash']), query)
+    else:
+        comments = request.db.activity.search(query, flatten=1, count=is_head, **searchParams(request))
     handler = JSONResourceRoot(request, comments, stats=is_head)
     return handler.buildResponse()
 
@@ -78,7 +88,11 @@ def getGlobalComments(comments, request):
         Get global comments
     """
     is_head = request.method == 'HEAD'
-    activities = request.db.activity.search({'verb': 'comment'}, flatten=1, count=is_head, **searchParams(request))
+    query = {'verb': 'comment'}
+    if counted_request(request, estimated=True):
+        activities = get_count(request, 'comments', query)
+    else:
+        activities = request.db.activity.search(query, flatten=1, count=is_head, **searchParams(request))
     handler = JSONResourceRoot(request, activities, stats=is_head)
     return handler.buildResponse()
 
@@ -140,6 +154,7 @@ def addActivityComment(activity, request):
                  'X-Oauth-Token': request.auth_headers[0],
                  'X-Oauth-Scope': request.auth_headers[2]}
 
+        import requests
         res = requests.post(url, headers=headers, data=payload, verify=False)
     except:
         pass
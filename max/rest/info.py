@@ -1,17 +1,23 @@
 # -*- coding: utf-8 -*-
 from max import RESOURCES
+from max.exceptions import Forbidden
+from max.metrics import EXPOSITION_CONTENT_TYPE
+from max.metrics import get_request_metrics
 from max.resources import Root
+from max.resources import getMAXVersion
 from max.rest import JSONResourceEntity
+from max.security.permissions import do_maintenance
 from max.security.permissions import view_server_settings
 from max.utils.markdown import reformat_markdown
 
 from pyramid.response import Response
+from pyramid.security import ACLAllowed
+from pyramid.settings import aslist
 from pyramid.view import view_config
 
+import hashlib
 import json
-import pkg_resources
 import re
-import sys
 
 
 @view_config(context=Root)
@@ -41,11 +47,30 @@ def getMaxPublicInfo(context, request):
         if setting in max_settings:
             settings[setting] = max_settings[setting]
 
-    settings['version'] = pkg_resources.require("max")[0].version
+    settings['version'] = getMAXVersion()
     handler = JSONResourceEntity(request, settings)
     return handler.buildResponse()
 
 
+@view_config(route_name='info_metrics', request_method='GET')
+def getMetrics(context, request):
+    """
+        /metrics
+
+        Returns the request metrics of this process, to be scraped by Prometheus
+
+        Requests from the addresses on `max.metrics_allowed_ips` don't need
+        to be authenticated, any other request needs to be made by a Manager.
+    """
+    allowed_ips = aslist(request.registry.settings.get('max.metrics_allowed_ips', ''))
+    if request.remote_addr not in allowed_ips and not isinstance(request.has_permission(do_maintenance), ACLAllowed):
+        raise Forbidden('You are not allowed to read the request metrics')
+
+    response = Response(get_request_metrics(request.registry).exposition())
+    response.content_type = EXPOSITION_CONTENT_TYPE
+    return response
+
+
 @view_config(route_name='info_settings', request_method='GET', permission=view_server_settings)
 def getMaxSettings(context, request):
     """
@@ -55,64 +80,73 @@ def getMaxSettings(context, request):
     """
     max_settings = request.registry.settings
     settings = {key: value for key, value in max_settings.items() if re.match('^(max|mongodb|cache|oauth)', key)}
-    settings['version'] = pkg_resources.require("max")[0].version
+    settings['version'] = getMAXVersion()
 
     handler = JSONResourceEntity(request, settings)
     return handler.buildResponse()
 
 
-@view_config(route_name='info_api', request_method='GET')
-def endpoints_view(context, request):
+def supports_head(method):
     """
+        Checks if a GET endpoint also answers HEAD requests, looking for the
+        HEAD method among the constants of its code
     """
-    views = request.registry.introspector.get_category('views')
-
-    def max_views():
-        """
-            Return route and view instrospection information
-            for all endpoints defined on RESOURCES (except this view)
-        """
-        for view in views:
-            related = view.get('related')
-            if related:
-                route = related[0].get('object', None)
-                if route is not None:
-                    if route.name in RESOURCES and \
-                       route.name != 'info_api' and \
-                       view['introspectable'].action_info.src.startswith('@endpoint'):
-                            yield view, route
-
-    def view_permission(view):
-        for item in view['related']:
-            if item.category_name == 'permissions':
-                return item.discriminator
-        return 'Anonymous'
-
-    def get_query_params(method):
-        params = []
-        endpoint_query_params = re.findall(r':query(\*?)\s+({.*?})\s+(.*?)\n', method.__doc__, re.MULTILINE)
-        for required, data, description in endpoint_query_params:
-            params.append({
-                'required': required == '*',
-                'data': json.loads(data),
-                'description': description
-            })
-        return params
-
-    def get_rest_params(method):
-        params = []
-        endpoint_rest_params = re.findall(r':rest\s+([\w\d\_\-]+)\s+(.*?)\n', method.__doc__, re.MULTILINE)
-        for name, description in endpoint_rest_params:
-            params.append({
-                'name': name,
-                'description': description
-            })
-        return params
+    return 'HEAD' in method.__code__.co_consts
 
+
+def view_permission(view):
+    for item in view['related']:
+        if item.category_name == 'permissions':
+            return item.discriminator
+    return 'Anonymous'
+
+
+def get_query_params(method):
+    params = []
+    endpoint_query_params = re.findall(r':query(\*?)\s+({.*?})\s+(.*?)\n', method.__doc__, re.MULTILINE)
+    for required, data, description in endpoint_query_params:
+        params.append({
+            'required': required == '*',
+            'data': json.loads(data),
+            'description': description
+        })
+    return params
+
+
+def get_rest_params(method):
+    params = []
+    endpoint_rest_params = re.findall(r':rest\s+([\w\d\_\-]+)\s+(.*?)\n', method.__doc__, re.MULTILINE)
+    for name, description in endpoint_rest_params:
+        params.append({
+            'name': name,
+            'description': description
+        })
+    return params
+
+
+def max_views(registry):
+    """
+        Return route and view instrospection information
+        for all endpoints defined on RESOURCES (except the api info view)
+    """
+    for view in registry.introspector.get_category('views'):
+        related = view.get('related')
+        if related:
+            route = related[0].get('object', None)
+            if route is not None:
+                if route.name in RESOURCES and \
+                   route.name != 'info_api' and \
+                   view['introspectable'].action_info.src.startswith('@endpoint'):
+                        yield view, route
+
+
+def build_api_endpoints(registry):
+    """
+        Returns the definition of all the endpoints, grouped by route and request method
+    """
     resources_by_route = {}
 
-    # Group all views by route and request method
-    for view, route in max_views():
+    for view, route in max_views(registry):
         view_settings = view['introspectable']
         resource_info = {
             'route': route.pattern,
@@ -124,19 +158,8 @@ def endpoints_view(context, request):
             'methods': {},
         }
 
-        # Import the method implementing the endpoint to get the docstring
-        module_fqdn = re.search(r'(?:max|\.egg)/(max/.*)\.py$', view_settings.action_info.file).groups()[0].replace('/', '.')
-        module_namespace, module_name = re.search(r'(.*?)\.([^\.]+$)', module_fqdn).groups()
-
-        method_name = re.search(r'([^.]+)$', view_settings.title).groups()[0]
-        module = getattr(sys.modules[module_namespace], module_name)
-        method = getattr(sys.modules[module_fqdn], method_name)
-
-        is_head = False
-        if view_settings['request_methods'] == 'GET':
-            code = open(module.__file__.rstrip('c')).read()
-            method_code = re.search(r'def\s+{}(.*?)(?:\n@|$)'.format(method_name), code, re.DOTALL)
-            is_head = re.search(r"request\.method\s+==\s+'HEAD'", method_code.groups()[0])
+        # The method implementing the endpoint, to get the docstring
+        method = view_settings['callable']
 
         resources_by_route.setdefault(route.name, resource_info)
 
@@ -167,45 +190,81 @@ def endpoints_view(context, request):
         # In case we found that the GET method has a HEAD version
         # append HEAD in order to duplicate method info entry of GET as HEAD
         methods = [view_settings['request_methods']]
-        if view_settings['request_methods'] == 'GET' and is_head:
+        if view_settings['request_methods'] == 'GET' and supports_head(method):
             methods.append('HEAD')
 
         for req_method in methods:
             # Create method entry
             resources_by_route[route.name]['methods'][req_method] = method_info
 
-    if request.params.get('by_category'):
-        endpoints = resources_by_route
-        endpoints_by_category = {}
-
-        for route_name, route_info in endpoints.items():
-            endpoints_by_category.setdefault(route_info['category'], [])
-            endpoints_by_category[route_info['category']].append(route_info)
-
-        sorted_categories = endpoints_by_category.keys()
-        sorted_categories.sort()
-
-        categories = []
-        for category_name in sorted_categories:
-
-            routes = []
-            for route_info in endpoints_by_category[category_name]:
-                routes.append({
-                    'route_id': route_info['id'],
-                    'filesystem': route_info['filesystem'],
-                    'route_name': route_info['name'],
-                    'route_url': route_info['url'],
-                    'methods': route_info['methods']
-                })
-            category = {
-                'name': category_name,
-                'id': category_name.lower().replace(' ', '-'),
-                'resources': sorted(routes, key=lambda route: route['route_name'])
-            }
-            categories.append(category)
-
-        handler = JSONResourceEntity(request, categories)
-    else:
-        handler = JSONResourceEntity(request, resources_by_route)
+    return resources_by_route
 
-    return handler.buildResponse()
+
+def group_api_endpoints(endpoints):
+    """
+        Returns the definition of the endpoints, grouped by category
+    """
+    endpoints_by_category = {}
+
+    for route_name, route_info in endpoints.items():
+        endpoints_by_category.setdefault(route_info['category'], [])
+        endpoints_by_category[route_info['category']].append(route_info)
+
+    sorted_categories = endpoints_by_category.keys()
+    sorted_categories.sort()
+
+    categories = []
+    for category_name in sorted_categories:
+
+        routes = []
+        for route_info in endpoints_by_category[category_name]:
+            routes.append({
+                'route_id': route_info['id'],
+                'filesystem': route_info['filesystem'],
+                'route_name': route_info['name'],
+                'route_url': route_info['url'],
+                'methods': route_info['methods']
+            })
+        category = {
+            'name': category_name,
+            'id': category_name.lower().replace(' ', '-'),
+            'resources': sorted(routes, key=lambda route: route['route_name'])
+        }
+        categories.append(category)
+
+    return categories
+
+
+def get_api_info(registry):
+    """
+        Returns the serialized api definition, by route and by category,
+        along with its etag. Views don't change while running, so it's
+        built only once, on the first request.
+    """
+    api_info = getattr(registry, 'api_info', None)
+    if api_info is None:
+        endpoints = build_api_endpoints(registry)
+        api_info = {}
+        for variant, data in [('by_route', endpoints), ('by_category', group_api_endpoints(endpoints))]:
+            body = json.dumps(data)
+            api_info[variant] = (body, hashlib.md5(body).hexdigest())
+        registry.api_info = api_info
+    return api_info
+
+
+@view_config(route_name='info_api', request_method='GET')
+def endpoints_view(context, request):
+    """
+        /info/api
+
+        Returns the definition of all the endpoints, by route or by category.
+        The response has an ETag, so clients can revalidate their copy.
+    """
+    variant = 'by_category' if request.params.get('by_category') else 'by_route'
+    body, etag = get_api_info(request.registry)[variant]
+
+    response = Response(body)
+    response.content_type = 'application/json'
+    response.etag = etag
+    response.conditional_response = True
+    return response
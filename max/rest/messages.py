@@ -9,12 +9,12 @@ from max.security.permissions import add_message
 from max.security.permissions import list_messages
 from max.security.permissions import view_message
 from max.utils import searchParams
+from max.utils.blobs import blob_response
+from max.utils.image import image_attachment_response
 from max.utils.dicts import flatten
 
 from pyramid.httpexceptions import HTTPGone
-from pyramid.response import Response
 
-from base64 import b64encode
 from bson import ObjectId
 from pymongo import DESCENDING
 
@@ -87,6 +87,7 @@ def add_message(conversation, request):
         newmessage['_id'] = ObjectId(message_oid)
         newmessage.process_file(request, message_file)
         newmessage.save()
+        newmessage.generate_thumbnails(request)
         if mobile:
             notifier = RabbitNotifications(request)
             notifier.add_conversation_message(conversation, newmessage)
@@ -108,19 +109,7 @@ def getMessageImageAttachment(message, request):
         Get a message image
     """
     file_size = request.matchdict.get('size', 'full')
-    image, mimetype = message.getImage(size=file_size)
-
-    if image is not None:
-        if request.headers.get('content-type', '') == 'application/base64':
-            image = b64encode(image)
-            mimetype = 'application/base64'
-
-        response = Response(image, status_int=200)
-        response.content_type = mimetype
-    else:
-        response = HTTPGone()
-
-    return response
+    return image_attachment_response(request, message, file_size)
 
 
 @endpoint(route_name='message_file_download', request_method='GET', permission=view_message)
@@ -128,17 +117,11 @@ def getMessageFileAttachment(message, request):
     """
         Get a message file
     """
-    file_data, mimetype = message.getFile()
+    file_path, mimetype = message.getFile()
 
-    if file_data is not None:
+    if file_path is not None:
         from_app = request.headers.get('X-From-Utalk', 'None') # app or None
-        if from_app == 'App':
-            pdf = b64encode(file_data)
-            mimetype = 'application/base64'
-            response = Response(pdf, status_int=200)
-        else:
-            response = Response(file_data, status_int=200)
-        response.content_type = mimetype
+        response = blob_response(request, file_path, mimetype, etag=message.getBlobETag(), base64=from_app == 'App')
         filename = message['object'].get('filename', message['_id'])
         response.headers.add('Content-Disposition', 'attachment; filename={}'.format(filename))
     else:
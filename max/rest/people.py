@@ -8,8 +8,10 @@ from max.rest import JSONResourceRoot
 from max.rest import endpoint
 from max.utils.dicts import flatten
 from max.utils import searchParams
+from max.utils.users import import_users
 from max.security.permissions import add_people
 from max.security.permissions import delete_user
+from max.security.permissions import import_people
 from max.security.permissions import list_visible_people
 from max.security.permissions import modify_user
 from max.security.permissions import view_user_profile
@@ -121,6 +123,37 @@ def addUser(users, request):
     return handler.buildResponse()
 
 
+@endpoint(
+    route_name='admin_people_import', request_method='POST',
+    permission=import_people,
+    modifiers=['notifications'])
+def importUsers(users, request):
+    """
+        Import users in bulk
+
+        Creates all the users found in the request body, that must be a JSONL stream
+        with a user object per line, with the same attributes accepted when adding a single user.
+
+        Users that already exist are detected at once and left untouched, new users are
+        inserted in batches and their exchanges are created through the same broker connection.
+        Exchanges creation can be disabled with `notifications=0`.
+
+        The response is a report with the number of users created, already existing and
+        invalid, the errors found on each failed line and the achieved throughput.
+
+        + Request
+
+            {"username": "user1", "displayName": "User 1"}
+            {"username": "user2", "displayName": "User 2"}
+
+    """
+    create_exchanges = asbool(request.params.get('notifications', True))
+    report = import_users(request, request.body_file, notifications=create_exchanges)
+    code = 201 if report['created'] else 200
+    handler = JSONResourceEntity(request, report, status_code=code)
+    return handler.buildResponse()
+
+
 @endpoint(
     route_name='user', request_method='GET',
     permission=view_user_profile)
@@ -4,14 +4,17 @@ from max import DEFAULT_CONTEXT_PERMISSIONS_PERMANENCY
 from max.MADMax import MADMaxCollection
 from max.exceptions import InvalidPermission
 from max.exceptions import ObjectNotFound
+from max.exceptions import ValidationError
 from max.models import Activity
 from max.rest import JSONResourceEntity
 from max.rest import JSONResourceRoot
 from max.rest import endpoint
 from max.utils import searchParams
 from max.security.permissions import add_subscription
+from max.security.permissions import add_subscriptions_bulk
 from max.security.permissions import manage_subcription_permissions
 from max.security.permissions import remove_subscription
+from max.security.permissions import remove_subscriptions_bulk
 from max.security.permissions import view_subscriptions
 
 from pyramid.httpexceptions import HTTPNoContent
@@ -65,6 +68,106 @@ def unsubscribe(context, request):
     return HTTPNoContent()
 
 
+def get_bulk_usernames(request):
+    """
+        Extracts and validates the list of usernames posted to a bulk subscriptions endpoint
+    """
+    usernames = request.decoded_payload
+
+    valid_usernames = isinstance(usernames, list)
+    if valid_usernames:
+        valid_usernames = False not in [isinstance(username, (str, unicode)) for username in usernames]
+    if not valid_usernames:
+        raise ValidationError("Sorry, We're expecting a list of usernames...")
+
+    # Remove duplicates, preserving the original order
+    unique_usernames = []
+    seen_usernames = set()
+    for username in usernames:
+        username = username.lower().strip()
+        if username and username not in seen_usernames:
+            seen_usernames.add(username)
+            unique_usernames.append(username)
+    return unique_usernames
+
+
+@endpoint(route_name='context_subscriptions_bulk', request_method='POST', permission=add_subscriptions_bulk)
+def subscribeBulk(context, request):
+    """
+        Subscribe users to context in bulk
+
+        Subscribes all the users in the posted list to the context at once. Users
+        are updated with a single write, subscribe activities are inserted together
+        and notification bindings are created using a single broker connection.
+
+        The response reports which users were subscribed, which ones were already
+        subscribed and which ones don't exist. If any user is subscribed, a **201 CREATED**
+        code is returned, otherwise **200 OK**.
+
+        + Request
+
+            ["user1", "user2", "user3"]
+
+    """
+    usernames = get_bulk_usernames(request)
+
+    subscription_unique_field = '{}.{}'.format(context.user_subscription_storage, context.unique.lstrip('_'))
+    fields = {'username': 1, 'displayName': 1, subscription_unique_field: 1}
+    found_users = request.db.db.users.find({'username': {'$in': usernames}}, fields)
+
+    existing_users = {}
+    already_subscribed = set()
+    for user in found_users:
+        existing_users[user['username']] = user
+        subscribed_contexts_hashes = set([a['hash'] for a in user.get(context.user_subscription_storage, [])])
+        if context['hash'] in subscribed_contexts_hashes:
+            already_subscribed.add(user['username'])
+
+    unknown = [username for username in usernames if username not in existing_users]
+    new_subscribers = [username for username in usernames if username in existing_users and username not in already_subscribed]
+
+    if new_subscribers:
+        context.addUsersSubscriptions(new_subscribers)
+
+        rest_params = {'object': context,
+                       'verb': 'subscribe'}
+        activities = Activity.from_users_batch(request, [existing_users[username] for username in new_subscribers], rest_params=rest_params)
+        request.db.db.activity.insert_many(activities, ordered=False)
+
+    result = {
+        'subscribed': new_subscribers,
+        'already_subscribed': [username for username in usernames if username in already_subscribed],
+        'unknown': unknown
+    }
+    code = 201 if new_subscribers else 200
+    handler = JSONResourceEntity(request, result, status_code=code)
+    return handler.buildResponse()
+
+
+@endpoint(route_name='context_subscriptions_bulk', request_method='DELETE', permission=remove_subscriptions_bulk)
+def unsubscribeBulk(context, request):
+    """
+        Unsubscribe users from context in bulk
+
+        Unsubscribes all the users in the list from the context at once. Users
+        are updated with a single write, and notification bindings are destroyed
+        using a single broker connection. Users not subscribed are ignored.
+
+        + Request
+
+            ["user1", "user2", "user3"]
+
+    """
+    usernames = get_bulk_usernames(request)
+
+    subscription_unique_field = '{}.{}'.format(context.user_subscription_storage, context.unique.lstrip('_'))
+    query = {'username': {'$in': usernames}, subscription_unique_field: context.getIdentifier()}
+    subscribed_usernames = [user['username'] for user in request.db.db.users.find(query, {'username': 1})]
+
+    context.removeUsersSubscriptions(subscribed_usernames)
+    return HTTPNoContent()
+
+
 @endpoint(route_name='context_unsubscriptionpush', request_method='POST', permission=add_subscription)
 def unsubscribepush(context, request):
     """
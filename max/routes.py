@@ -33,6 +33,7 @@ RESOURCES['users'] = dict(route='/people', category='User', name='Users', traver
 RESOURCES['user'] = dict(route='/people/{username}', category='User', name='User', traverse='/people/{username}')
 RESOURCES['avatar'] = dict(route='/people/{username}/avatar', filesystem=True, category='User', name='User avatar', traverse='/people/{username}')
 RESOURCES['avatar_sizes'] = dict(route='/people/{username}/avatar/{size}', filesystem=True, category='User', name='User avatar sizes', traverse='/people/{username}')
+RESOURCES['avatars'] = dict(route='/avatars', filesystem=True, category='User', name='Users avatars')
 RESOURCES['user_activities'] = dict(route='/people/{username}/activities', category='Activities', name='User activities', traverse='/people/{username}')
 RESOURCES['timeline'] = dict(route='/people/{username}/timeline', category='Activities', name='User Timeline', traverse='/people/{username}')
 RESOURCES['timeline_authors'] = dict(route='/people/{username}/timeline/authors', category='Activities', name='User Timeline authors', traverse='/people/{username}')
@@ -72,6 +73,7 @@ RESOURCES['context_activities'] = dict(route='/contexts/{hash}/activities', cate
 RESOURCES['context_comments'] = dict(route='/contexts/{hash}/comments', category='Comments', name='Context comments', traverse='/contexts/{hash}')
 RESOURCES['context_activities_authors'] = dict(route='/contexts/{hash}/activities/authors', category='Activities', name='Context authors', traverse='/contexts/{hash}')
 RESOURCES['context_subscriptions'] = dict(route='/contexts/{hash}/subscriptions', category='Contexts', name='Users subscribed to context', traverse='/contexts/{hash}')
+RESOURCES['context_subscriptions_bulk'] = dict(route='/contexts/{hash}/bulk-subscriptions', category='Contexts', name='Bulk users subscriptions', traverse='/contexts/{hash}')
 RESOURCES['context_subscription'] = dict(route='/contexts/{hash}/subscriptions/{username}', category='Contexts', name='User subscription', traverse='/contexts/{hash}')
 RESOURCES['context_users_unsubscriptionpush'] = dict(route='/contexts/{hash}/unsubscriptionpush', category='Contexts', name='Users unsubscribed push to context', traverse='/contexts/{hash}')
 RESOURCES['context_unsubscriptionpush'] = dict(route='/contexts/{hash}/unsubscriptionpush/{username}', category='Contexts', name='User unsubscribed push', traverse='/contexts/{hash}')
@@ -101,6 +103,7 @@ RESOURCES['message_file_download'] = dict(route='/messages/{id}/file/download',
 
 RESOURCES['info'] = dict(route='/info', category='Management', name='Public settings')
 RESOURCES['info_api'] = dict(route='/info/api', category='Management', name='Api endpoints definition')
+RESOURCES['info_metrics'] = dict(route='/metrics', category='Management', name='Request metrics')
 RESOURCES['info_settings'] = dict(route='/info/settings', category='Management', name='Restricted settings')
 
 # Maintenance Resources
@@ -108,14 +111,20 @@ RESOURCES['info_settings'] = dict(route='/info/settings', category='Management',
 RESOURCES['admin_security'] = dict(route='/admin/security', category='Management', name='Security settings', traverse="/security", actor_not_required=['GET'])
 RESOURCES['admin_security_role_user'] = dict(route='/admin/security/roles/{role}/users/{user}', category='Management', name='User role', traverse="/security/", actor_not_required=['GET', 'POST', 'DELETE'])
 RESOURCES['admin_security_users'] = dict(route='/admin/security/users', category='Management', name='Users with security', traverse="/security/", actor_not_required=['GET'])
+RESOURCES['admin_people_import'] = dict(route='/admin/import/people', category='Management', name='People bulk import', traverse='/people')
 RESOURCES['maintenance_keywords'] = dict(route='/admin/maintenance/keywords', category='Management', name='Keywords maintenance', actor_not_required=['POST'])
 RESOURCES['maintenance_dates'] = dict(route='/admin/maintenance/dates', category='Management', name='Dates maintenance', actor_not_required=['POST'])
 RESOURCES['maintenance_subscriptions'] = dict(route='/admin/maintenance/subscriptions', category='Management', name='Subscriptions maintenance', actor_not_required=['POST'])
 RESOURCES['maintenance_conversations'] = dict(route='/admin/maintenance/conversations', category='Management', name='Conversations maintenance', actor_not_required=['POST'])
 RESOURCES['maintenance_users'] = dict(route='/admin/maintenance/users', category='Management', name='Users Maintenance', actor_not_required=['POST'])
 RESOURCES['maintenance_tokens'] = dict(route='/admin/maintenance/tokens', category='Management', name='Tokens Maintenance', actor_not_required=['POST'])
+RESOURCES['maintenance_jobs'] = dict(route='/admin/maintenance/jobs', category='Management', name='Maintenance jobs', actor_not_required=['GET'])
+RESOURCES['maintenance_job'] = dict(route='/admin/maintenance/jobs/{id}', category='Management', name='Maintenance job', actor_not_required=['GET', 'POST'])
 RESOURCES['maintenance_exceptions'] = dict(route='/admin/maintenance/exceptions', category='Management', name='Error Exception list', actor_not_required=['GET'])
 RESOURCES['maintenance_exception'] = dict(route='/admin/maintenance/exceptions/{hash}', category='Management', name='Error Exception', actor_not_required=['GET'])
+RESOURCES['maintenance_deprecations'] = dict(route='/admin/maintenance/deprecations', category='Management', name='Deprecated routes usage', actor_not_required=['GET'])
+RESOURCES['maintenance_mongoprobe'] = dict(route='/admin/maintenance/mongoprobe', category='Management', name='Mongodb queries statistics', actor_not_required=['GET', 'DELETE'])
+RESOURCES['maintenance_hubmonitor'] = dict(route='/admin/maintenance/hubmonitor', category='Management', name='Gevent hub blocks statistics', actor_not_required=['GET', 'DELETE'])
 
 # Routes not currently implemented
 
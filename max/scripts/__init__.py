@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+from pyramid.paster import bootstrap
+from pyramid.paster import setup_logging
+
+
+def get_max_environment(config_uri):
+    """
+        Bootstraps a max application from a paste ini file, to run max code
+        outside a real http request.
+
+        Returns the pyramid environment (app, request, registry, closer ...)
+    """
+    setup_logging(config_uri)
+    env = bootstrap(config_uri)
+    return env
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from max.scripts import get_max_environment
+from max.utils.users import IMPORT_BATCH_SIZE
+from max.utils.users import import_users
+
+import argparse
+import json
+import sys
+
+
+def main(argv=sys.argv[1:]):
+    """
+        Imports users into max from a JSONL file, one user object per line.
+    """
+    parser = argparse.ArgumentParser(description='Import users from a JSONL stream into max.')
+    parser.add_argument('config', help='max .ini configuration file')
+    parser.add_argument('input', nargs='?', default='-', help='JSONL file to import, - to read from stdin (default)')
+    parser.add_argument('-c', '--creator', default=None, help='username recorded as creator of the new users')
+    parser.add_argument('-b', '--batch-size', type=int, default=IMPORT_BATCH_SIZE, help='users inserted on each write')
+    parser.add_argument('--no-notifications', dest='notifications', action='store_false', help="don't create rabbitmq exchanges")
+    args = parser.parse_args(argv)
+
+    env = get_max_environment(args.config)
+    stream = sys.stdin if args.input == '-' else open(args.input)
+
+    try:
+        report = import_users(
+            env['request'], stream,
+            creator=args.creator,
+            notifications=args.notifications,
+            batch_size=args.batch_size)
+    finally:
+        stream.close()
+        env['closer']()
+
+    print json.dumps(report, indent=4)
+    return 0 if not report['invalid'] else 1
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+from max.maintenance import MAINTENANCE_CHUNK_SIZE
+from max.maintenance import create_job
+from max.maintenance import format_job
+from max.maintenance import get_id_ranges
+from max.maintenance import get_jobs_collection
+from max.maintenance import get_worker_id
+from max.maintenance import run_job_range
+from max.maintenance.jobs import MAINTENANCE_JOBS
+from max.scripts import get_max_environment
+
+from bson import ObjectId
+from datetime import datetime
+from multiprocessing import cpu_count
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+# Placeholder for the open ends of the first and last ranges of _ids
+OPEN_RANGE = '-'
+
+
+def start_range_process(config, chunk_size, job, step_index, min_id, max_id):
+    """
+        Starts a new interpreter processing a range of _ids of a job step.
+
+        Ranges are processed on fresh processes instead of forked ones, so they
+        don't share the mongodb and rabbitmq connections nor the gevent hub of
+        the parent process.
+    """
+    command = [
+        sys.executable, '-m', 'max.scripts.maintenance', config, job['name'],
+        '--chunk-size', str(chunk_size),
+        '--range', str(job['_id']), job['worker'], str(step_index),
+        str(min_id) if min_id is not None else OPEN_RANGE,
+        str(max_id) if max_id is not None else OPEN_RANGE
+    ]
+    return subprocess.Popen(command, stdout=subprocess.PIPE)
+
+
+def wait_range_process(process):
+    """
+        Waits for a range process to finish.
+
+        Returns the number of documents processed and the time spent.
+    """
+    output, errors = process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError('Maintenance range process exited with code {}'.format(process.returncode))
+    result = json.loads(output.strip().splitlines()[-1])
+    return result['processed'], result['elapsed']
+
+
+def process_range(args):
+    """
+        Processes a range of _ids of a maintenance job step, on a range process,
+        and prints the number of documents processed and the time spent.
+    """
+    job_id, worker, step_index, min_id, max_id = args.range
+    env = get_max_environment(args.config)
+    try:
+        job = {'_id': ObjectId(job_id), 'name': args.job, 'worker': worker}
+        start = time.time()
+        processed = run_job_range(
+            env['request'], job, int(step_index),
+            min_id=ObjectId(min_id) if min_id != OPEN_RANGE else None,
+            max_id=ObjectId(max_id) if max_id != OPEN_RANGE else None,
+            chunk_size=args.chunk_size)
+    finally:
+        env['closer']()
+
+    print json.dumps({'processed': processed, 'elapsed': time.time() - start})
+    return 0
+
+
+def main(argv=sys.argv[1:]):
+    """
+        Runs a maintenance job, splitting each of its steps in ranges of _ids
+        processed in parallel by separate processes.
+    """
+    parser = argparse.ArgumentParser(description='Run a max maintenance job in parallel.')
+    parser.add_argument('config', help='max .ini configuration file')
+    parser.add_argument('job', choices=MAINTENANCE_JOBS.keys(), help='maintenance job to run')
+    parser.add_argument('-p', '--processes', type=int, default=cpu_count(), help='number of worker processes (default: number of cores)')
+    parser.add_argument('-c', '--chunk-size', type=int, default=MAINTENANCE_CHUNK_SIZE, help='documents processed on each bulk write')
+    parser.add_argument('--range', nargs=5, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.range:
+        return process_range(args)
+
+    env = get_max_environment(args.config)
+    processes = []
+    try:
+        request = env['request']
+        job = create_job(request, args.job, worker=get_worker_id())
+        jobs = get_jobs_collection(request)
+
+        # Steps depend on the results of the previous ones, so only
+        # the ranges of the same step are processed in parallel
+        report = {'job': args.job, 'processes': args.processes, 'steps': []}
+        start = time.time()
+        try:
+            for step_index, step in enumerate(MAINTENANCE_JOBS[args.job]):
+                ranges = get_id_ranges(request, step, args.processes)
+                processes = [start_range_process(args.config, args.chunk_size, job, step_index, min_id, max_id) for min_id, max_id in ranges]
+                results = [wait_range_process(process) for process in processes]
+
+                report['steps'].append({
+                    'collection': step.collection,
+                    'ranges': len(ranges),
+                    'processed': sum([count for count, elapsed in results]),
+                    'slowest_range': round(max([elapsed for count, elapsed in results] or [0]), 3)
+                })
+                jobs.update_one({'_id': job['_id'], 'worker': job['worker']}, {
+                    '$set': {'step': step_index + 1, 'heartbeat': datetime.utcnow()}
+                })
+        except Exception as exc:
+            jobs.update_one({'_id': job['_id'], 'worker': job['worker']}, {'$set': {'status': 'failed', 'error': repr(exc)}})
+            raise
+
+        jobs.update_one({'_id': job['_id'], 'worker': job['worker']}, {'$set': {'status': 'finished', 'finished': datetime.utcnow()}})
+        report['elapsed'] = round(time.time() - start, 3)
+        report['status'] = format_job(jobs.find_one({'_id': job['_id']}))
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
+        env['closer']()
+
+    print json.dumps(report, indent=4)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from max import maxlogger
+from max.maintenance import MAINTENANCE_CHUNK_SIZE
+from max.maintenance import MAINTENANCE_JOB_LEASE
+from max.maintenance import claim_job
+from max.maintenance import run_job
+from max.scripts import get_max_environment
+
+import argparse
+import os
+import socket
+import sys
+import time
+
+
+def main(argv=sys.argv[1:]):
+    """
+        Runs pending maintenance jobs, and resumes the interrupted ones.
+    """
+    parser = argparse.ArgumentParser(description='Run max maintenance jobs in a separate process.')
+    parser.add_argument('config', help='max .ini configuration file')
+    parser.add_argument('-c', '--chunk-size', type=int, default=None, help='documents processed between checkpoints')
+    parser.add_argument('-l', '--lease', type=int, default=MAINTENANCE_JOB_LEASE, help='seconds without checkpoints before a running job is considered interrupted')
+    parser.add_argument('-p', '--poll', type=int, default=5, help='seconds to wait between checks for new jobs')
+    parser.add_argument('--once', action='store_true', help='exit when there are no more jobs to run')
+    args = parser.parse_args(argv)
+
+    env = get_max_environment(args.config)
+    request = env['request']
+    settings = env['registry'].settings
+    chunk_size = args.chunk_size or int(settings.get('maintenance.chunk_size', MAINTENANCE_CHUNK_SIZE))
+    worker = '{}:{}'.format(socket.gethostname(), os.getpid())
+
+    try:
+        while True:
+            job = claim_job(request, worker, lease=args.lease)
+            if job is None:
+                if args.once:
+                    break
+                time.sleep(args.poll)
+                continue
+
+            maxlogger.info('Running maintenance job {} ({}) on {}'.format(job['name'], job['_id'], worker))
+            try:
+                run_job(request, job, chunk_size=chunk_size)
+            except Exception:
+                maxlogger.exception('Maintenance job {} ({}) failed'.format(job['name'], job['_id']))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        env['closer']()
+
+    return 0
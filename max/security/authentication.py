@@ -5,6 +5,7 @@ from zope.interface import implementer
 from max.exceptions import Unauthorized
 from max.resources import getMAXSettings
 from max.security import Owner, is_owner, get_user_roles
+from max.timing import timed
 
 from pyramid.interfaces import IAuthenticationPolicy
 from pyramid.security import Authenticated
@@ -13,14 +14,13 @@ from pyramid.settings import asbool
 
 from beaker.cache import cache_region
 
-import requests
-
 
 @cache_region('oauth_token')
 def check_token(url, username, token, scope, oauth_standard):
     """
         Checks if a user matches the given token.
     """
+    import requests
     payload = {"access_token": token, "username": username}
     payload['scope'] = scope if scope else 'widgetcli'
     return requests.post(url, data=payload, verify=False).status_code == 200
@@ -54,10 +54,11 @@ class MaxAuthenticationPolicy(object):
             raise Unauthorized('The specified scope is not allowed for this resource.')
 
         settings = getMAXSettings(request)
-        valid = check_token(
-            settings['max_oauth_check_endpoint'],
-            username, oauth_token, scope,
-            asbool(settings.get('max_oauth_standard', True)))
+        with timed('oauth', request):
+            valid = check_token(
+                settings['max_oauth_check_endpoint'],
+                username, oauth_token, scope,
+                asbool(settings.get('max_oauth_standard', True)))
 
         if not valid:
             raise Unauthorized('Invalid token.')
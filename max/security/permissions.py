@@ -6,6 +6,7 @@ delete_context = 'Delete context'
 view_context = 'View context'
 
 add_people = 'Add people'
+import_people = 'Import people in bulk'
 list_visible_people = 'List visible people'
 view_user_profile = 'View user profile'
 view_private_fields = 'View private fields'
@@ -16,6 +17,8 @@ add_subscription = 'Subscribe an user to a context'
 remove_subscription = 'Unsubscribe an user to a context'
 manage_subcription_permissions = 'Grant or revoke permissions on a subscription'
 view_subscriptions = 'View all subscriptions of user to a context'
+add_subscriptions_bulk = 'Subscribe many users to a context at once'
+remove_subscriptions_bulk = 'Unsubscribe many users from a context at once'
 
 modify_immutable_fields = 'Modify immutable fields'
 change_ownership = "Change an object's owner"
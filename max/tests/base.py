@@ -50,14 +50,58 @@ def http_mock_twitter_user_image(image, status=200):
     )
 
 
-def http_mock_bitly(status=200, body=None):
+def http_mock_twitter_api(calls=None, userid='526326641', fail=False):
+    """
+        Fakes the twitter api endpoints used by max. If a calls dict is
+        given, the number of calls to each endpoint are counted there.
+    """
+    calls = {} if calls is None else calls
+
+    def endpoint(name, response):
+        def callback(request, uri, headers):
+            calls[name] = calls.get(name, 0) + 1
+            if fail:
+                return (500, headers, json.dumps({'errors': [{'message': 'Simulated Twitter Failure', 'code': 131}]}))
+            return (200, headers, json.dumps(response))
+        return callback
+
+    user = {
+        'id': int(userid),
+        'id_str': userid,
+        'screen_name': 'maxupcnet',
+        'profile_image_url_https': 'https://pbs.twimg.com/profile_images/1901828730/logo_MAX_color_normal.png'
+    }
+    httpretty.register_uri(
+        httpretty.GET, re.compile(r'https://api.twitter.com/1.1/account/verify_credentials.json.*'),
+        body=endpoint('verify_credentials', user),
+        content_type="application/json"
+    )
+    httpretty.register_uri(
+        httpretty.GET, re.compile(r'https://api.twitter.com/1.1/users/show.json.*'),
+        body=endpoint('get_user', user),
+        content_type="application/json"
+    )
+    return calls
+
+
+def http_mock_bitly(status=200, body=None, calls=None):
+    """
+        Fakes the bitly shorten endpoint. If a calls list is given,
+        the urls requested to be shortened are appended there.
+    """
     body = '{"status_code": %s, "data": {"url": "http://shortened.url"}}' % status if body is None else body
+    calls = [] if calls is None else calls
+
+    def shorten(request, uri, headers):
+        calls.append(request.querystring.get('longUrl', [None])[0])
+        return (status, headers, body)
+
     httpretty.register_uri(
         httpretty.GET, re.compile("http://api.bitly.com"),
-        body=body,
-        status=status,
+        body=shorten,
         content_type="application/json"
     )
+    return calls
 
 
 class MockTweepyAPI(object):
@@ -276,6 +320,10 @@ class MaxTestBase(object):
         self.app.registry.max_store.drop_collection('security')
         self.app.registry.max_store.drop_collection('tokens')
         self.app.registry.max_store.drop_collection('cloudapis')
+        self.app.registry.max_store.drop_collection('maintenance_jobs')
+        self.app.registry.max_store.drop_collection('shortened_urls')
+        self.app.registry.max_store.drop_collection('counters')
+        self.app.registry.max_store.drop_collection('versions')
 
     def assertFileExists(self, path):
         self.assertTrue(os.path.exists(path))
@@ -58,6 +58,14 @@ class InfoACLTests(unittest.TestCase, MaxTestBase):
         self.testapp.post('/admin/maintenance/users', headers=oauth2Header(username), status=403)
         self.testapp.get('/admin/maintenance/exceptions', headers=oauth2Header(username), status=403)
         self.testapp.get('/admin/maintenance/exceptions/000000', headers=oauth2Header(username), status=403)
+        self.testapp.get('/admin/maintenance/deprecations', headers=oauth2Header(username), status=403)
+        self.testapp.get('/admin/maintenance/mongoprobe', headers=oauth2Header(username), status=403)
+        self.testapp.delete('/admin/maintenance/mongoprobe', headers=oauth2Header(username), status=403)
+        self.testapp.get('/admin/maintenance/hubmonitor', headers=oauth2Header(username), status=403)
+        self.testapp.delete('/admin/maintenance/hubmonitor', headers=oauth2Header(username), status=403)
+        self.testapp.get('/admin/maintenance/jobs', headers=oauth2Header(username), status=403)
+        self.testapp.get('/admin/maintenance/jobs/000000', headers=oauth2Header(username), status=403)
+        self.testapp.post('/admin/maintenance/jobs/000000', headers=oauth2Header(username), status=403)
 
     def test_execute_maintenance_as_manager(self):
         """
@@ -72,3 +80,5 @@ class InfoACLTests(unittest.TestCase, MaxTestBase):
         self.testapp.post('/admin/maintenance/users', headers=oauth2Header(test_manager), status=200)
         self.testapp.get('/admin/maintenance/exceptions', headers=oauth2Header(test_manager), status=200)
         self.testapp.get('/admin/maintenance/exceptions/000000', headers=oauth2Header(test_manager), status=404)
+        self.testapp.get('/admin/maintenance/jobs', headers=oauth2Header(test_manager), status=200)
+        self.testapp.get('/admin/maintenance/jobs/000000', headers=oauth2Header(test_manager), status=404)
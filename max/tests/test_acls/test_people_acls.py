@@ -62,6 +62,25 @@ class PeopleACLTests(unittest.TestCase, MaxTestBase):
         username = 'sheldon'
         self.testapp.post('/people', json.dumps({"username": username}), headers=oauth2Header(username), status=201)
 
+    # Import people tests
+
+    def test_import_people_as_manager(self):
+        """
+            Given i'm a user that has the Manager role
+            When i try to import people in bulk
+            I succeed
+        """
+        self.testapp.post('/admin/import/people?notifications=0', json.dumps({"username": 'sheldon'}), headers=oauth2Header(test_manager), status=201)
+
+    def test_import_people_as_non_manager(self):
+        """
+            Given i'm user that doesn't have the Manager role
+            When i try to import people in bulk
+            I get a Forbidden exception
+        """
+        username = 'sheldon'
+        self.testapp.post('/admin/import/people', json.dumps({"username": username}), headers=oauth2Header(username), status=403)
+
     # View profile tests
 
     def test_get_person_as_manager(self):
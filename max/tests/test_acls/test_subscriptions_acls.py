@@ -494,3 +494,60 @@ class SubscriptionsACLTests(unittest.TestCase, MaxTestBase):
         self.create_context(create_context, permissions={'read': 'subscribed'}, owner=username)
         self.admin_subscribe_user_to_context(other, subscribe_context, expect=201)
         self.testapp.post('/contexts/%s/permissions/%s/defaults' % (url_hash, other), "", oauth2Header(other), status=403)
+
+    # Bulk subscriptions tests
+
+    def test_subscribe_users_to_context_in_bulk_as_context_owner(self):
+        """
+            Given i'm a user that doesn't have the Manager role
+            And i'm the owner of the context
+            When i try to subscribe a list of users to a context in bulk
+            I succeed
+        """
+        from max.tests.mockers import create_context
+
+        url_hash = sha1(create_context['url']).hexdigest()
+        username = 'sheldon'
+        other = 'penny'
+
+        self.create_user(username)
+        self.create_user(other)
+        self.create_context(create_context, owner=username)
+        self.testapp.post('/contexts/%s/bulk-subscriptions' % url_hash, json.dumps([other]), oauth2Header(username), status=201)
+
+    def test_subscribe_users_to_context_in_bulk_as_non_manager_nor_owner(self):
+        """
+            Given i'm a user that doesn't have the Manager role
+            And i'm not the owner of the context
+            When i try to subscribe a list of users to a public context in bulk
+            I get a Forbidden Exception
+        """
+        from max.tests.mockers import create_context
+
+        url_hash = sha1(create_context['url']).hexdigest()
+        username = 'sheldon'
+        other = 'penny'
+
+        self.create_user(username)
+        self.create_user(other)
+        self.create_context(create_context, permissions={'subscribe': 'public'})
+        self.testapp.post('/contexts/%s/bulk-subscriptions' % url_hash, json.dumps([username, other]), oauth2Header(username), status=403)
+
+    def test_unsubscribe_users_from_context_in_bulk_as_non_manager_nor_owner(self):
+        """
+            Given i'm a user that doesn't have the Manager role
+            And i'm not the owner of the context
+            When i try to unsubscribe a list of users from a context in bulk
+            I get a Forbidden Exception
+        """
+        from max.tests.mockers import create_context, subscribe_context
+
+        url_hash = sha1(create_context['url']).hexdigest()
+        username = 'sheldon'
+        other = 'penny'
+
+        self.create_user(username)
+        self.create_user(other)
+        self.create_context(create_context)
+        self.admin_subscribe_user_to_context(other, subscribe_context, expect=201)
+        self.testapp.delete('/contexts/%s/bulk-subscriptions' % url_hash, json.dumps([other]), oauth2Header(username), status=403)
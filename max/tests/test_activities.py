@@ -449,6 +449,34 @@ class FunctionalTests(unittest.TestCase, MaxTestBase):
         result = json.loads(res.text)
         self.assertEqual(len(result), 1)
 
+    def test_get_activities_from_recursive_public_contexts_after_modifying_permissions(self):
+        """
+            Given a public context with a public child context, when the child context
+            stops being public, its activities are no longer listed on the parent context
+            for users not subscribed to it.
+        """
+        from .mockers import context_query
+        from .mockers import create_context
+        from .mockers import subscribe_contextA, create_contextA, user_status_contextA
+        from hashlib import sha1
+        username = 'messi'
+        username_not_me = 'xavi'
+        self.create_user(username)
+        self.create_user(username_not_me)
+        self.create_context(create_context, permissions=dict(read='public', write='restricted', subscribe='restricted', invite='restricted'))
+        self.create_context(create_contextA, permissions=dict(read='public', write='subscribed', subscribe='restricted', invite='restricted'))
+        self.admin_subscribe_user_to_context(username_not_me, subscribe_contextA)
+        self.create_activity(username_not_me, user_status_contextA)
+
+        res = self.testapp.get('/contexts/%s/activities' % (context_query['context']), '', oauth2Header(username), status=200)
+        self.assertEqual(len(res.json), 1)
+
+        permissions = dict(read='subscribed', write='subscribed', subscribe='restricted', invite='restricted')
+        self.testapp.put('/contexts/%s' % sha1(create_contextA['url']).hexdigest(), json.dumps({'permissions': permissions}), oauth2Header(test_manager), status=200)
+
+        res = self.testapp.get('/contexts/%s/activities' % (context_query['context']), '', oauth2Header(username), status=200)
+        self.assertEqual(len(res.json), 0)
+
     def test_get_activities_from_recursive_subscribed_contexts(self):
         from .mockers import context_query
         from .mockers import create_context
@@ -468,6 +496,76 @@ class FunctionalTests(unittest.TestCase, MaxTestBase):
 
         self.testapp.get('/contexts/%s/activities' % (context_query['context']), '', oauth2Header(username), status=403)
 
+    def test_get_activities_from_recursive_contexts_not_matching_url_prefixes(self):
+        """
+            Given a public context and a public sibling context with an url starting with
+            the url of the first one, querying the activities of the first context
+            should not get the activities of the sibling, as it's not a child context.
+        """
+        from .mockers import create_contextA, user_status_contextA
+        from hashlib import sha1
+        username = 'messi'
+        self.create_user(username)
+        create_sibling = dict(create_contextA, url=create_contextA['url'] + 'B')
+        user_status_sibling = deepcopy(user_status_contextA)
+        user_status_sibling['contexts'][0]['url'] = create_sibling['url']
+        self.create_context(create_contextA)
+        self.create_context(create_sibling)
+        self.create_activity(username, user_status_contextA)
+        self.create_activity(username, user_status_sibling)
+
+        res = self.testapp.get('/contexts/%s/activities' % sha1(create_contextA['url']).hexdigest(), '', oauth2Header(username), status=200)
+        self.assertEqual(len(res.json), 1)
+        self.assertEqual(res.json[0]['contexts'][0]['url'], create_contextA['url'])
+        self.assertNotIn('_ancestors', res.json[0]['contexts'][0])
+
+    def test_get_activities_from_recursive_contexts_with_trailing_slash(self):
+        """
+            Given a public context with an url ending with a separator and a public
+            child context, querying the activities of the first context should
+            get the activities of the child.
+        """
+        from .mockers import create_contextA, user_status_contextA
+        from hashlib import sha1
+        username = 'messi'
+        self.create_user(username)
+        create_parent = dict(create_contextA, url=create_contextA['url'] + '/')
+        create_child = dict(create_contextA, url=create_contextA['url'] + '/child')
+        user_status_child = deepcopy(user_status_contextA)
+        user_status_child['contexts'][0]['url'] = create_child['url']
+        self.create_context(create_parent)
+        self.create_context(create_child)
+        self.create_activity(username, user_status_child)
+
+        res = self.testapp.get('/contexts/%s/activities' % sha1(create_parent['url']).hexdigest(), '', oauth2Header(username), status=200)
+        self.assertEqual(len(res.json), 1)
+        self.assertEqual(res.json[0]['contexts'][0]['url'], create_child['url'])
+
+    def test_get_activities_from_recursive_contexts_without_ancestors(self):
+        """
+            Given activities of a context and of a child context stored before the
+            ancestors of their contexts were kept, querying the activities of the
+            first context should get both of them, but not the ones of siblings.
+        """
+        from .mockers import create_contextA, user_status_contextA
+        from hashlib import sha1
+        username = 'messi'
+        self.create_user(username)
+        create_child = dict(create_contextA, url=create_contextA['url'] + '/child')
+        create_sibling = dict(create_contextA, url=create_contextA['url'] + 'B')
+        self.create_context(create_contextA)
+        for context in [create_child, create_sibling]:
+            self.create_context(context)
+            user_status = deepcopy(user_status_contextA)
+            user_status['contexts'][0]['url'] = context['url']
+            self.create_activity(username, user_status, note=context['url'])
+        self.create_activity(username, user_status_contextA)
+        self.exec_mongo_query('activity', 'update_many', {}, {'$unset': {'contexts.0._ancestors': ''}})
+
+        res = self.testapp.get('/contexts/%s/activities' % sha1(create_contextA['url']).hexdigest(), '', oauth2Header(username), status=200)
+        self.assertEqual(len(res.json), 2)
+        self.assertItemsEqual([activity['contexts'][0]['url'] for activity in res.json], [create_contextA['url'], create_child['url']])
+
     def test_post_activity_with_generator(self):
         """ Post an activity to a context which allows everyone to read and write
         """
@@ -185,6 +185,21 @@ class AvatarTests(unittest.TestCase, MaxTestBase, MaxAvatarsTestBase):
         self.assertEqual(self.get_user_avatar_dimensions(username), (48, 48))
         self.assertEqual(self.get_user_avatar_dimensions(username, 'large'), (250, 250))
 
+        original_folder = get_avatar_folder(self.avatar_folder, 'people', username, size='original')
+        self.assertTrue(os.path.exists(os.path.join(original_folder, username)))
+
+    def test_upload_user_avatar_not_an_image(self):
+        """
+            Given a user without avatar
+            When I upload a file that is not an image
+            Then I get an error
+        """
+        username = 'messi'
+        self.create_user(username)
+        files = [('image', 'avatar.png', 'not an image', 'image/png')]
+
+        self.testapp.post('/people/{}/avatar'.format(username), '', headers=oauth2Header(username), upload_files=files, status=400)
+
     def test_invalid_upload_user_avatar(self):
         """
             Given a user without avatar
@@ -270,6 +285,155 @@ class AvatarTests(unittest.TestCase, MaxTestBase, MaxAvatarsTestBase):
         self.assertIn('image', response.content_type)
         self.assertEqual(self.get_image_dimensions_from(response), (48, 48))
 
+    def test_get_user_avatar_not_modified(self):
+        """
+            Given a user with avatar
+            When I retrieve the avatar again with the ETag I got
+            Then I get a Not Modified response
+        """
+        username = 'messi'
+        self.create_user(username)
+        self.upload_user_avatar(username, "avatar.png")
+
+        response = self.testapp.get('/people/%s/avatar' % username, '', {}, status=200)
+        etag = response.headers['ETag']
+        self.assertEqual(response.cache_control.max_age, 300)
+
+        self.testapp.get('/people/%s/avatar' % username, '', {'If-None-Match': etag}, status=304)
+
+    def test_get_user_avatar_versioned(self):
+        """
+            Given a user with avatar
+            When I retrieve the avatar with its current version
+            Then the avatar can be cached for a long time
+            And when i upload a new avatar the version changes
+        """
+        username = 'messi'
+        self.create_user(username)
+        self.upload_user_avatar(username, "avatar.png")
+
+        response = self.testapp.get('/people/%s/avatar' % username, '', {}, status=200)
+        version = response.headers['ETag'].strip('"')
+
+        response = self.testapp.get('/people/%s/avatar?v=%s' % (username, version), '', {}, status=200)
+        self.assertEqual(response.cache_control.max_age, 31536000)
+        self.assertTrue(response.cache_control.public)
+
+        self.upload_user_avatar(username, "avatar.png")
+        response = self.testapp.get('/people/%s/avatar?v=%s' % (username, version), '', {}, status=200)
+        self.assertNotEqual(response.headers['ETag'].strip('"'), version)
+        self.assertEqual(response.cache_control.max_age, 300)
+
+    def test_get_users_avatars(self):
+        """
+            Given a user with avatar and a user without avatar
+            When I retrieve the avatars of both users at once
+            Then I get the versioned url of each user avatar
+            And the url of the user with avatar returns its current avatar
+        """
+        self.create_user('messi')
+        self.create_user('xavi')
+        self.upload_user_avatar('messi', "avatar.png")
+
+        response = self.testapp.get('/avatars?usernames=messi,xavi&size=large', '', {}, status=200)
+        self.assertItemsEqual(response.json.keys(), ['messi', 'xavi'])
+        self.assertTrue(response.json['messi'].startswith('/people/messi/avatar/large?v='))
+        self.assertTrue(response.json['xavi'].startswith('/people/xavi/avatar/large?v='))
+
+        avatar = self.testapp.get(response.json['messi'], '', {}, status=200)
+        self.assertEqual(avatar.cache_control.max_age, 31536000)
+        self.assertEqual(self.get_image_dimensions_from(avatar), (250, 250))
+
+    def test_get_users_avatars_without_usernames(self):
+        """
+            When I retrieve the avatars without giving any username
+            Then I get an error
+        """
+        self.testapp.get('/avatars', '', {}, status=400)
+
+    def test_get_user_avatar_cached(self):
+        """
+            Given a user with a cached avatar
+            When the avatar file is replaced on disk by another process
+            Then I get the new file instead of the cached one
+        """
+        username = 'messi'
+        self.create_user(username)
+        self.upload_user_avatar(username, "avatar.png")
+
+        first = self.testapp.get('/people/%s/avatar' % username, '', {}, status=200)
+        response = self.testapp.get('/people/%s/avatar' % username, '', {}, status=200)
+        self.assertEqual(response.headers['ETag'], first.headers['ETag'])
+
+        # Replace the regular size with the large one, without evicting the cache
+        avatar_path = '{}/{}'.format(get_avatar_folder(self.avatar_folder, 'people', username), username)
+        large_avatar_path = '{}/{}'.format(get_avatar_folder(self.avatar_folder, 'people', username, size='large'), username)
+        shutil.copyfile(large_avatar_path, avatar_path)
+        modification_time = os.path.getmtime(avatar_path) + 10
+        os.utime(avatar_path, (modification_time, modification_time))
+
+        response = self.testapp.get('/people/%s/avatar' % username, '', {}, status=200)
+        self.assertNotEqual(response.headers['ETag'], first.headers['ETag'])
+        self.assertEqual(self.get_image_dimensions_from(response), (250, 250))
+
+    def test_upload_user_avatar_processed_on_threads(self):
+        """
+            Given images configured to be processed on a thread pool
+            When I upload an avatar
+            Then the avatar sizes are generated on the pool
+            And the cached avatars of the user are evicted once they are ready
+        """
+        from gevent.monkey import get_original
+        from max.utils.cache import CachedFile
+        from max.utils.image import get_image_cache
+        from max.utils.image_processing import get_image_pool
+        from max.utils.image_processing import process_image
+
+        import gevent
+
+        username = 'messi'
+        self.create_user(username)
+        self.app.registry.settings['image_processing.threads'] = 1
+        pool = get_image_pool(self.app.registry)
+        image_cache = get_image_cache(self.app.registry)
+
+        # Keep the only pool thread busy, so the avatar is processed only when released
+        busy = get_original('thread', 'allocate_lock')()
+        busy.acquire()
+        process_image(self.app.registry, busy.acquire, (), lambda result: None)
+
+        self.upload_user_avatar(username, "avatar.png")
+        stale_key = (u'people', username, 'large')
+        image_cache.set(stale_key, CachedFile('stale', 'stale', 0, 'stale'))
+
+        busy.release()
+        pool.join()
+        for retry in range(100):
+            if image_cache.get(stale_key) is None:
+                break
+            gevent.sleep(0.01)
+
+        self.assertIsNone(image_cache.get(stale_key))
+        response = self.testapp.get('/people/%s/avatar/large' % username, '', {}, status=200)
+        self.assertEqual(self.get_image_dimensions_from(response), (250, 250))
+
+    def test_get_user_avatar_cached_evicted_on_upload(self):
+        """
+            Given a user with a cached avatar
+            When I upload a new avatar
+            Then I get the new avatar instead of the cached one
+        """
+        username = 'messi'
+        self.create_user(username)
+        self.upload_user_avatar(username, "avatar.png")
+
+        first = self.testapp.get('/people/%s/avatar/large' % username, '', {}, status=200)
+        self.upload_user_avatar(username, "avatar.png")
+        response = self.testapp.get('/people/%s/avatar/large' % username, '', {}, status=200)
+
+        self.assertNotEqual(response.headers['ETag'], first.headers['ETag'])
+        self.assertEqual(self.get_image_dimensions_from(response), (250, 250))
+
     @httpretty.activate
     @patch('tweepy.API', MockTweepyAPI)
     def test_get_context_twitter_download_avatar(self):
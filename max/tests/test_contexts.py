@@ -236,6 +236,23 @@ class FunctionalTests(unittest.TestCase, MaxTestBase):
         self.assertEqual(result.get('twitterUsername', None), 'maxupcnet')
         self.assertEqual(result.get('twitterUsernameId', None), '526326641')
 
+    @patch('tweepy.API', MockTweepyAPI)
+    def test_create_context_with_twitter_username_on_background(self):
+        from hashlib import sha1
+        from max.utils.twitter import get_twitter_client
+        from .mockers import create_context_full
+
+        twitter = get_twitter_client(self.app.registry)
+        twitter.tasks.enabled = True
+
+        res = self.testapp.post('/contexts', json.dumps(create_context_full), oauth2Header(test_manager), status=201)
+        self.assertEqual(res.json.get('twitterUsernameId', None), None)
+
+        twitter.tasks.join()
+        url_hash = sha1(create_context_full['url']).hexdigest()
+        res = self.testapp.get('/contexts/%s' % url_hash, '', oauth2Header(test_manager), status=200)
+        self.assertEqual(res.json.get('twitterUsernameId', None), '526326641')
+
     def test_get_context_tags(self):
         from hashlib import sha1
         from .mockers import create_context
@@ -254,6 +254,38 @@ class DeprecationTests(unittest.TestCase, MaxTestBase):
 
         self.assertEqual(rewrited_request_url, '/tokens/{}'.format(token))
 
+    def test_deprecated_routes_usage(self):
+        """
+            Given some requests to deprecated routes
+            When i get the usage of the deprecated routes
+            Then i get how many times each deprecated route has been used
+        """
+        from .mockers import create_context, subscribe_context, user_status, user_status_context
+        username = 'sheldon'
+        self.create_user(username)
+        self.create_context(create_context)
+        self.admin_subscribe_user_to_context(username, subscribe_context)
+        token = '000000000000000000'
+        platform = 'ios'
+
+        self.testapp.post('/people/{}/device/{}/{}'.format(username, platform, token), '', headers=oauth2Header(username), status=201)
+        self.testapp.delete('/people/{}/device/{}/{}'.format(username, platform, token), '', headers=oauth2Header(username), status=204)
+        self.testapp.post('/people/leonard', json.dumps({}), headers=oauth2Header(test_manager), status=201)
+
+        # Timeline posts use a route still in use, only context posts are deprecated
+        self.create_activity(username, user_status)
+        self.create_activity(username, user_status, note='Another timeline post')
+        self.create_activity(username, user_status_context)
+
+        res = self.testapp.get('/admin/maintenance/deprecations', headers=oauth2Header(test_manager), status=200)
+        usage = dict([((route['method'], route['route']), route['count']) for route in res.json])
+
+        self.assertEqual(len(usage), 8)
+        self.assertEqual(usage[('POST', '/people/{username}/device/{platform}/{token}')], 1)
+        self.assertEqual(usage[('DELETE', '/people/{username}/device/{platform}/{token}')], 1)
+        self.assertEqual(usage[('POST', '/people/{username}')], 1)
+        self.assertEqual(usage[('POST', '/people/{username}/activities')], 1)
+
     def test_deprecated_sortBy_parameter(self):
         """
             Given a plain user
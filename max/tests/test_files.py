@@ -6,7 +6,10 @@ from max.tests.base import MaxTestBase
 from max.tests.base import mock_post
 from max.tests.base import oauth2Header
 
+from PIL import Image
+from bson import ObjectId
 from functools import partial
+from io import BytesIO
 from mock import patch
 from paste.deploy import loadapp
 
@@ -15,6 +18,35 @@ import os
 import shutil
 import unittest
 
+# Posts a file activity from a file on a new process, and prints the response
+# status and the increase of the peak resident memory, in kilobytes
+LARGE_UPLOAD_SCRIPT = """
+import os
+import sys
+from functools import partial
+from mock import patch
+from paste.deploy import loadapp
+from resource import RUSAGE_SELF
+from resource import getrusage
+from webob import Request
+from max.tests.base import mock_post
+from max.tests.base import oauth2Header
+
+conf_dir, username, upload_path, boundary = sys.argv[1:]
+app = loadapp('config:tests.ini', relative_to=conf_dir)
+request = Request.blank('/people/{}/activities'.format(username), method='POST', headers=oauth2Header(username))
+request.environ['CONTENT_LENGTH'] = str(os.path.getsize(upload_path))
+request.environ['CONTENT_TYPE'] = 'multipart/form-data; boundary={}'.format(boundary)
+
+with open(upload_path, 'rb') as upload, patch('requests.post', new=partial(mock_post, None)):
+    request.environ['wsgi.input'] = upload
+    peak_before = getrusage(RUSAGE_SELF).ru_maxrss
+    response = request.get_response(app)
+    peak_after = getrusage(RUSAGE_SELF).ru_maxrss
+
+print response.status_int, peak_after - peak_before
+"""
+
 
 class FunctionalTests(unittest.TestCase, MaxTestBase):
 
@@ -321,8 +353,183 @@ class FunctionalTests(unittest.TestCase, MaxTestBase):
 
         res = self.testapp.get('/activities/{}/image/thumb'.format(response[0]['id']), '', oauth2Header(username), status=200)
 
-        # Give a margin of size of 10 bytes, sometimes readed image
-        # size differs by two bytes, who knows why ...
-        self.assertLessEqual(abs(len(res.body) - 2966), 10)
+        thumbnail = Image.open(BytesIO(res.body))
+        self.assertLessEqual(max(thumbnail.size), 400)
+        self.assertTrue(thumbnail.info.get('progressive'))
+
+        self.assertEqual(res.content_type, u'image/jpeg')
+
+    def test_get_thumb_image_activity_not_generated_yet(self):
+        """
+            Given an image activity
+            When its thumbnail is still being generated
+            Then I get the original image as thumbnail
+        """
+        from .mockers import user_image_activity_with_context as activity
+        from .mockers import subscribe_context, create_context
+        username = 'messi'
+        self.create_user(username)
+        self.create_context(create_context)
+        self.admin_subscribe_user_to_context(username, subscribe_context)
+
+        image_data = open(os.path.join(os.path.dirname(__file__), "avatar.png"), "rb").read()
+        files = [('file', 'avatar.png', image_data, 'image/png')]
+
+        res = self.testapp.post('/people/{}/activities'.format(username), dict(json_data=json.dumps(activity)), oauth2Header(username), upload_files=files, status=201)
+        activity_id = res.json['id']
+        self.exec_mongo_query('activity', 'update_one', {'_id': ObjectId(activity_id)}, {'$unset': {'_blobs.thumb': '', '_blobs.thumb-webp': ''}})
+
+        res = self.testapp.get('/activities/{}/image/thumb'.format(activity_id), '', oauth2Header(username), status=200)
+        self.assertEqual(res.body, image_data)
+        self.assertEqual(res.content_type, u'image/png')
+        self.assertIsNone(res.cache_control.max_age)
+
+    def test_get_thumb_image_activity_as_webp(self):
+        """
+            Given an image activity
+            When I retrieve its thumbnail accepting WebP images
+            Then I get the WebP version of the thumbnail
+        """
+        from .mockers import user_image_activity_with_context as activity
+        from .mockers import subscribe_context, create_context
+        username = 'messi'
+        self.create_user(username)
+        self.create_context(create_context)
+        self.admin_subscribe_user_to_context(username, subscribe_context)
 
+        files = [('file', 'avatar.png', open(os.path.join(os.path.dirname(__file__), "avatar.png"), "rb").read(), 'image/png')]
+
+        res = self.testapp.post('/people/{}/activities'.format(username), dict(json_data=json.dumps(activity)), oauth2Header(username), upload_files=files, status=201)
+        activity_id = res.json['id']
+        stored = self.exec_mongo_query('activity', 'find', {'_id': ObjectId(activity_id)})[0]
+        if 'thumb-webp' not in stored['_blobs']:
+            self.skipTest('PIL built without WebP support')
+
+        headers = oauth2Header(username)
+        headers['Accept'] = 'image/webp,image/*,*/*;q=0.8'
+        res = self.testapp.get('/activities/{}/image/thumb'.format(activity_id), '', headers, status=200)
+        self.assertEqual(res.content_type, u'image/webp')
+        self.assertEqual(res.headers['Vary'], 'Accept')
+
+        res = self.testapp.get('/activities/{}/image/thumb'.format(activity_id), '', oauth2Header(username), status=200)
         self.assertEqual(res.content_type, u'image/jpeg')
+
+    def test_file_activities_with_same_content_share_blob(self):
+        """
+            Given a plain user
+            When I post the same file twice on different activities
+            Then the file is stored only once
+        """
+        from .mockers import user_file_activity_with_context as activity
+        from .mockers import subscribe_context, create_context
+        username = 'messi'
+        self.create_user(username)
+        self.create_context(create_context)
+        self.admin_subscribe_user_to_context(username, subscribe_context)
+
+        thefile = open(os.path.join(os.path.dirname(__file__), "map.pdf"), "rb")
+        files = [('file', 'map.pdf', thefile.read(), 'application/pdf')]
+
+        self.testapp.post('/people/{}/activities'.format(username), dict(json_data=json.dumps(activity)), oauth2Header(username), upload_files=files, status=201)
+        self.testapp.post('/people/{}/activities'.format(username), dict(json_data=json.dumps(activity)), oauth2Header(username), upload_files=files, status=201)
+
+        activities = self.exec_mongo_query('activity', 'find', {'object.objectType': 'file'})
+        self.assertEqual(activities[0]['_blobs']['full'], activities[1]['_blobs']['full'])
+
+        blobs_folder = os.path.join(self.app.registry.settings['file_repository'], 'blobs')
+        stored_blobs = [filename for path, dirs, filenames in os.walk(blobs_folder) for filename in filenames]
+        self.assertEqual(len(stored_blobs), 1)
+
+    def test_get_file_activity_file_conditional_and_range(self):
+        """
+            Given a file activity
+            When I retrieve the file with a matching If-None-Match header
+            Then I get a Not Modified response
+            And when i request a range of bytes
+            Then I get only that part of the file
+        """
+        from .mockers import user_file_activity_with_context as activity
+        from .mockers import subscribe_context, create_context
+        username = 'messi'
+        self.create_user(username)
+        self.create_context(create_context)
+        self.admin_subscribe_user_to_context(username, subscribe_context)
+
+        file_data = open(os.path.join(os.path.dirname(__file__), "map.pdf"), "rb").read()
+        files = [('file', 'map.pdf', file_data, 'application/pdf')]
+
+        res = self.testapp.post('/people/{}/activities'.format(username), dict(json_data=json.dumps(activity)), oauth2Header(username), upload_files=files, status=201)
+        download_url = '/activities/{}/file/download'.format(res.json['id'])
+
+        res = self.testapp.get(download_url, '', oauth2Header(username), status=200)
+        etag = res.headers['ETag']
+
+        headers = oauth2Header(username)
+        headers['If-None-Match'] = etag
+        self.testapp.get(download_url, '', headers, status=304)
+
+        headers = oauth2Header(username)
+        headers['Range'] = 'bytes=0-99'
+        res = self.testapp.get(download_url, '', headers, status=206)
+        self.assertEqual(res.body, file_data[:100])
+
+    def test_get_file_activity_file_as_base64(self):
+        """
+            Given a file activity
+            When I retrieve the file from the app
+            Then I get the file base64 encoded
+        """
+        from .mockers import user_file_activity_with_context as activity
+        from .mockers import subscribe_context, create_context
+        from base64 import b64encode
+        username = 'messi'
+        self.create_user(username)
+        self.create_context(create_context)
+        self.admin_subscribe_user_to_context(username, subscribe_context)
+
+        file_data = open(os.path.join(os.path.dirname(__file__), "map.pdf"), "rb").read()
+        files = [('file', 'map.pdf', file_data, 'application/pdf')]
+
+        res = self.testapp.post('/people/{}/activities'.format(username), dict(json_data=json.dumps(activity)), oauth2Header(username), upload_files=files, status=201)
+
+        headers = oauth2Header(username)
+        headers['X-From-Utalk'] = 'App'
+        res = self.testapp.get('/activities/{}/file/download'.format(res.json['id']), '', headers, status=200)
+        self.assertEqual(res.content_type, 'application/base64')
+        self.assertEqual(res.body, b64encode(file_data))
+
+    def test_create_large_file_activity_memory_usage(self):
+        """
+            Given a plain user
+            When I post a 50MB file activity
+            Then the file activity is created
+            And the upload body is never held in memory
+        """
+        from .mockers import user_file_activity as activity
+        from tempfile import NamedTemporaryFile
+
+        import subprocess
+        import sys
+
+        username = 'messi'
+        self.create_user(username)
+
+        boundary = 'largeuploadboundary'
+        chunk = '0123456789abcdef' * 65536
+        upload = NamedTemporaryFile()
+        upload.write('--{}\r\nContent-Disposition: form-data; name="json_data"\r\n\r\n{}\r\n'.format(boundary, json.dumps(activity)))
+        upload.write('--{}\r\nContent-Disposition: form-data; name="file"; filename="large.bin"\r\n'.format(boundary))
+        upload.write('Content-Type: application/octet-stream\r\n\r\n')
+        for i in range(50):
+            upload.write(chunk)
+        upload.write('\r\n--{}--\r\n'.format(boundary))
+        upload.flush()
+
+        # The upload is posted on a new process, as the peak resident memory of this
+        # one may already be higher than the one reached while posting the file
+        output = subprocess.check_output([sys.executable, '-c', LARGE_UPLOAD_SCRIPT, os.path.dirname(__file__), username, upload.name, boundary])
+        upload.close()
+        status, peak_increase = [int(value) for value in output.strip().splitlines()[-1].split()]
+
+        self.assertEqual(status, 201)
+        self.assertLess(peak_increase, 20 * 1024)
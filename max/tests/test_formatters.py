@@ -67,14 +67,84 @@ class FunctionalTests(unittest.TestCase, MaxTestBase):
         res = self.testapp.post('/conversations', json.dumps(message_with_tags), oauth2Header(sender), status=201)
         self.assertEqual(res.json['object']['content'], u'A <strong>text</strong> A')
 
+    @httpretty.activate
     def test_post_activity_shortens_url(self):
         """  """
         from .mockers import user_status_with_url
+        http_mock_bitly(body='{"status_code": 200, "data": {"url": "http://bit.ly/1a2b3c"}}')
         username = 'messi'
         self.create_user(username)
         res = self.create_activity(username, user_status_with_url)
         self.assertIn('bit.ly', res.json['object']['content'],)
 
+    @httpretty.activate
+    def test_post_activities_shortens_url_once(self):
+        """
+            Given a url already shortened on a previous activity
+            When i post another activity with the same url
+            Then the stored shortened url is used
+            Even if the in-process cache has forgotten it
+        """
+        from max.utils.formatting import get_url_shortener
+        from .mockers import user_status_with_url
+        calls = http_mock_bitly()
+        username = 'messi'
+        self.create_user(username)
+
+        self.create_activity(username, user_status_with_url)
+        get_url_shortener(self.app.registry).cache.entries.clear()
+        res = self.create_activity(username, user_status_with_url, note='Again http://example.com')
+
+        self.assertIn('http://shortened.url', res.json['object']['content'])
+        self.assertEqual(calls, ['http://example.com'])
+
+    @httpretty.activate
+    def test_post_activity_shortens_url_on_background(self):
+        """
+            Given the url shortener running on the background
+            When i post an activity with a url not shortened yet
+            Then the activity is stored with the original url
+            And rewritten when the url is shortened
+        """
+        from max.utils.formatting import get_url_shortener
+        from .mockers import user_status_with_url
+        http_mock_bitly()
+        shortener = get_url_shortener(self.app.registry)
+        shortener.tasks.enabled = True
+        username = 'messi'
+        self.create_user(username)
+
+        res = self.create_activity(username, user_status_with_url)
+        self.assertIn('http://example.com', res.json['object']['content'])
+
+        shortener.tasks.join()
+        res = self.testapp.get('/activities/%s' % res.json['id'], '', oauth2Header(username), status=200)
+        self.assertIn('http://shortened.url', res.json['object']['content'])
+        self.assertNotIn('http://example.com', res.json['object']['content'])
+
+    @httpretty.activate
+    def test_post_comment_shortens_url_on_background(self):
+        """
+            Given the url shortener running on the background
+            When i comment an activity with a url not shortened yet
+            Then the comment is rewritten when the url is shortened
+        """
+        from max.utils.formatting import get_url_shortener
+        from .mockers import user_status, user_comment
+        http_mock_bitly()
+        shortener = get_url_shortener(self.app.registry)
+        username = 'messi'
+        self.create_user(username)
+        activity = self.create_activity(username, user_status).json
+
+        shortener.tasks.enabled = True
+        comment = {'object': {'objectType': 'comment', 'content': user_comment['object']['content'] + ' http://example.com'}}
+        self.comment_activity(username, activity['id'], comment)
+        shortener.tasks.join()
+
+        res = self.testapp.get('/activities/%s' % activity['id'], '', oauth2Header(username), status=200)
+        self.assertIn('http://shortened.url', res.json['replies'][0]['content'])
+
     @httpretty.activate
     def test_url_shortened_bitly_failure(self):
         from max.utils.formatting import shortenURL
@@ -6,6 +6,7 @@ from max.tests.base import MaxTestBase
 from max.tests.base import mock_post
 from max.tests.base import oauth2Header
 
+from datetime import datetime
 from functools import partial
 from mock import patch
 from paste.deploy import loadapp
@@ -288,3 +289,226 @@ class FunctionalTests(unittest.TestCase, MaxTestBase):
         self.assertItemsEqual(migrated_android_tokens, ['token3', 'token4'])
         self.assertNotIn('iosDevices', user)
         self.assertNotIn('androidDevices', user)
+
+    def test_maintenance_job_status(self):
+        from .mockers import user_status
+        username = 'messi'
+        self.create_user(username, displayName='Lionel messi')
+        self.create_activity(username, user_status)
+
+        res = self.testapp.post('/admin/maintenance/keywords', "", oauth2Header(test_manager), status=200)
+        self.assertEqual(res.json['name'], 'keywords')
+        self.assertEqual(res.json['status'], 'finished')
+        self.assertEqual(res.json['processed'], 1)
+        job_id = res.json['id']
+
+        res = self.testapp.get('/admin/maintenance/jobs/{}'.format(job_id), "", oauth2Header(test_manager), status=200)
+        self.assertEqual(res.json['status'], 'finished')
+
+        res = self.testapp.get('/admin/maintenance/jobs', "", oauth2Header(test_manager), status=200)
+        self.assertEqual(len(res.json), 1)
+        self.assertEqual(res.json[0]['id'], job_id)
+
+    def test_maintenance_job_resume(self):
+        from .mockers import user_status
+        username = 'messi'
+        self.create_user(username, displayName='Lionel messi')
+        self.create_activity(username, user_status)
+        self.create_activity(username, user_status)
+
+        # Hard remove keywords directly on mongodb to simulate bad keywords
+        self.exec_mongo_query('activity', 'update_many', {}, {'$unset': {'_keywords': ''}})
+
+        res = self.testapp.post('/admin/maintenance/keywords?background=1', "", oauth2Header(test_manager), status=202)
+        self.assertEqual(res.json['status'], 'pending')
+        self.assertEqual(res.json['total'], 2)
+        job_id = res.json['id']
+
+        # Simulate a job interrupted after processing the first activity
+        activities = self.exec_mongo_query('activity', 'find', {})
+        activities.sort(key=lambda activity: activity['_id'])
+        self.exec_mongo_query('maintenance_jobs', 'update', {}, {'$set': {'status': 'failed', 'last_id': activities[0]['_id'], 'processed': 1}})
+
+        res = self.testapp.post('/admin/maintenance/jobs/{}'.format(job_id), "", oauth2Header(test_manager), status=200)
+        self.assertEqual(res.json['status'], 'finished')
+        self.assertEqual(res.json['processed'], 2)
+
+        activities = self.exec_mongo_query('activity', 'find', {})
+        activities.sort(key=lambda activity: activity['_id'])
+        self.assertNotIn('_keywords', activities[0])
+        self.assertIn('lionel', activities[1]['_keywords'])
+
+    def test_maintenance_job_resume_running(self):
+        res = self.testapp.post('/admin/maintenance/keywords?background=1', "", oauth2Header(test_manager), status=202)
+        job_id = res.json['id']
+
+        # Simulate a job claimed by a live worker
+        self.exec_mongo_query('maintenance_jobs', 'update', {}, {'$set': {'status': 'running', 'worker': 'host:1:worker'}})
+        self.testapp.post('/admin/maintenance/jobs/{}'.format(job_id), "", oauth2Header(test_manager), status=409)
+
+    def test_maintenance_conversations_malformed_subscription_id(self):
+        username = 'messi'
+        self.create_user(username)
+        subscription = {'id': 'not-an-id', 'objectType': 'conversation', 'participants': [], 'permissions': []}
+        self.exec_mongo_query('users', 'update', {'username': username}, {'$set': {'talkingIn': [subscription]}})
+
+        res = self.testapp.post('/admin/maintenance/conversations', "", oauth2Header(test_manager), status=200)
+        self.assertEqual(res.json['status'], 'finished')
+
+        user = self.exec_mongo_query('users', 'find', {'username': username})[0]
+        self.assertEqual(user['talkingIn'], [])
+
+    def test_maintenance_job_not_found(self):
+        self.testapp.get('/admin/maintenance/jobs/{}'.format('0' * 24), "", oauth2Header(test_manager), status=404)
+
+    def test_maintenance_id_ranges(self):
+        from .mockers import user_status
+        from max.maintenance import get_id_ranges
+        from max.maintenance import process_step
+        from max.maintenance.jobs import MAINTENANCE_JOBS
+        from pyramid.scripting import prepare
+
+        username = 'messi'
+        self.create_user(username, displayName='Lionel messi')
+        for count in range(7):
+            self.create_activity(username, user_status)
+
+        env = prepare(registry=self.app.registry)
+        step = MAINTENANCE_JOBS['keywords'][0]
+        ranges = get_id_ranges(env['request'], step, 3)
+        self.assertEqual(len(ranges), 3)
+        self.assertIsNone(ranges[0][0])
+        self.assertIsNone(ranges[-1][1])
+
+        processed = []
+        for min_id, max_id in ranges:
+            processed.append(sum([count for last_id, count in process_step(env['request'], step, chunk_size=2, min_id=min_id, max_id=max_id)]))
+        env['closer']()
+
+        self.assertEqual(sum(processed), 7)
+        self.assertNotIn(0, processed)
+
+    def test_maintenance_job_range_heartbeat(self):
+        from .mockers import user_status
+        from max.maintenance import MaintenanceJobInterrupted
+        from max.maintenance import create_job
+        from max.maintenance import run_job_range
+        from pyramid.scripting import prepare
+
+        username = 'messi'
+        self.create_user(username, displayName='Lionel messi')
+        for count in range(3):
+            self.create_activity(username, user_status)
+
+        env = prepare(registry=self.app.registry)
+        job = create_job(env['request'], 'keywords', worker='host:1:range')
+        stale = datetime(2000, 1, 1)
+        self.exec_mongo_query('maintenance_jobs', 'update', {}, {'$set': {'heartbeat': stale}})
+
+        processed = run_job_range(env['request'], job, 0, chunk_size=2)
+        self.assertEqual(processed, 3)
+        stored = self.exec_mongo_query('maintenance_jobs', 'find', {})[0]
+        self.assertEqual(stored['processed'], 3)
+        self.assertGreater(stored['heartbeat'], stale)
+
+        # A range of a job claimed by another worker stops on the first chunk
+        self.exec_mongo_query('maintenance_jobs', 'update', {}, {'$set': {'worker': 'host:2:other'}})
+        with self.assertRaises(MaintenanceJobInterrupted):
+            run_job_range(env['request'], job, 0, chunk_size=2)
+        env['closer']()
+
+    def test_maintenance_script_parallel(self):
+        from .mockers import user_status
+        from max.scripts.maintenance import main
+        from StringIO import StringIO
+
+        username = 'messi'
+        self.create_user(username, displayName='Lionel messi')
+        for count in range(5):
+            self.create_activity(username, user_status, note='Testejant {}'.format(count))
+        self.exec_mongo_query('activity', 'update_many', {}, {'$set': {'_keywords': []}})
+
+        config = os.path.join(os.path.dirname(__file__), 'tests.ini')
+        with patch('sys.stdout', new_callable=StringIO) as output:
+            main([config, 'keywords', '-p', '2', '-c', '2'])
+        report = json.loads(output.getvalue())
+
+        self.assertEqual(report['job'], 'keywords')
+        self.assertEqual(report['processes'], 2)
+        self.assertEqual(len(report['steps']), 1)
+        self.assertEqual(report['steps'][0]['collection'], 'activity')
+        self.assertEqual(report['steps'][0]['ranges'], 2)
+        self.assertEqual(report['steps'][0]['processed'], 5)
+        self.assertEqual(report['status']['status'], 'finished')
+        self.assertEqual(report['status']['processed'], 5)
+
+        job = self.exec_mongo_query('maintenance_jobs', 'find', {})[0]
+        self.assertEqual(job['status'], 'finished')
+        self.assertEqual(job['step'], 1)
+        self.assertEqual(job['processed'], job['total'])
+
+        for activity in self.exec_mongo_query('activity', 'find', {}):
+            self.assertIn(u'testejant', activity['_keywords'])
+
+    def test_maintenance_mongoprobe(self):
+        """
+            Given some requests querying mongodb
+            When i get the mongodb queries statistics
+            Then i get the queries aggregated by route and query shape
+            And the statistics can be reset
+        """
+        self.create_user('messi')
+        self.create_user('xavi')
+        self.testapp.get('/people/messi', '', oauth2Header(test_manager), status=200)
+        self.testapp.get('/people/xavi', '', oauth2Header(test_manager), status=200)
+
+        res = self.testapp.get('/admin/maintenance/mongoprobe', '', oauth2Header(test_manager), status=200)
+        self.assertEqual(res.json['sample_rate'], 1.0)
+        user_queries = [
+            query for query in res.json['queries']
+            if query['route'] == '/people/{username}' and query['method'] == 'GET' and query['collection'] == 'users'
+        ]
+        self.assertTrue(user_queries)
+        self.assertGreaterEqual(max([query['count'] for query in user_queries]), 2)
+        self.assertNotIn('messi', ''.join([query['shape'] for query in res.json['queries']]))
+        self.assertEqual(sum(user_queries[0]['histogram'].values()), user_queries[0]['count'])
+
+        self.testapp.delete('/admin/maintenance/mongoprobe', '', oauth2Header(test_manager), status=204)
+        res = self.testapp.get('/admin/maintenance/mongoprobe', '', oauth2Header(test_manager), status=200)
+        self.assertEqual(
+            [query for query in res.json['queries'] if query['route'] == '/people/{username}'],
+            []
+        )
+
+    def test_maintenance_hubmonitor(self):
+        """
+            Given a greenlet blocking the gevent hub
+            When i get the gevent hub blocks statistics
+            Then i get the block with its blocking location and stack
+            And the statistics can be reset
+        """
+        from greenlet import getcurrent
+        from max.hubmonitor import HubMonitor
+
+        import thread
+        import time
+
+        monitor = self.app.registry.hub_monitor = HubMonitor(threshold=50)
+        monitor.hub_thread = thread.get_ident()
+        monitor.trace('switch', (None, getcurrent()))
+        time.sleep(0.1)
+        monitor.report(getcurrent(), 0.1, monitor.switches)
+        monitor.trace('switch', (getcurrent(), None))
+
+        res = self.testapp.get('/admin/maintenance/hubmonitor', '', oauth2Header(test_manager), status=200)
+        self.assertEqual(res.json['threshold'], 50)
+        self.assertEqual(len(res.json['blocks']), 1)
+        block = res.json['blocks'][0]
+        self.assertEqual(block['count'], 1)
+        self.assertGreaterEqual(block['time_total'], 100)
+        self.assertIn('test_maintenance_hubmonitor', block['location'])
+        self.assertIn('test_maintenance_hubmonitor', block['stack'])
+
+        self.testapp.delete('/admin/maintenance/hubmonitor', '', oauth2Header(test_manager), status=204)
+        res = self.testapp.get('/admin/maintenance/hubmonitor', '', oauth2Header(test_manager), status=200)
+        self.assertEqual(res.json['blocks'], [])
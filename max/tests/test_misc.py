@@ -145,6 +145,21 @@ class FunctionalTests(unittest.TestCase, MaxTestBase, MaxAvatarsTestBase):
         self.assertEqual(res.request.headers['X-Oauth-Scope'], params['X-Oauth-Scope'])
         self.assertEqual(res.request.headers['X-Oauth-Token'], params['X-Oauth-Token'])
 
+    def test_post_tunneling_on_get_without_content_type(self):
+        """
+            Test that calling a endpoint with GET indirectly within a POST
+            with the headers as post data, sent without a content type as
+            clients that can't set headers do, actually calls the real GET method
+        """
+        from urllib import urlencode
+        username = 'messi'
+        self.create_user(username)
+        params = oauth2Header(username)
+        params['X-HTTP-Method-Override'] = 'GET'
+        res = self.testapp.post('/people', urlencode(params), content_type='', status=200)
+        self.assertEqual(res.request.method, 'GET')
+        self.assertEqual(res.request.headers['X-Oauth-Username'], params['X-Oauth-Username'])
+
     def test_image_rotation_180(self):
         from max.utils.image import rotate_image_by_EXIF
         from PIL import Image
@@ -256,6 +271,181 @@ class FunctionalTests(unittest.TestCase, MaxTestBase, MaxAvatarsTestBase):
         self.assertItemsEqual(defined_categories, listed_categories)
         self.assertItemsEqual(res.json[0].keys(), [u'name', u'resources', u'id'])
 
+    def test_public_info_version(self):
+        """
+            Test that the public info reports the installed max version
+        """
+        import pkg_resources
+        res = self.testapp.get('/info', status=200)
+        self.assertEqual(res.json['version'], pkg_resources.get_distribution('max').version)
+
+    def test_routes_have_views(self):
+        """
+            Test that every route has views registered, so no module with
+            views is left out of the packages scanned on startup
+        """
+        from max import RESOURCES
+        views = self.app.registry.introspector.get_category('views')
+        routes_with_views = set([view['introspectable']['route_name'] for view in views])
+        self.assertEqual(sorted([route for route in RESOURCES if route not in routes_with_views]), [])
+
+    def test_api_info_etag(self):
+        """
+            Test that the api info is served with an etag, and that clients
+            revalidating an unchanged copy get a Not Modified response
+        """
+        res = self.testapp.get('/info/api', status=200)
+        etag = res.headers['ETag']
+
+        res = self.testapp.get('/info/api', headers={'If-None-Match': etag}, status=304)
+        self.assertEqual(res.body, '')
+
+        res = self.testapp.get('/info/api?by_category=1', headers={'If-None-Match': etag}, status=200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+        self.assertIsInstance(res.json, list)
+
+    def test_api_info_head_methods(self):
+        """
+            Test that GET endpoints answering HEAD requests are listed with both methods
+        """
+        res = self.testapp.get('/info/api', status=200)
+        self.assertIn('HEAD', res.json['user_activities']['methods'])
+        self.assertNotIn('HEAD', res.json['user']['methods'])
+
+    def test_metrics(self):
+        """
+            Test that request metrics are exposed in the Prometheus text format,
+            labeled by route, method and response status
+        """
+        username = 'messi'
+        self.create_user(username)
+        self.testapp.get('/people/{}'.format(username), '', oauth2Header(username), status=200)
+        self.testapp.get('/people/{}'.format(username), '', oauth2Header(username), status=200)
+        self.testapp.get('/people/unknown', '', oauth2Header(username), status=400)
+
+        res = self.testapp.get('/metrics', '', oauth2Header(test_manager), status=200)
+        self.assertTrue(res.content_type.startswith('text/plain'))
+        samples = dict([line.rsplit(' ', 1) for line in res.text.splitlines() if not line.startswith('#')])
+
+        self.assertEqual(samples['max_requests_total{route="/people/{username}",method="GET",status="200"}'], '2')
+        self.assertEqual(samples['max_requests_total{route="/people/{username}",method="GET",status="400"}'], '1')
+        self.assertEqual(samples['max_request_duration_seconds_count{route="/people/{username}",method="GET"}'], '3')
+        self.assertEqual(samples['max_request_duration_seconds_bucket{route="/people/{username}",method="GET",le="+Inf"}'], '3')
+        self.assertEqual(samples['max_response_size_bytes_count{route="/people/{username}",method="GET"}'], '3')
+        self.assertEqual(samples['max_requests_in_flight'], '1')
+
+    def test_metrics_not_manager(self):
+        """
+            Test that request metrics are not exposed to non Manager users
+        """
+        username = 'messi'
+        self.create_user(username)
+        self.testapp.get('/metrics', '', oauth2Header(username), status=403)
+
+    def test_metrics_allowed_ips(self):
+        """
+            Test that request metrics are exposed without authentication only
+            to the allowed addresses
+        """
+        self.app.registry.settings['max.metrics_allowed_ips'] = '10.0.0.1 10.0.0.2'
+
+        res = self.testapp.get('/metrics', extra_environ={'REMOTE_ADDR': '10.0.0.2'}, status=200)
+        self.assertIn('max_requests_in_flight', res.text)
+        self.testapp.get('/metrics', extra_environ={'REMOTE_ADDR': '10.0.0.3'}, status=401)
+
+    def test_server_timing(self):
+        """
+            Test that a Manager asking for server timings gets the time spent
+            on each subsystem on the Server-Timing header
+        """
+        username = 'messi'
+        self.create_user(username)
+        headers = oauth2Header(test_manager)
+        headers['X-Max-Server-Timing'] = '1'
+
+        res = self.testapp.get('/people/{}'.format(username), '', headers, status=200)
+        timings = dict([timing.strip().split(';', 1) for timing in res.headers['Server-Timing'].split(',')])
+        for subsystem in ['oauth', 'mongodb', 'view', 'serialization', 'total']:
+            self.assertIn(subsystem, timings)
+
+        res = self.testapp.get('/people/{}'.format(username), '', oauth2Header(test_manager), status=200)
+        self.assertNotIn('Server-Timing', res.headers)
+
+    def test_profile_request(self):
+        """
+            Test that a Manager can profile a request, and get the stored
+            profile report from the exceptions maintenance endpoint
+        """
+        username = 'messi'
+        self.create_user(username)
+
+        res = self.testapp.get('/people/{}?profile=1'.format(username), '', oauth2Header(test_manager), status=200)
+        self.assertEqual(res.json['username'], username)
+        profile_id = res.headers['X-Max-Profile']
+
+        res = self.testapp.get('/admin/maintenance/exceptions/{}'.format(profile_id), '', oauth2Header(test_manager), status=200)
+        self.assertIn('function calls', res.json['profile'])
+        self.assertIn('cumtime', res.json['profile'])
+        self.assertIn('GET /people/{}?profile=1'.format(username), res.json['request'])
+
+    def test_profile_request_inline(self):
+        """
+            Test that a Manager can get the profile report of a request instead of its response
+        """
+        username = 'messi'
+        self.create_user(username)
+        headers = oauth2Header(test_manager)
+        headers['X-Max-Profile'] = 'inline'
+
+        res = self.testapp.get('/people/{}'.format(username), '', headers, status=200)
+        self.assertEqual(res.content_type, 'text/plain')
+        self.assertIn('ncalls', res.text)
+
+    def test_profile_request_not_manager(self):
+        """
+            Test that requests of non Manager users are not profiled
+        """
+        username = 'messi'
+        self.create_user(username)
+
+        res = self.testapp.get('/people/{}?profile=1'.format(username), '', oauth2Header(username), status=200)
+        self.assertNotIn('X-Max-Profile', res.headers)
+        self.assertEqual(res.json['username'], username)
+
+    def test_profile_excludes_other_greenlets(self):
+        """
+            Test that a profile doesn't include the code run by other greenlets
+            while the profiled one is waiting
+        """
+        from max.profiling import format_profile
+        from max.profiling import profile_greenlet
+        import gevent
+
+        def other_greenlet_work():
+            return sum(range(1000))
+
+        def profiled_work():
+            gevent.spawn(other_greenlet_work).join()
+            return sum(range(1000))
+
+        result, profile = profile_greenlet(profiled_work)
+        report = format_profile(profile)
+        self.assertEqual(result, 499500)
+        self.assertIn('profiled_work', report)
+        self.assertNotIn('other_greenlet_work', report)
+
+    def test_server_timing_not_manager(self):
+        """
+            Test that server timings are not returned to non Manager users
+        """
+        username = 'messi'
+        self.create_user(username)
+        headers = oauth2Header(username)
+        headers['X-Max-Server-Timing'] = '1'
+
+        res = self.testapp.get('/people/{}'.format(username), '', headers, status=200)
+        self.assertNotIn('Server-Timing', res.headers)
+
     def test_raw_request_parsing(self):
         """
         """
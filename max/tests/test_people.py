@@ -276,3 +276,44 @@ class FunctionalTests(unittest.TestCase, MaxTestBase):
     def test_create_own_user(self):
         username = 'messi'
         self.testapp.post('/people/%s' % username, "", oauth2Header(username), status=201)
+
+    def test_import_users(self):
+        """
+            Given a JSONL stream of users with new, existing, duplicated and invalid entries
+            When i import it in bulk
+            Then only the new users are created
+            And the report accounts for every line
+        """
+        self.create_user('messi')
+        lines = [
+            json.dumps({'username': 'Xavi', 'displayName': 'Xavi Hernandez'}),
+            json.dumps({'username': 'iniesta'}),
+            json.dumps({'username': 'xavi'}),
+            json.dumps({'username': 'messi'}),
+            '',
+            json.dumps({'displayName': 'Nobody'}),
+            '{"username": "broken"',
+        ]
+        res = self.testapp.post('/admin/import/people?notifications=0', '\n'.join(lines), oauth2Header(test_manager), status=201)
+        result = json.loads(res.text)
+        self.assertEqual(result['created'], 2)
+        self.assertEqual(result['existing'], 1)
+        self.assertEqual(result['invalid'], 3)
+        self.assertEqual(result['created'] + result['existing'] + result['invalid'], len([line for line in lines if line]))
+        self.assertItemsEqual([error['line'] for error in result['errors']], [3, 6, 7])
+
+        res = self.testapp.get('/people/xavi', "", oauth2Header('xavi'), status=200)
+        self.assertEqual(json.loads(res.text)['displayName'], 'Xavi Hernandez')
+        self.testapp.get('/people/iniesta', "", oauth2Header('iniesta'), status=200)
+
+    def test_import_users_all_existing(self):
+        """
+            Given a JSONL stream of users that already exist
+            When i import it in bulk
+            Then nothing is created
+        """
+        self.create_user('messi')
+        res = self.testapp.post('/admin/import/people?notifications=0', json.dumps({'username': 'messi'}), oauth2Header(test_manager), status=200)
+        result = json.loads(res.text)
+        self.assertEqual(result['created'], 0)
+        self.assertEqual(result['existing'], 1)
@@ -78,3 +78,44 @@ class RegexTests(unittest.TestCase):
         self.assertEqual(re.sub(RE_VALID_TWITTER_USERNAME, r'\1', 'johndoe'), 'johndoe')
         self.assertEqual(re.sub(RE_VALID_TWITTER_USERNAME, r'\1', '   @johndoe   '), 'johndoe')
         self.assertEqual(re.sub(RE_VALID_TWITTER_USERNAME, r'\1', '   johndoe   '), 'johndoe')
+
+    def test_extract_entities(self):
+        """
+        Tests that urls, hashtags and keywords are extracted in a single pass.
+        See max.utils.entities for more info on what is considered each entity
+        """
+        from max.utils.entities import extract_entities
+        text = u"#first # Hello i'm a #Text with #hashtags but#some are not valid#  # ##double #ab #last http://example.com/#hash www.upc.edu"
+        entities = extract_entities(text)
+        self.assertEqual(entities.hashtags, [u'first', u'text', u'hashtags', u'ab', u'last'])
+        self.assertEqual(entities.keywords, [u'first', u'hello', u'text', u'with', u'hashtags', u'but', u'are', u'not', u'valid', u'last'])
+        self.assertEqual([text[start:end] for start, end in entities.urls], [u'http://example.com/#hash', u'www.upc.edu'])
+
+    def test_extract_entities_with_accented_chars(self):
+        """
+        Tests that lowercase and uppercase accented chars are part of hashtags and keywords
+        """
+        from max.utils.entities import extract_entities
+        entities = extract_entities(u"L'Àlex ha penjat la presentació de la #Reunió a (http://foo.com/bar)")
+        self.assertEqual(entities.hashtags, [u'reunió'])
+        self.assertEqual(entities.keywords, [u'àlex', u'penjat', u'presentació', u'reunió'])
+        self.assertEqual(len(entities.urls), 1)
+
+    def test_extract_entities_urls_glued_to_words(self):
+        """
+        Tests that urls right after a keyword are found, as with the previous extraction
+        """
+        from max.benchmarks.entities import legacy_extract_entities
+        from max.benchmarks.entities import single_pass_extract_entities
+        from max.utils.entities import extract_entities
+
+        entities = extract_entities(u"seehttp://x.com")
+        self.assertEqual(entities.keywords, [u'see'])
+        self.assertEqual(len(entities.urls), 1)
+
+        for text in [u"seehttp://x.com", u"Visitwww.upc.edu now", u"Mira:https://x.com/a i www.upc.edu"]:
+            self.assertEqual(single_pass_extract_entities(text), legacy_extract_entities(text))
+
+        entities = extract_entities(u"#foohttp://x.com")
+        self.assertEqual(entities.hashtags, [u'foo'])
+        self.assertEqual([u"#foohttp://x.com"[start:end] for start, end in entities.urls], [u'http://x.com'])
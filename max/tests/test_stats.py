@@ -214,6 +214,103 @@ class FunctionalTests(unittest.TestCase, MaxTestBase):
         res = self.testapp.head('/people/%s/comments' % username, oauth2Header(username), status=200)
         self.assertEqual(res.headers.get('X-totalItems'), '2')
 
+    def test_context_stats_from_counters(self):
+        """
+            Given a context with activities and comments
+            When i count them after the first count
+            Then the counts are answered from counters kept up to date
+            And an exact count sets the counter again
+        """
+        from .mockers import user_status_context
+        from .mockers import create_context
+        from .mockers import subscribe_context
+        from .mockers import user_comment
+        from hashlib import sha1
+
+        username = 'messi'
+        self.create_user(username)
+        self.create_context(create_context)
+        self.admin_subscribe_user_to_context(username, subscribe_context)
+        url_hash = sha1(create_context['url']).hexdigest()
+
+        activity = self.create_activity(username, user_status_context).json
+        self.testapp.post('/activities/%s/comments' % activity['id'], json.dumps(user_comment), oauth2Header(username), status=201)
+
+        res = self.testapp.head('/contexts/%s/activities' % url_hash, oauth2Header(test_manager), status=200)
+        self.assertEqual(res.headers.get('X-totalItems'), '1')
+        res = self.testapp.head('/contexts/%s/comments' % url_hash, oauth2Header(test_manager), status=200)
+        self.assertEqual(res.headers.get('X-totalItems'), '1')
+        res = self.testapp.head('/people/%s/comments' % username, oauth2Header(username), status=200)
+        self.assertEqual(res.headers.get('X-totalItems'), '1')
+
+        second = self.create_activity(username, user_status_context, note='second').json
+        self.testapp.post('/activities/%s/comments' % second['id'], json.dumps(user_comment), oauth2Header(username), status=201)
+        self.testapp.delete('/activities/%s' % activity['id'], '', oauth2Header(username), status=204)
+
+        counters = dict([(counter['_id'], counter['count']) for counter in self.exec_mongo_query('counters', 'find', {})])
+        self.assertEqual(counters[u'context_activities:{}'.format(create_context['url'])], 1)
+        self.assertEqual(counters[u'context_comments:{}'.format(url_hash)], 2)
+        self.assertEqual(counters[u'user_comments:{}'.format(username)], 2)
+
+        res = self.testapp.head('/contexts/%s/activities' % url_hash, oauth2Header(test_manager), status=200)
+        self.assertEqual(res.headers.get('X-totalItems'), '1')
+        res = self.testapp.head('/contexts/%s/comments' % url_hash, oauth2Header(test_manager), status=200)
+        self.assertEqual(res.headers.get('X-totalItems'), '2')
+
+        # Drifted counters are fixed with an exact count
+        self.exec_mongo_query('counters', 'update', {'_id': u'context_comments:{}'.format(url_hash)}, {'$set': {'count': 10}})
+        res = self.testapp.head('/contexts/%s/comments' % url_hash, oauth2Header(test_manager), status=200)
+        self.assertEqual(res.headers.get('X-totalItems'), '10')
+        res = self.testapp.head('/contexts/%s/comments?exact=1' % url_hash, oauth2Header(test_manager), status=200)
+        self.assertEqual(res.headers.get('X-totalItems'), '2')
+        res = self.testapp.head('/contexts/%s/comments' % url_hash, oauth2Header(test_manager), status=200)
+        self.assertEqual(res.headers.get('X-totalItems'), '2')
+
+    def test_global_activities_estimated_stats(self):
+        """
+            Given some activities
+            When i ask for an estimated global count
+            Then i get it from the global counter, kept up to date
+        """
+        from .mockers import user_status
+        username = 'messi'
+        self.create_user(username)
+
+        self.create_activity(username, user_status, note='first')
+        res = self.testapp.head('/activities?estimated=1', oauth2Header(test_manager), status=200)
+        self.assertEqual(res.headers.get('X-totalItems'), '1')
+
+        self.create_activity(username, user_status, note='second')
+        res = self.testapp.head('/activities?estimated=1', oauth2Header(test_manager), status=200)
+        self.assertEqual(res.headers.get('X-totalItems'), '2')
+        counter = self.exec_mongo_query('counters', 'find', {'_id': 'activities'})[0]
+        self.assertEqual(counter['count'], 2)
+
+    def test_counter_created_concurrently(self):
+        """
+            Given a missing counter
+            When it's created by another request while it's being counted
+            Then the counter created first is kept, and returned
+        """
+        from max.counters import Counters
+        from .mockers import user_status
+        username = 'messi'
+        self.create_user(username)
+        self.create_activity(username, user_status)
+
+        db = self.app.registry.max_store
+        counters = Counters(db)
+
+        class ConcurrentlyCountedActivities(object):
+            def find(self, query):
+                counters.collection.insert_one({'_id': 'activities', 'count': 5})
+                return db.activity.find(query)
+
+        counters.activity = ConcurrentlyCountedActivities()
+        self.assertEqual(counters.count('activities', {'verb': 'post'}), 5)
+        counter = self.exec_mongo_query('counters', 'find', {'_id': 'activities'})[0]
+        self.assertEqual(counter['count'], 5)
+
     def test_timeline_authors(self):
         """
             As a plain user
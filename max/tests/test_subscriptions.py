@@ -423,3 +423,164 @@ class FunctionalTests(unittest.TestCase, MaxTestBase):
         self.assertEqual(res.json['permissions']['read'], 'subscribed')
         self.assertEqual(res.json['permissions']['write'], 'subscribed')
         res = self.create_activity(username, user_status_context, expect=403)
+
+    def test_change_context_permissions_with_mixed_grants_and_vetos(self):
+        """
+            Create a write restricted context, admin subscribes three users to context.
+            Admin grants write permanently to one user, and vetoes read to another.
+            Change the context to write subscribed and rename it, and each user keeps
+            its own grants and vetos, and all of them see the new name.
+        """
+        from .mockers import create_context
+        from .mockers import subscribe_context
+
+        url_hash = sha1(create_context['url']).hexdigest()
+        self.create_context(create_context, permissions=dict(read='subscribed', write='restricted', subscribe='restricted', invite='restricted'))
+        for username in ['messi', 'xavi', 'puyol']:
+            self.create_user(username)
+            self.admin_subscribe_user_to_context(username, subscribe_context, expect=201)
+
+        self.testapp.put('/contexts/%s/permissions/%s/%s?permanent=1' % (url_hash, 'xavi', 'write'), "", oauth2Header(test_manager), status=201)
+        self.testapp.delete('/contexts/%s/permissions/%s/%s?permanent=1' % (url_hash, 'puyol', 'read'), "", oauth2Header(test_manager), status=201)
+
+        data = json.dumps({"displayName": "New Name", "permissions": {'write': 'subscribed'}})
+        self.testapp.put('/contexts/%s' % url_hash, data, oauth2Header(test_manager), status=200)
+
+        expected_permissions = {
+            'messi': ['read', 'write'],
+            'xavi': ['read', 'write'],
+            'puyol': ['write'],
+        }
+        for username, permissions in expected_permissions.items():
+            res = self.testapp.get('/people/%s/subscriptions' % username, '', oauth2Header(username), status=200)
+            self.assertEqual(res.json[0]['displayName'], 'New Name')
+            self.assertItemsEqual(res.json[0]['permissions'], permissions)
+
+    def test_change_context_url_and_permissions_with_mixed_grants_and_vetos(self):
+        """
+            Create a write restricted context, admin subscribes three users to context.
+            Admin grants write permanently to one user, and vetoes read to another.
+            Change the context to write subscribed and change its url in the same request,
+            and each user keeps its own grants and vetos on the subscription to the new url,
+            and the subscription activities of the users point to the new url.
+        """
+        from .mockers import create_context
+        from .mockers import subscribe_context
+
+        url_hash = sha1(create_context['url']).hexdigest()
+        new_url = 'http://new.url'
+        new_url_hash = sha1(new_url).hexdigest()
+        self.create_context(create_context, permissions=dict(read='subscribed', write='restricted', subscribe='restricted', invite='restricted'))
+        for username in ['messi', 'xavi', 'puyol']:
+            self.create_user(username)
+            self.admin_subscribe_user_to_context(username, subscribe_context, expect=201)
+
+        self.testapp.put('/contexts/%s/permissions/%s/%s?permanent=1' % (url_hash, 'xavi', 'write'), "", oauth2Header(test_manager), status=201)
+        self.testapp.delete('/contexts/%s/permissions/%s/%s?permanent=1' % (url_hash, 'puyol', 'read'), "", oauth2Header(test_manager), status=201)
+
+        data = json.dumps({"url": new_url, "permissions": {'write': 'subscribed'}})
+        self.testapp.put('/contexts/%s' % url_hash, data, oauth2Header(test_manager), status=200)
+
+        expected_permissions = {
+            'messi': ['read', 'write'],
+            'xavi': ['read', 'write'],
+            'puyol': ['write'],
+        }
+        for username, permissions in expected_permissions.items():
+            res = self.testapp.get('/people/%s/subscriptions' % username, '', oauth2Header(username), status=200)
+            self.assertEqual(res.json[0]['url'], new_url)
+            self.assertEqual(res.json[0]['hash'], new_url_hash)
+            self.assertItemsEqual(res.json[0]['permissions'], permissions)
+
+            subscription_activities = self.exec_mongo_query('activity', 'find', {'verb': 'subscribe', 'actor.username': username})
+            self.assertEqual(subscription_activities[0]['object']['url'], new_url)
+            self.assertEqual(subscription_activities[0]['object']['hash'], new_url_hash)
+
+    def test_subscribe_users_to_context_in_bulk(self):
+        """
+            Given a admin user
+            When I subscribe a list of users to a context in bulk
+            Then the new users get subscribed with a subscribe activity
+            And already subscribed and unknown users are reported
+        """
+        from .mockers import create_context
+        from .mockers import subscribe_context
+
+        url_hash = sha1(create_context['url']).hexdigest()
+        self.create_user('messi')
+        self.create_user('xavi')
+        self.create_user('puyol')
+        self.create_context(create_context)
+        self.admin_subscribe_user_to_context('puyol', subscribe_context, expect=201)
+
+        usernames = ['messi', 'Xavi', 'puyol', 'unknown']
+        res = self.testapp.post('/contexts/%s/bulk-subscriptions' % url_hash, json.dumps(usernames), oauth2Header(test_manager), status=201)
+        self.assertEqual(res.json['subscribed'], ['messi', 'xavi'])
+        self.assertEqual(res.json['already_subscribed'], ['puyol'])
+        self.assertEqual(res.json['unknown'], ['unknown'])
+
+        res = self.testapp.get('/contexts/%s/subscriptions' % url_hash, "", oauth2Header(test_manager), status=200)
+        self.assertEqual(sorted([subscription['username'] for subscription in res.json]), ['messi', 'puyol', 'xavi'])
+
+        res = self.testapp.get('/people/%s/subscriptions' % 'xavi', {}, oauth2Header('xavi'), status=200)
+        self.assertEqual(len(res.json), 1)
+        self.assertEqual(res.json[0]['hash'], url_hash)
+
+        subscribe_activities = self.exec_mongo_query('activity', 'find', {'verb': 'subscribe', 'object.url': create_context['url']})
+        self.assertEqual(sorted([activity['actor']['username'] for activity in subscribe_activities]), ['messi', 'puyol', 'xavi'])
+
+        res = self.testapp.post('/contexts/%s/bulk-subscriptions' % url_hash, json.dumps(['messi']), oauth2Header(test_manager), status=200)
+        self.assertEqual(res.json['subscribed'], [])
+
+    def test_subscribe_users_to_context_in_bulk_invalid_payload(self):
+        """
+            Given a admin user
+            When I subscribe users to a context in bulk without posting a list of usernames
+            Then I get a validation error
+        """
+        from .mockers import create_context
+
+        url_hash = sha1(create_context['url']).hexdigest()
+        self.create_context(create_context)
+        self.testapp.post('/contexts/%s/bulk-subscriptions' % url_hash, json.dumps({'username': 'messi'}), oauth2Header(test_manager), status=400)
+
+    def test_unsubscribe_users_from_context_in_bulk(self):
+        """
+            Given a admin user
+            When I unsubscribe a list of users from a context in bulk
+            Then the users are not subscribed to the context anymore
+        """
+        from .mockers import create_context
+        from .mockers import subscribe_context
+
+        url_hash = sha1(create_context['url']).hexdigest()
+        self.create_user('messi')
+        self.create_user('xavi')
+        self.create_user('puyol')
+        self.create_context(create_context)
+        self.admin_subscribe_user_to_context('messi', subscribe_context, expect=201)
+        self.admin_subscribe_user_to_context('xavi', subscribe_context, expect=201)
+        self.admin_subscribe_user_to_context('puyol', subscribe_context, expect=201)
+
+        self.testapp.delete('/contexts/%s/bulk-subscriptions' % url_hash, json.dumps(['messi', 'xavi', 'unknown']), oauth2Header(test_manager), status=204)
+
+        res = self.testapp.get('/contexts/%s/subscriptions' % url_hash, "", oauth2Header(test_manager), status=200)
+        self.assertEqual([subscription['username'] for subscription in res.json], ['puyol'])
+
+    def test_unsubscribe_user_named_as_bulk_route(self):
+        """
+            Given a admin user
+            When I unsubscribe a user named bulk from a context
+            Then the user is unsubscribed through the single user subscription route
+        """
+        from .mockers import create_context
+        from .mockers import subscribe_context
+
+        url_hash = sha1(create_context['url']).hexdigest()
+        self.create_user('bulk')
+        self.create_context(create_context)
+        self.admin_subscribe_user_to_context('bulk', subscribe_context, expect=201)
+        self.admin_unsubscribe_user_from_context('bulk', url_hash, expect=204)
+
+        res = self.testapp.get('/contexts/%s/subscriptions' % url_hash, "", oauth2Header(test_manager), status=200)
+        self.assertEqual(res.json, [])
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 from max.tests.base import MaxTestBase
 from max.tests.base import MockTweepyAPI
+from max.tests import test_cloudapis
+from max.tests.base import http_mock_twitter_api
 from max.tests.base import http_mock_twitter_user_image
 
 from paste.deploy import loadapp
@@ -157,3 +159,82 @@ class TwitterApiFailingScenariosTestCase(unittest.TestCase, MaxTestBase):
         imagefile = os.path.join(self.tempfolder, 'twitter.png')
         download_twitter_user_image(api, 'maxupcnet', imagefile)
         self.assertFileNotExists(imagefile)
+
+
+class TwitterClientTestCase(unittest.TestCase, MaxTestBase):
+    """
+        Tests to check the memoized twitter client, against
+        a fake twitter api
+    """
+
+    def setUp(self):
+        self.conf_dir = os.path.dirname(__file__)
+        self.app = loadapp('config:tests.ini', relative_to=self.conf_dir)
+        self.app.registry.cloudapis_settings = test_cloudapis
+        self.tempfolder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempfolder)
+
+    @httpretty.activate
+    def test_twitter_client_verifies_credentials_once(self):
+        """
+            Given a twitter client
+            When i get the api several times
+            Then the credentials are verified only the first time
+        """
+        from max.utils.twitter import get_twitter_api
+        calls = http_mock_twitter_api()
+
+        api = get_twitter_api(self.app.registry)
+        self.assertIs(get_twitter_api(self.app.registry), api)
+        self.assertEqual(calls['verify_credentials'], 1)
+
+    @httpretty.activate
+    def test_twitter_client_remembers_userids(self):
+        """
+            Given a twitter client
+            When i resolve the same twitter username several times
+            Then twitter is asked only the first time
+        """
+        from max.utils.twitter import get_twitter_client
+        calls = http_mock_twitter_api(userid='1234')
+        twitter = get_twitter_client(self.app.registry)
+
+        self.assertEqual(twitter.get_userid('maxupcnet'), '1234')
+        self.assertEqual(twitter.get_userid('MaxUpcNet'), '1234')
+        self.assertEqual(calls['get_user'], 1)
+
+    @httpretty.activate
+    def test_twitter_client_failing_api(self):
+        """
+            Given a twitter api that fails
+            When i get the api several times
+            Then i get nothing in response
+            And the credentials are not verified again until a while later
+        """
+        from max.utils.twitter import get_twitter_api
+        calls = http_mock_twitter_api(fail=True)
+
+        self.assertIsNone(get_twitter_api(self.app.registry))
+        self.assertIsNone(get_twitter_api(self.app.registry))
+        self.assertEqual(calls['verify_credentials'], 1)
+
+    @httpretty.activate
+    def test_twitter_client_background_avatar_download(self):
+        """
+            Given a twitter client running lookups on the background
+            When i request an avatar refresh
+            Then the avatar is downloaded by the background worker
+        """
+        from max.utils.twitter import get_twitter_client
+        http_mock_twitter_api()
+        http_mock_twitter_user_image(os.path.join(self.conf_dir, "avatar.png"))
+
+        twitter = get_twitter_client(self.app.registry)
+        twitter.tasks.enabled = True
+        imagefile = os.path.join(self.tempfolder, 'twitter.png')
+        twitter.refresh_avatar('maxupcnet', imagefile)
+        twitter.tasks.join()
+
+        self.assertFileExists(imagefile)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+    Request scoped timing of the subsystems involved in serving a request.
+
+    Time spent checking oauth tokens, querying mongodb, notifying rabbitmq,
+    serializing the results and in the view itself is collected only for
+    requests that ask for it with the X-Max-Server-Timing header, a fraction
+    of the requests set by `max.server_timing_sample_rate`, or all of them
+    while the request dumper is enabled. Other requests only pay a lookup on
+    the request environment at each timed point.
+
+    Collected timings are returned on the Server-Timing header only to Managers
+    asking for them. Timings of sampled requests are logged, and all of them
+    are added to the request dump.
+"""
+from max.security import Manager
+from max.security import get_user_roles
+from max.tweens import dump_requests
+
+from pyramid.threadlocal import get_current_request
+
+from collections import OrderedDict
+from functools import wraps
+
+import logging
+import random
+import time
+
+logger = logging.getLogger('max')
+
+TIMING_HEADER = 'X-Max-Server-Timing'
+
+
+class RequestTimings(object):
+    """
+        Time spent on each subsystem while serving a request.
+
+        Timers of a subsystem can be nested, only the outermost one counts.
+    """
+
+    def __init__(self):
+        self.timings = OrderedDict()
+        self.running = {}
+
+    def add(self, name, seconds, count=1):
+        total, total_count = self.timings.get(name, (0, 0))
+        self.timings[name] = (total + seconds, total_count + count)
+
+    def start(self, name):
+        depth, started = self.running.get(name, (0, None))
+        self.running[name] = (depth + 1, started if depth else time.time())
+
+    def stop(self, name):
+        depth, started = self.running.pop(name)
+        if depth > 1:
+            self.running[name] = (depth - 1, started)
+        else:
+            self.add(name, time.time() - started)
+
+    def header(self):
+        """
+            Returns the timings formatted as a Server-Timing header value
+        """
+        return ', '.join([
+            '{};dur={:.2f};desc="{} calls"'.format(name, total * 1000, count)
+            for name, (total, count) in self.timings.items()
+        ])
+
+    def format(self):
+        return ', '.join([
+            '{} {:.2f}ms ({})'.format(name, total * 1000, count)
+            for name, (total, count) in self.timings.items()
+        ])
+
+
+def get_request_timings(request=None):
+    """
+        Returns the timings collector of a request, or of the current one
+        if not given. Returns None if the request is not being timed.
+    """
+    if request is None:
+        request = get_current_request()
+        if request is None:
+            return None
+    return request.environ.get('max.timings')
+
+
+class timed(object):
+    """
+        Context manager timing a block as part of a subsystem
+    """
+
+    def __init__(self, name, request=None):
+        self.name = name
+        self.timings = get_request_timings(request)
+
+    def __enter__(self):
+        if self.timings is not None:
+            self.timings.start(self.name)
+
+    def __exit__(self, *exc_info):
+        if self.timings is not None:
+            self.timings.stop(self.name)
+
+
+def timed_call(name):
+    """
+        Decorator timing each call of a function as part of a subsystem
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            timings = get_request_timings()
+            if timings is None:
+                return func(*args, **kwargs)
+            timings.start(name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timings.stop(name)
+        return wrapper
+    return decorator
+
+
+def timed_view(view):
+    """
+        View decorator timing the view callable
+    """
+    @wraps(view)
+    def wrapper(context, request):
+        timings = request.environ.get('max.timings')
+        if timings is None:
+            return view(context, request)
+        timings.start('view')
+        try:
+            return view(context, request)
+        finally:
+            timings.stop('view')
+    return wrapper
+
+
+def is_manager(request):
+    try:
+        userid = request.authenticated_userid
+    except Exception:
+        return False
+    return userid is not None and Manager in get_user_roles(request, userid)
+
+
+def server_timing_factory(handler, registry):
+    sample_rate = float(registry.settings.get('max.server_timing_sample_rate', 0))
+
+    def server_timing_tween(request):
+        requested = TIMING_HEADER in request.headers
+        sampled = sample_rate > 0 and random.random() < sample_rate
+        if not (requested or sampled or dump_requests['enabled']):
+            return handler(request)
+
+        timings = request.environ['max.timings'] = RequestTimings()
+        start = time.time()
+        response = handler(request)
+        timings.add('total', time.time() - start)
+
+        if sampled:
+            logger.info('Server timing of {} {}: {}'.format(request.method, request.path, timings.header()))
+        if requested and is_manager(request):
+            response.headers['Server-Timing'] = timings.header()
+        return response
+
+    return server_timing_tween
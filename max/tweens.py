@@ -1,9 +1,7 @@
 # -*- coding: utf-8 -*-
 from zope.interface import providedBy
 
-from max.deprecations import DELETE_DEPRECATIONS
-from max.deprecations import POST_DEPRECATIONS
-from max.deprecations import check_deprecation
+from max.deprecations import get_deprecations
 from max.exceptions.http import JSONHTTPPreconditionFailed
 from max.exceptions.scavenger import format_raw_request
 from max.exceptions.scavenger import format_raw_response
@@ -22,6 +20,10 @@ import sys
 request_logger = logging.getLogger('requestdump')
 dump_requests = {'enabled': False}
 
+# Content types of the bodies where tunneled params are looked for. Bodies
+# without a content type are parsed as forms by webob
+FORM_CONTENT_TYPES = ['', 'application/x-www-form-urlencoded', 'multipart/form-data']
+
 SEPARATOR = '-' * 80
 DUMP_TEMPLATE = u"""
 {sep}
@@ -45,9 +47,16 @@ def dump_request(request, response):
         if global var dump_requests['enabled'] is True
     """
     if dump_requests['enabled'] and response.status_int != 500:
+        dumped_response = format_raw_response(response)
+
+        # Timings collected up to now, see max.timing
+        timings = request.environ.get('max.timings')
+        if timings is not None:
+            dumped_response = u'{}\n--\nTIMINGS: {}'.format(dumped_response, timings.format())
+
         request_logger.debug(DUMP_TEMPLATE.format(
             format_raw_request(request),
-            format_raw_response(response)
+            dumped_response
         ))
 
 
@@ -133,43 +142,56 @@ def compatibility_checker_factory(handler, registry):
     return compatibility_checker_tween
 
 
+def get_tunneled_param(request, name, default=None):
+    """
+        Returns a parameter sent on the query string or on a form body.
+
+        Bodies are only parsed when sent as a form, or without a content type,
+        as clients that can't set headers do. Form bodies are made seekable
+        before being parsed, so they can still be read afterwards, and its
+        parsed params are reused by webob. Multipart bodies are parsed to
+        temporary files, so uploads aren't read whole into memory.
+    """
+    value = request.GET.get(name, None)
+    if value is None and request.content_type in FORM_CONTENT_TYPES:
+        request.make_body_seekable()
+        value = request.POST.get(name, None)
+    return default if value is None else value
+
+
 def post_tunneling_factory(handler, registry):
     def post_tunneling_tween(request):
-        original_body = request.body
+        if request.method.upper() != 'POST':
+            return handler(request)
+
         # Look for header in post-data if not found in headers
-        overriden_method = request.headers.get('X-HTTP-Method-Override', request.params.get('X-HTTP-Method-Override', None))
-        is_valid_overriden_method = overriden_method in ['DELETE', 'PUT', 'GET']
-        is_POST_request = request.method.upper() == 'POST'
-        if is_POST_request and is_valid_overriden_method:
+        overriden_method = request.headers.get('X-HTTP-Method-Override', None)
+        if overriden_method is None:
+            overriden_method = get_tunneled_param(request, 'X-HTTP-Method-Override')
+
+        if overriden_method in ['DELETE', 'PUT', 'GET']:
             # If it's an overriden GET pass over the authentication data in the post body
             # to the headers, before overriding the method, after this, post data will be lost
             if overriden_method == 'GET':
-                request.headers.setdefault('X-Oauth-Token', request.params.get('X-Oauth-Token', ''))
-                request.headers.setdefault('X-Oauth-Username', request.params.get('X-Oauth-Username', ''))
-                request.headers.setdefault('X-Oauth-Scope', request.params.get('X-Oauth-Scope', ''))
+                request.headers.setdefault('X-Oauth-Token', get_tunneled_param(request, 'X-Oauth-Token', ''))
+                request.headers.setdefault('X-Oauth-Username', get_tunneled_param(request, 'X-Oauth-Username', ''))
+                request.headers.setdefault('X-Oauth-Scope', get_tunneled_param(request, 'X-Oauth-Scope', ''))
 
             request.method = overriden_method
 
-        # Restore uncorrupted body
-        request.body = original_body
         response = handler(request)
         return response
     return post_tunneling_tween
 
 
 def deprecation_wrapper_factory(handler, registry):
+    deprecations = get_deprecations(registry)
+
     def deprecation_wrapper_tween(request):
         response_wrapper = None
-        if request.method == 'POST':
-            for pattern, action in POST_DEPRECATIONS:
-                matched, response_wrapper = check_deprecation(request, pattern, action)
-                if matched:
-                    break
-        elif request.method == 'DELETE':
-            for pattern, action in DELETE_DEPRECATIONS:
-                matched, response_wrapper = check_deprecation(request, pattern, action)
-                if matched:
-                    break
+        table = deprecations.get(request.method)
+        if table is not None:
+            response_wrapper = table.apply(request)
         response = handler(request)
         if response_wrapper:
             return response_wrapper(response)
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+    Materialized ancestry of contexts.
+
+    A context is a child of the contexts whose urls are the prefixes of its
+    url ending before a path separator, with or without it. Contexts and the
+    contexts of the activities store the hashes of all their ancestors,
+    themselves included, so recursive context queries are an indexed match
+    on a hash.
+"""
+from max.utils.formatting import url_hash
+
+
+def url_ancestors(url):
+    """
+        Returns the urls of the ancestors of a context url, from the
+        outermost one to the url itself.
+
+        Contexts are registered with or without a trailing separator, so both
+        spellings of each ancestor are returned, and the url itself as given.
+    """
+    scheme_end = url.find('://')
+    start = scheme_end + 3 if scheme_end != -1 else 0
+    path = url.rstrip('/')
+
+    prefixes = []
+    separator = path.find('/', start)
+    while separator != -1:
+        if separator > start:
+            prefixes.append(path[:separator])
+        separator = path.find('/', separator + 1)
+    prefixes.append(path)
+
+    ancestors = []
+    for prefix in prefixes:
+        for ancestor in [prefix, prefix + '/']:
+            if ancestor not in ancestors:
+                ancestors.append(ancestor)
+
+    if url not in ancestors:
+        ancestors.append(url)
+    return ancestors
+
+
+def ancestor_hashes(url):
+    """
+        Returns the hashes of the ancestors of a context url, itself included
+    """
+    return [url_hash(ancestor) for ancestor in url_ancestors(url)]
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from Queue import Queue
+
+import logging
+import threading
+
+
+class BackgroundTasks(object):
+    """
+        A queue of tasks run one after another on a background thread.
+
+        Tasks with the same key as a task still pending are skipped. If the
+        queue is not enabled, tasks are run inline as they are added.
+    """
+
+    def __init__(self, name, enabled=True):
+        self.name = name
+        self.enabled = enabled
+        self.pending = set()
+        self.queue = Queue()
+        self.lock = threading.Lock()
+        self.worker = None
+
+    def run(self, key, task, *args):
+        """
+            Adds a task to the queue, or runs it right away if not enabled
+        """
+        if not self.enabled:
+            return task(*args)
+
+        with self.lock:
+            if key in self.pending:
+                return
+            self.pending.add(key)
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self.work, name=self.name)
+                self.worker.daemon = True
+                self.worker.start()
+        self.queue.put((key, task, args))
+
+    def work(self):
+        while True:
+            key, task, args = self.queue.get()
+            try:
+                task(*args)
+            except Exception:
+                logging.getLogger('max').exception('Error on {} background task {}'.format(self.name, key))
+            finally:
+                with self.lock:
+                    self.pending.discard(key)
+                self.queue.task_done()
+
+    def join(self):
+        """
+            Waits until all the queued tasks are done
+        """
+        self.queue.join()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+    Content addressed storage of activity and message attachments.
+
+    Blobs are stored on the file repository by the sha1 of its content, so
+    identical uploads are stored only once. Blobs are written and read in
+    chunks, so attachments are never held completely in memory.
+"""
+from pyramid.response import FileResponse
+from pyramid.response import Response
+
+from base64 import b64encode
+from base64 import decodestring
+from hashlib import sha1
+from io import BytesIO
+from tempfile import NamedTemporaryFile
+
+import os
+
+BLOB_CHUNK_SIZE = 64 * 1024
+
+# Multiple of 3, so chunks can be base64 encoded independently
+BASE64_CHUNK_SIZE = 3 * 16 * 1024
+
+
+def get_blobs_folder(base_path):
+    return os.path.join(base_path, 'blobs')
+
+
+def get_blob_path(base_path, digest):
+    """
+        Returns the path where the blob with the given digest is stored
+    """
+    return os.path.join(get_blobs_folder(base_path), digest[:2], digest[2:4], digest)
+
+
+def store_blob(base_path, source):
+    """
+        Stores the contents of a file-like object as a blob, and returns its digest.
+
+        The content is copied in chunks to a temporary file while hashing it, and
+        moved to its final place only if there's no blob with the same content yet.
+        Sources that are not file-like are expected to be base64 encoded strings.
+    """
+    if not hasattr(source, 'read'):
+        source = BytesIO(decodestring(source))
+
+    blobs_folder = get_blobs_folder(base_path)
+    if not os.path.exists(blobs_folder):
+        os.makedirs(blobs_folder)
+
+    content_hash = sha1()
+    with NamedTemporaryFile(dir=blobs_folder, delete=False) as temporary:
+        for chunk in iter(lambda: source.read(BLOB_CHUNK_SIZE), b''):
+            content_hash.update(chunk)
+            temporary.write(chunk)
+
+    digest = content_hash.hexdigest()
+    path = get_blob_path(base_path, digest)
+    if os.path.exists(path):
+        os.remove(temporary.name)
+    else:
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        os.rename(temporary.name, path)
+
+    return digest
+
+
+def base64_file_iter(path):
+    """
+        Yields the base64 encoded contents of a file, chunk by chunk
+    """
+    with open(path, 'rb') as blob:
+        for chunk in iter(lambda: blob.read(BASE64_CHUNK_SIZE), b''):
+            yield b64encode(chunk)
+
+
+def file_etag(path):
+    """
+        Returns a validator for a file, derived from its modification time and size
+    """
+    stat = os.stat(path)
+    return '{:x}-{:x}'.format(int(stat.st_mtime * 1000000), stat.st_size)
+
+
+def blob_response(request, path, content_type, etag=None, base64=False, cache_max_age=None, public=False):
+    """
+        Returns a response streaming the file at path.
+
+        The file is served through wsgi.file_wrapper when the server provides it,
+        and the response answers conditional and Range requests. The etag defaults
+        to one derived from the file modification time and size. If cache_max_age is
+        given, clients are allowed to cache the response, privately unless public is set.
+
+        If base64 is requested, the file contents are encoded on the fly and
+        served without validators.
+    """
+    if base64:
+        response = Response(app_iter=base64_file_iter(path), status_int=200)
+        response.content_type = 'application/base64'
+        return response
+
+    response = FileResponse(path, request=request, content_type=content_type)
+    response.etag = etag if etag is not None else file_etag(path)
+    response.accept_ranges = 'bytes'
+
+    if cache_max_age is not None:
+        response.cache_control.max_age = cache_max_age
+        if public:
+            response.cache_control.public = True
+        else:
+            response.cache_control.private = True
+    return response
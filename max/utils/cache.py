@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+from collections import namedtuple
+
+import os
+import threading
+
+# Default maximum size in bytes of the in-process image cache
+IMAGE_CACHE_SIZE = 32 * 1024 * 1024
+
+CachedFile = namedtuple('CachedFile', ['data', 'etag', 'mtime', 'path'])
+
+
+class LRUBytesCache(object):
+    """
+        A least recently used cache of file contents, bounded by the total
+        size in bytes of the cached files.
+
+        Keys are tuples, so all the entries of an object can be evicted at once
+        by prefix. Files larger than the whole cache are never stored.
+    """
+
+    def __init__(self, max_bytes=IMAGE_CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.RLock()
+
+    def get(self, key):
+        """
+            Returns the cached file for a key, or None if not cached
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.entries[key] = entry
+            return entry
+
+    def set(self, key, entry):
+        """
+            Stores a cached file, evicting the least recently used ones if needed
+        """
+        entry_size = len(entry.data)
+        if entry_size > self.max_bytes:
+            return
+
+        with self.lock:
+            self.evict(key)
+            while self.entries and self.size + entry_size > self.max_bytes:
+                oldest_key, oldest = self.entries.popitem(last=False)
+                self.size -= len(oldest.data)
+            self.entries[key] = entry
+            self.size += entry_size
+
+    def load(self, key, path, etag=None):
+        """
+            Reads a file from disk, and caches it with validators derived
+            from its modification time and size, unless an etag is given.
+        """
+        with open(path, 'rb') as cached_file:
+            data = cached_file.read()
+            stat = os.fstat(cached_file.fileno())
+
+        etag = etag if etag is not None else '{:x}-{:x}'.format(int(stat.st_mtime * 1000000), stat.st_size)
+        entry = CachedFile(data, etag, stat.st_mtime, path)
+        self.set(key, entry)
+        return entry
+
+    def load_fresh(self, key, path):
+        """
+            Returns the cached file for a key if it was read from the same path
+            and the file didn't change on disk since, otherwise reads it again.
+
+            Files can be replaced by any process, so this is the only check that
+            keeps the cached files of all the processes up to date.
+        """
+        entry = self.get(key)
+        if entry is not None and entry.path == path and entry.mtime == os.path.getmtime(path):
+            return entry
+        return self.load(key, path)
+
+    def evict(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.size -= len(entry.data)
+
+    def evict_prefix(self, prefix):
+        """
+            Evicts all the entries whose key starts with the prefix
+        """
+        with self.lock:
+            for key in [key for key in self.entries if key[:len(prefix)] == prefix]:
+                self.evict(key)
+
+
+class LRUCache(object):
+    """
+        A least recently used cache, bounded by its number of entries.
+    """
+
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+            Returns the cached value for a key, or None if not cached
+        """
+        with self.lock:
+            value = self.entries.pop(key, None)
+            if value is not None:
+                self.entries[key] = value
+            return value
+
+    def set(self, key, value):
+        """
+            Stores a value, evicting the least recently used one if full
+        """
+        with self.lock:
+            self.entries.pop(key, None)
+            while self.entries and len(self.entries) >= self.max_items:
+                self.entries.popitem(last=False)
+            self.entries[key] = value
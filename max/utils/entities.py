@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+    Single pass extraction of the entities of a text: urls, hashtags and keywords.
+
+    Hashtags and keywords are searched at the beginning of each whitespace
+    separated word, while urls are found anywhere, also right after a hashtag
+    or keyword. A word starting with an url is only an url, so the contents of
+    urls are never hashtags nor keywords.
+"""
+from collections import namedtuple
+
+import re
+
+UNICODE_ACCEPTED_CHARS = u'áéíóúàèìòùïöüçñ'
+
+# Characters allowed in hashtags and keywords. Uppercase accented chars are included
+# as the text is not lowercased before matching, so urls keep their case.
+KEYWORD_CHARS = u'[\\w\\-\\_\\.%s%s]' % (UNICODE_ACCEPTED_CHARS, UNICODE_ACCEPTED_CHARS.upper())
+
+URL_START_PATTERN = u'(?:[hH][tT][tT][pP][sS]?://|[wW][wW][wW]\\.)'
+
+URL_PATTERN = URL_START_PATTERN + u'\\S+'
+
+# Hashtags and keywords stop where an url starts, so urls glued to a word are found
+WORD_CHAR = u'(?:(?!{url_start}){chars})'.format(url_start=URL_START_PATTERN, chars=KEYWORD_CHARS)
+
+# All the alternatives are tried at once after a whitespace, and only urls
+# are searched for inside words.
+ENTITIES_REGEX = re.compile(
+    u'(?<!\\S)(?:'
+    u'(?P<url>{url})|'
+    u'#(?P<hashtag>{word_char}+)|'
+    u'(?:#|\'|"|\\w\')?(?P<keyword>{word_char}{{3,}})["\']?'
+    u')|(?P<inner_url>{url})'.format(url=URL_PATTERN, word_char=WORD_CHAR)
+)
+
+TextEntities = namedtuple('TextEntities', ['urls', 'hashtags', 'keywords'])
+
+
+def extract_entities(text):
+    """
+        Returns the entities found in text, in one pass.
+
+        Urls are returned as (start, end) spans on text, so they can be replaced.
+        Hashtags and keywords are returned in lowercase, with hashtags of at
+        least three characters also being keywords.
+    """
+    urls = []
+    hashtags = []
+    keywords = []
+    for match in ENTITIES_REGEX.finditer(text):
+        kind = match.lastgroup
+        if kind == 'keyword':
+            keywords.append(match.group(kind).lower())
+        elif kind == 'hashtag':
+            hashtag = match.group(kind).lower()
+            hashtags.append(hashtag)
+            if len(hashtag) >= 3:
+                keywords.append(hashtag)
+        else:
+            urls.append(match.span())
+    return TextEntities(urls, hashtags, keywords)
@@ -1,38 +1,65 @@
 # -*- coding: utf-8 -*-
+from max.resources import getMAXSettings
+from max.utils.background import BackgroundTasks
+from max.utils.cache import LRUCache
+from max.utils.entities import extract_entities
+
+from bson import ObjectId
+from datetime import datetime
+from hashlib import sha1
+from pyramid.settings import asbool
+
 import json
 import re
-import requests
 import urllib2
-from max.resources import getMAXSettings
-
-UNICODE_ACCEPTED_CHARS = u'áéíóúàèìòùïöüçñ'
 
 # Inicialmente Carles habia puesto este regex FIND_URL_REGEX = r'((https?\:\/\/)|(www\.))(\S+)(\w{2,4})(:[0-9]+)?(\/|\/([\w#!:.?+=&%@!\-\/]))?'
 # pero nos da problemas con la url: http://www.businessinsider.com/r-for-egypts-entrepreneurs-going-green-makes-business-sense-2016-6
-# Hemos dejado este regex en FIND_URL_KEYWORDS_REGEX para el findKeywords que no tenemos claro para que sirve
+# Las urls, hashtags y keywords del contenido se extraen ahora en una sola pasada, ver max.utils.entities
 FIND_URL_REGEX = r'((https?\:\/\/)|(www\.))(\S+)'
-FIND_URL_KEYWORDS_REGEX = r'((https?\:\/\/)|(www\.))(\S+)(\w{2,4})(:[0-9]+)?(\/|\/([\w#!:.?+=&%@!\-\/]))?'
-FIND_HASHTAGS_REGEX = r'(\s|^)#{1}([\w\-\_\.%s]+)' % UNICODE_ACCEPTED_CHARS
-FIND_KEYWORDS_REGEX = r'(\s|^)(?:#|\'|\"|\w\')?([\w\-\_\.%s]{3,})[\"\']?' % UNICODE_ACCEPTED_CHARS
+
+# Number of shortened urls remembered in process
+SHORTENED_URLS_CACHE_SIZE = 10000
 
 
-def formatMessageEntities(request, text):
+def formatMessageEntities(request, text, urls=None):
     """
         function that shearches for elements in the text that have to be formatted.
         Currently shortens urls.
-    """
-
-    def shorten(matchobj):
-        url = matchobj.group(0)
-        settings = getMAXSettings(request)
-        bitly_username = settings.get('max_bitly_username', '')
-        bitly_api_key = settings.get('max_bitly_api_key', '')
 
-        return shortenURL(url, bitly_username, bitly_api_key, secure=request.url.startswith('https://'))
-
-    shortened = re.sub(FIND_URL_REGEX, shorten, text, flags=re.IGNORECASE)
-
-    return shortened
+        The (start, end) spans of the urls in text can be given, if already extracted.
+    """
+    if urls is None:
+        urls = extract_entities(text).urls
+    if not urls:
+        return text
+
+    shortener = get_url_shortener(request.registry)
+    settings = getMAXSettings(request)
+    bitly_username = settings.get('max_bitly_username', '')
+    bitly_api_key = settings.get('max_bitly_api_key', '')
+    secure = request.url.startswith('https://')
+
+    def shorten(url):
+        # Urls not shortened yet are left as they are, to be rewritten later
+        if shortener.tasks.enabled:
+            shortened_url = shortener.get(url, secure=secure)
+            if shortened_url is None:
+                request.environ.setdefault('max.pending_urls', set()).add(url)
+                return url
+            return shortened_url
+
+        return shortener.shorten(url, bitly_username, bitly_api_key, secure=secure)
+
+    parts = []
+    position = 0
+    for start, end in urls:
+        parts.append(text[position:start])
+        parts.append(shorten(text[start:end]))
+        position = end
+    parts.append(text[position:])
+
+    return ''.join(parts)
 
 
 def findHashtags(text):
@@ -45,21 +72,16 @@ def findHashtags(text):
         teststring = "#first # Hello i'm a #text with #hashtags but#some are not valid#  # ##double #last"
         should return ['first', 'text', 'hashtags', 'last']
     """
-    hashtags = [a.groups()[1] for a in re.finditer(FIND_HASHTAGS_REGEX, text)]
-    lowercase = [hasht.lower() for hasht in hashtags]
-    return lowercase
+    return extract_entities(text).hashtags
 
 
 def findKeywords(text):
     """
         Returns a list of valid keywords, including hashtags (without the hash),
-        excluding urls and words shorter than the defined in KEYWORD_MIN_LENGTH.
+        excluding urls and words shorter than three characters.
         Keywords are stored in lowercase.
     """
-    _text = text.lower()
-    stripped_urls = re.sub(FIND_URL_KEYWORDS_REGEX, '', _text)
-    keywords = [kw.groups()[1] for kw in re.finditer(FIND_KEYWORDS_REGEX, stripped_urls)]
-    return keywords
+    return extract_entities(text).keywords
 
 
 def shortenURL(url, bitly_username, bitly_api_key, secure=False):
@@ -82,6 +104,7 @@ def shortenURL(url, bitly_username, bitly_api_key, secure=False):
 
     queryurl = '%(api_url)s/%(version)s/%(endpoint)s?%(login)s&%(endpoint_params)s' % params
 
+    import requests
     req = requests.get(queryurl)
 
     try:
@@ -94,3 +117,107 @@ def shortenURL(url, bitly_username, bitly_api_key, secure=False):
         shortened_url = url
 
     return shortened_url
+
+
+def url_hash(url):
+    return sha1(url.encode('utf-8') if isinstance(url, unicode) else url).hexdigest()
+
+
+class URLShortener(object):
+    """
+        Shortens urls with bitly, remembering the shortened urls on the shortened_urls
+        collection, fronted by an in-process LRU cache, so each url is shortened once.
+
+        With `shortener.background` enabled, urls not shortened yet are stored as they
+        are, and the activities and messages containing them are rewritten once shortened.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.collection = registry.max_store.shortened_urls
+        self.cache = LRUCache(int(registry.settings.get('shortener.cache_size', SHORTENED_URLS_CACHE_SIZE)))
+        self.tasks = BackgroundTasks('max-shortener', asbool(registry.settings.get('shortener.background', False)))
+
+    def get(self, url, secure=False):
+        """
+            Returns the already shortened url, or None if not shortened yet
+        """
+        shortened_url = self.cache.get(url)
+        if shortened_url is None:
+            stored = self.collection.find_one({'_id': url_hash(url)}, {'shortened': 1})
+            if stored is None:
+                return None
+            shortened_url = stored['shortened']
+            self.cache.set(url, shortened_url)
+
+        return shortened_url.replace('http://', 'https://') if secure else shortened_url
+
+    def shorten(self, url, bitly_username, bitly_api_key, secure=False):
+        """
+            Returns the shortened url, shortening it with bitly if not shortened yet.
+            Urls that fail to be shortened are returned as they are, and not remembered.
+        """
+        shortened_url = self.get(url, secure=secure)
+        if shortened_url is not None:
+            return shortened_url
+
+        shortened_url = shortenURL(url, bitly_username, bitly_api_key)
+        if shortened_url != url:
+            self.collection.update_one(
+                {'_id': url_hash(url)},
+                {'$setOnInsert': {'url': url, 'shortened': shortened_url, 'published': datetime.utcnow()}},
+                upsert=True
+            )
+            self.cache.set(url, shortened_url)
+
+        return shortened_url.replace('http://', 'https://') if secure else shortened_url
+
+    def rewrite_later(self, request, collection, oid, content, parent_id=None):
+        """
+            Schedules the rewrite of the urls not shortened yet on the content of an
+            stored activity or message, once the request is finished. If a parent_id is
+            given, the comment embedded on the parent activity is rewritten too.
+        """
+        urls = [url for url in request.environ.get('max.pending_urls', ()) if url in content]
+        if not urls:
+            return
+
+        settings = getMAXSettings(request)
+        args = (
+            collection, ObjectId(oid), urls,
+            settings.get('max_bitly_username', ''), settings.get('max_bitly_api_key', ''),
+            request.url.startswith('https://'),
+            ObjectId(parent_id) if parent_id else None
+        )
+        request.add_finished_callback(lambda request: self.tasks.run(('rewrite', collection, str(oid)), self.rewrite, *args))
+
+    def rewrite(self, collection, oid, urls, bitly_username, bitly_api_key, secure, parent_id=None):
+        shortened_urls = dict([(url, self.shorten(url, bitly_username, bitly_api_key, secure=secure)) for url in urls])
+        documents = self.registry.max_store[collection]
+
+        document = documents.find_one({'_id': oid}, {'object.content': 1})
+        if document is None:
+            return
+
+        content = document['object']['content']
+        rewritten = re.sub(FIND_URL_REGEX, lambda match: shortened_urls.get(match.group(0), match.group(0)), content, flags=re.IGNORECASE)
+        if rewritten == content:
+            return
+
+        # Only rewrite if the content hasn't been modified meanwhile
+        documents.update_one({'_id': oid, 'object.content': content}, {'$set': {'object.content': rewritten}})
+        if parent_id is not None:
+            documents.update_one(
+                {'_id': parent_id, 'replies': {'$elemMatch': {'id': str(oid), 'content': content}}},
+                {'$set': {'replies.$.content': rewritten}}
+            )
+
+
+def get_url_shortener(registry):
+    """
+        Returns the url shortener of the application
+    """
+    shortener = getattr(registry, 'url_shortener', None)
+    if shortener is None:
+        shortener = registry.url_shortener = URLShortener(registry)
+    return shortener
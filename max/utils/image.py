@@ -1,7 +1,20 @@
 # -*- coding: utf-8 -*-
+from max.utils.blobs import blob_response
+from max.utils.cache import IMAGE_CACHE_SIZE
+from max.utils.cache import LRUBytesCache
+
+from pyramid.httpexceptions import HTTPGone
+from pyramid.response import Response
+
 import os
 import re
 
+# Seconds that unversioned avatar urls can be cached before revalidating
+AVATAR_MAX_AGE = 300
+
+# Seconds that versioned avatar urls, and images of activities, can be cached
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+
 
 EXIF_ROTATIONS = {
     3: 180,
@@ -30,10 +43,10 @@ SPLITTERS = {
 }
 
 
-def get_avatar_folder(base_folder, context='', identifier='', size=''):
+def get_avatar_folder(base_folder, context='', identifier='', size='', create=True):
     """
         Returns the right folder for the given parameters set, and
-        creates the folder if is missing.
+        creates the folder if is missing, unless told not to.
     """
     id_splitter = SPLITTERS.get(context)
 
@@ -52,6 +65,95 @@ def get_avatar_folder(base_folder, context='', identifier='', size=''):
 
     avatar_path = os.path.join(*avatar_path_parts)
 
-    if not os.path.exists(avatar_path):
+    if create and not os.path.exists(avatar_path):
         os.makedirs(avatar_path)
     return avatar_path.rstrip('/')
+
+
+def get_image_cache(registry):
+    """
+        Returns the in-process cache of avatars and thumbnails of the application
+    """
+    image_cache = getattr(registry, 'image_cache', None)
+    if image_cache is None:
+        image_cache = registry.image_cache = LRUBytesCache(int(registry.settings.get('image_cache_size', IMAGE_CACHE_SIZE)))
+    return image_cache
+
+
+def cached_file_response(request, cached_file, content_type, cache_max_age, public=False):
+    """
+        Returns a response for a file held in memory by the image cache, answering
+        conditional and Range requests with the validators of the cached file.
+    """
+    response = Response(body=cached_file.data, conditional_response=True, content_type=content_type)
+    response.etag = cached_file.etag
+    response.last_modified = cached_file.mtime
+    response.accept_ranges = 'bytes'
+    response.cache_control.max_age = cache_max_age
+    if public:
+        response.cache_control.public = True
+    else:
+        response.cache_control.private = True
+    return response
+
+
+def avatar_response(request, cached_file):
+    """
+        Returns a cacheable response for an avatar image.
+
+        Urls carrying the current version of the avatar on the `v` parameter can be
+        cached for as long as possible, as a new avatar will get a new version. Plain
+        urls are cached for `avatar_max_age` seconds, and revalidated with the ETag.
+    """
+    if request.params.get('v') == cached_file.etag:
+        max_age = IMMUTABLE_MAX_AGE
+    else:
+        max_age = int(request.registry.settings.get('avatar_max_age', AVATAR_MAX_AGE))
+
+    return cached_file_response(request, cached_file, 'image/png', max_age, public=True)
+
+
+def image_attachment_response(request, activity, size):
+    """
+        Returns the response for the image attached to an activity or message,
+        on the requested named size.
+
+        Thumbnails are served as WebP to clients that accept it, if available. While
+        the thumbnails are still being generated, the original image is served instead.
+        Thumbnails stored on the blob store are served from the image cache, so a cache
+        hit doesn't touch the filesystem.
+    """
+    base64 = request.headers.get('content-type', '') == 'application/base64'
+    if size == 'thumb' and activity.getBlobETag(extension='thumb-webp') and \
+       'image/webp' in request.headers.get('Accept', '') and not base64:
+        size = 'thumb-webp'
+
+    extension = size if size != 'full' else ''
+    digest = activity.getBlobETag(extension=extension)
+
+    if extension and digest is None and activity.getBlobETag() is not None:
+        image_path, mimetype = activity.getImage(size='full')
+        if image_path is None:
+            return HTTPGone()
+        return blob_response(request, image_path, mimetype, base64=base64)
+
+    cacheable = size.startswith('thumb') and digest is not None and not base64
+    image_cache = get_image_cache(request.registry)
+
+    if cacheable:
+        cached_thumb = image_cache.get(('blobs', digest))
+        if cached_thumb is None:
+            image_path, mimetype = activity.getImage(size=size)
+            if image_path is None:
+                return HTTPGone()
+            cached_thumb = image_cache.load(('blobs', digest), image_path, etag=digest)
+
+        response = cached_file_response(request, cached_thumb, 'image/webp' if size == 'thumb-webp' else 'image/jpeg', IMMUTABLE_MAX_AGE)
+        response.vary = ('Accept',)
+        return response
+
+    image_path, mimetype = activity.getImage(size=size)
+    if image_path is None:
+        return HTTPGone()
+
+    return blob_response(request, image_path, mimetype, etag=digest, base64=base64, cache_max_age=IMMUTABLE_MAX_AGE)
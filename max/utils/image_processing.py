@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+    Generation of the derived sizes of uploaded images.
+
+    By default images are processed inline on the upload request. Setting
+    `image_processing.threads` runs the processing on a gevent thread pool
+    instead, so uploads only store the original image and return right away,
+    and upload latency doesn't depend on the image resolution. Until the
+    thumbnails and avatar sizes are ready, the original image, or a
+    placeholder, is served instead.
+
+    The pool uses native threads managed by gevent, as forking processes from
+    a worker with its gevent hub and open connections to mongodb and rabbitmq
+    is unsafe, and callbacks must run on the hub, where the results are stored.
+"""
+from max import maxlogger
+from max.utils.blobs import get_blob_path
+from max.utils.blobs import store_blob
+from max.utils.image import get_avatar_folder
+from max.utils.image import rotate_image_by_EXIF
+
+from functools import partial
+from gevent.threadpool import ThreadPool
+from io import BytesIO
+from tempfile import NamedTemporaryFile
+
+import os
+import shutil
+
+IMAGE_PROCESSING_THREADS = 0
+
+THUMBNAIL_SIZE = (400, 400)
+
+AVATAR_SIZES = [
+    ('', (48, 48)),
+    ('large', (250, 250))
+]
+
+
+def encode_image(image, format, **options):
+    """
+        Returns a file-like object with the image encoded in format
+    """
+    encoded = BytesIO()
+    image.save(encoded, format, **options)
+    encoded.seek(0)
+    return encoded
+
+
+def save_image_file(path, source):
+    """
+        Writes the contents of a file-like object to path.
+
+        The file is written to a temporary file first and then moved to its
+        place, so a file being served is never found half written.
+    """
+    folder = os.path.dirname(path)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    with NamedTemporaryFile(dir=folder, delete=False) as temporary:
+        shutil.copyfileobj(source, temporary)
+    os.rename(temporary.name, path)
+
+
+def render_thumbnails(base_path, digest):
+    """
+        Generates the thumbnails of the image stored on the blob store with digest.
+
+        The thumbnail is stored as a progressive JPEG, and also as WebP if the
+        installed PIL supports it. Returns the digests of the stored thumbnails.
+    """
+    from PIL import Image
+    image = rotate_image_by_EXIF(Image.open(get_blob_path(base_path, digest)))
+    image.thumbnail(THUMBNAIL_SIZE, Image.ANTIALIAS)
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    blobs = {'thumb': store_blob(base_path, encode_image(image, 'JPEG', progressive=True, optimize=True))}
+    try:
+        blobs['thumb-webp'] = store_blob(base_path, encode_image(image, 'WEBP', quality=80))
+    except (IOError, KeyError):
+        # PIL built without WebP support
+        pass
+    return blobs
+
+
+def render_avatars(base_folder, username, original_path):
+    """
+        Generates all the named sizes of the avatar of a user from its original image
+    """
+    from PIL import Image
+    from PIL import ImageOps
+    image = Image.open(original_path)
+    for size_name, size in AVATAR_SIZES:
+        avatar = ImageOps.fit(image, size, method=Image.ANTIALIAS, centering=(0, 0))
+        avatar_folder = get_avatar_folder(base_folder, 'people', username, size=size_name)
+        save_image_file(os.path.join(avatar_folder, username), encode_image(avatar, 'PNG', optimize=True))
+    return username
+
+
+def run_image_task(task, *args):
+    """
+        Runs an image task on a pool thread, logging any error instead
+        of raising it, as there's no request to report it to.
+    """
+    try:
+        return task(*args)
+    except Exception:
+        maxlogger.exception('Error processing image on {}{}'.format(task.__name__, args))
+        return None
+
+
+def image_task_done(callback, result):
+    """
+        Calls callback with the result of a successful image task
+    """
+    if result is None:
+        return
+    try:
+        callback(result)
+    except Exception:
+        maxlogger.exception('Error storing the result of an image task')
+
+
+def get_image_pool(registry):
+    """
+        Returns the pool of image processing threads of the application,
+        or None if images are configured to be processed inline.
+    """
+    if not hasattr(registry, 'image_pool'):
+        threads = int(registry.settings.get('image_processing.threads', IMAGE_PROCESSING_THREADS))
+        registry.image_pool = ThreadPool(threads) if threads else None
+    return registry.image_pool
+
+
+def process_image(registry, task, args, callback):
+    """
+        Runs an image task on the pool, and calls callback with its result once finished.
+
+        The task must not use the request nor the database, as it runs on another
+        thread. The callback runs on the gevent hub, where the results can be stored.
+    """
+    pool = get_image_pool(registry)
+    if pool is None:
+        image_task_done(callback, run_image_task(task, *args))
+    else:
+        pool.apply_async(run_image_task, (task,) + tuple(args), callback=partial(image_task_done, callback))
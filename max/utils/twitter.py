@@ -1,15 +1,32 @@
 # -*- coding: utf-8 -*-
+from max.utils.background import BackgroundTasks
+
+from pyramid.settings import asbool
+
+from tempfile import NamedTemporaryFile
+
 import logging
-import requests
-import tweepy
+import os
+import threading
+import time
 
+# Seconds to wait before trying to authenticate again after a failure
+TWITTER_API_RETRY = 60
 
-def get_twitter_api(registry):
-    twitter_settings = registry.cloudapis_settings.get('twitter', None)
+# Seconds that a resolved twitter username id is remembered
+TWITTER_USERID_MAX_AGE = 24 * 60 * 60
+
+# Seconds that a downloaded context avatar is considered fresh
+TWITTER_AVATAR_MAX_AGE = 3 * 60 * 60
+
+
+def create_twitter_api(cloudapis_settings):
+    twitter_settings = cloudapis_settings.get('twitter', None)
 
     if twitter_settings:
         try:
             # Twitter auth
+            import tweepy
             auth = tweepy.OAuthHandler(twitter_settings.get('consumer_key', ''), twitter_settings.get('consumer_secret', ''))
             auth.set_access_token(twitter_settings.get('access_token', ''), twitter_settings.get('access_token_secret', ''))
             api = tweepy.API(auth)
@@ -20,8 +37,85 @@ def get_twitter_api(registry):
             return None
 
 
+class TwitterClient(object):
+    """
+        Memoized access to the twitter api, shared by all the requests of the application.
+
+        Credentials are verified only once, and resolved username ids are remembered.
+        Lookups are run on a background thread, so requests never wait for twitter,
+        unless `twitter.background` is disabled, then they run inline.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.api = None
+        self.api_checked = None
+        self.userids = {}
+        self.tasks = BackgroundTasks('max-twitter', asbool(registry.settings.get('twitter.background', True)))
+        self.lock = threading.Lock()
+
+    def get_api(self):
+        """
+            Returns an authenticated api, or None if twitter is not available.
+        """
+        with self.lock:
+            if self.api is None and (self.api_checked is None or time.time() - self.api_checked > TWITTER_API_RETRY):
+                self.api_checked = time.time()
+                self.api = create_twitter_api(self.registry.cloudapis_settings)
+            return self.api
+
+    def get_userid(self, username, lookup=True):
+        """
+            Returns the twitter id of a username, remembered from previous lookups.
+            Unknown usernames are looked up on twitter, unless told not to.
+        """
+        userid, resolved = self.userids.get(username.lower(), (None, 0))
+        if time.time() - resolved < TWITTER_USERID_MAX_AGE or not lookup:
+            return userid
+
+        userid = get_userid_from_twitter(self.get_api(), username)
+        if userid:
+            self.userids[username.lower()] = (userid, time.time())
+        return userid
+
+    def refresh_avatar(self, username, filename):
+        """
+            Downloads the avatar of a twitter username to filename
+        """
+        self.tasks.run(('avatar', filename), self.download_avatar, username, filename)
+
+    def download_avatar(self, username, filename):
+        return download_twitter_user_image(self.get_api(), username, filename)
+
+
+def get_twitter_client(registry):
+    """
+        Returns the twitter client of the application
+    """
+    twitter = getattr(registry, 'twitter_client', None)
+    if twitter is None:
+        twitter = registry.twitter_client = TwitterClient(registry)
+    return twitter
+
+
+def get_twitter_api(registry):
+    return get_twitter_client(registry).get_api()
+
+
+def avatar_needs_refresh(filename):
+    """
+        Checks if a downloaded avatar is missing or older than the
+        time twitter avatars are considered fresh.
+    """
+    if not os.path.exists(filename):
+        return True
+    return time.time() - os.path.getmtime(filename) > TWITTER_AVATAR_MAX_AGE
+
+
 def download_twitter_user_image(api, twitterUsername, filename):
     """
+        Downloads the profile image of a twitter user. The image is written
+        to a temporary file and moved in place, to never serve it half written.
     """
     exit_status = False
     if api:
@@ -29,9 +123,12 @@ def download_twitter_user_image(api, twitterUsername, filename):
         image_url = getattr(user, 'profile_image_url_https', None)
 
         if image_url:
+            import requests
             req = requests.get(image_url, verify=False)
             if req.status_code == 200:
-                open(filename, 'w').write(req.content)
+                with NamedTemporaryFile(dir=os.path.dirname(filename), delete=False) as image:
+                    image.write(req.content)
+                os.rename(image.name, filename)
                 exit_status = True
 
     if not exit_status:
@@ -44,4 +141,3 @@ def get_userid_from_twitter(api, twitterUsername):
     if api:
         user = api.get_user(twitterUsername)
         return user.id_str
-
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+from max.models import User
+
+import json
+import time
+
+IMPORT_BATCH_SIZE = 1000
+
+
+def read_users_stream(lines):
+    """
+        Parses a JSONL stream of users, one json object per line.
+
+        Yields a (line_number, user_data, error) tuple for each non-empty line,
+        where user_data is None and error is set if the line couldn't be decoded.
+    """
+    for line_number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            user_data = json.loads(line)
+        except ValueError:
+            yield line_number, None, 'Invalid json'
+        else:
+            yield line_number, user_data, None
+
+
+def import_users(request, lines, creator=None, notifications=True, batch_size=IMPORT_BATCH_SIZE):
+    """
+        Imports users from a JSONL stream in batches, using User.bulk_insert.
+
+        Returns a report with the count of created, existing and invalid users, the
+        errors found on each failed line, and the achieved throughput.
+    """
+    report = {
+        'created': 0,
+        'existing': 0,
+        'invalid': 0,
+        'errors': [],
+    }
+
+    def flush(batch):
+        users_data = [user_data for line_number, user_data in batch]
+        line_numbers = {id(user_data): line_number for line_number, user_data in batch}
+        created, existing, invalid = User.bulk_insert(request, users_data, creator=creator, notifications=notifications)
+        report['created'] += len(created)
+        report['existing'] += len(existing)
+        report['invalid'] += len(invalid)
+        for user_data, error in invalid:
+            report['errors'].append({'line': line_numbers[id(user_data)], 'error': error})
+
+    start = time.time()
+    batch = []
+    for line_number, user_data, error in read_users_stream(lines):
+        if error:
+            report['invalid'] += 1
+            report['errors'].append({'line': line_number, 'error': error})
+            continue
+
+        batch.append((line_number, user_data))
+        if len(batch) == batch_size:
+            flush(batch)
+            batch = []
+
+    if batch:
+        flush(batch)
+
+    elapsed = time.time() - start
+    processed = report['created'] + report['existing'] + report['invalid']
+    report['elapsed'] = round(elapsed, 3)
+    report['users_per_second'] = round(processed / elapsed, 1) if elapsed else processed
+    return report
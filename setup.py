@@ -14,7 +14,7 @@ requires = [
     'pyramid_tm',
     'pyramid_debugtoolbar',
     'pyramid_beaker',
-    'pymongo',
+    'pymongo>=3.6',
     'rfc3339',
     'requests',
     'tweepy',
@@ -56,5 +56,9 @@ setup(name='max',
       entry_points="""
       [paste.app_factory]
       main = max:main
+      [console_scripts]
+      max-import-users = max.scripts.import_users:main
+      max-maintenance = max.scripts.maintenance:main
+      max-maintenance-worker = max.scripts.maintenance_worker:main
       """,
       )